@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- pairing engine and standings benchmarks
+#
+# Plays simulated Swiss events in memory (no database needed) and times
+# every pairing engine on each round:
+#
+#   python benchmark.py
+#   python benchmark.py 64 1000
+#
+# Compares the read latency of the materialized standings with the
+# winners/losers view join they replace (wipes the database):
+#
+#   python benchmark.py standings
+#   python benchmark.py standings 1000 100000
+#
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+import pairing
+
+SIZES = [64, 1000, 10000]
+ROUNDS = 6
+STANDINGS_SIZES = [1000, 10000, 100000]
+READS = 20
+
+# playerStandings before the standings table
+VIEW_JOIN_QUERY = """
+    select
+        id, name,
+        COALESCE(wins, 0) as wins,
+        COALESCE(wins, 0) + COALESCE(losses, 0) as matches
+    from
+        players
+            left join winners on players.id = winners.winner
+            left join losers on players.id = losers.loser
+    order by
+        wins desc;
+"""
+
+
+def simulate(num_players, rounds=ROUNDS, seed=2015):
+    """Times each engine on every round of a simulated event.
+
+    Results are random; the rounds themselves are paired with the matching
+    engine so that every engine sees the same history.
+    """
+    rng = random.Random(seed)
+    wins = dict((x, 0) for x in range(num_players))
+    played = dict((x, set()) for x in range(num_players))
+    for round_number in range(1, rounds + 1):
+        standings = sorted(((x, str(x), wins[x], round_number - 1) for x in wins),
+                           key=lambda row: (-row[2], row[0]))
+        pairs = None
+        for engine in sorted(pairing.ENGINES):
+            options = dict()
+            if engine == 'lookahead':
+                options['rounds_left'] = rounds - round_number + 1
+            start = time.time()
+            try:
+                result = pairing.pair(standings, played, engine=engine, **options)
+                outcome = 'ok'
+            except ValueError:
+                result = None
+                outcome = 'stuck'
+            elapsed = time.time() - start
+            print("{0:>6} players  round {1}  {2:<9} {3:8.3f}s  {4}".format(
+                num_players, round_number, engine, elapsed, outcome))
+            if engine == 'matching':
+                pairs = result
+        for (p1, _, p2, _) in pairs:
+            if p2 == pairing.BYE:
+                wins[p1] += 1
+                continue
+            winner = p1 if rng.random() < 0.5 else p2
+            wins[winner] += 1
+            played[p1].add(p2)
+            played[p2].add(p1)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def timedReads(c, query, reads=READS):
+    """Median seconds of reads executions of query, rows fetched."""
+    times = list()
+    for x in range(reads):
+        start = time.time()
+        c.execute(query)
+        c.fetchall()
+        times.append(time.time() - start)
+    return median(times)
+
+
+def benchStandings(num_players, rounds=ROUNDS, seed=2015):
+    """Read latency of the materialized standings and of the view join.
+
+    Plays rounds of random results and refreshes the standings after each
+    one, like swissPairings does.  The standings are read right after the
+    last refresh and once more with another round in the tail.
+    """
+    import tournament
+
+    rng = random.Random(seed)
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    db = tournament.connect()
+    c = db.cursor()
+    c.execute("insert into players (name) select 'Player ' || x from generate_series(1, %s) as x", (num_players, ))
+    c.execute("select id from players")
+    ids = [row[0] for row in c.fetchall()]
+    db.commit()
+
+    def playRound():
+        rng.shuffle(ids)
+        values = ','.join(c.mogrify('(%s, %s)', (ids[x], ids[x + 1])) for x in range(0, len(ids) - 1, 2))
+        c.execute("insert into matches (winner, loser) values " + values)
+        db.commit()
+
+    for round_number in range(rounds):
+        playRound()
+        start = time.time()
+        tournament.refreshStandings()
+        refresh_time = time.time() - start
+    c.execute("analyze")
+    db.commit()
+    view_join = timedReads(c, VIEW_JOIN_QUERY)
+    refreshed = timedReads(c, tournament.STANDINGS_QUERY)
+    playRound()
+    tail = timedReads(c, tournament.STANDINGS_QUERY)
+    db.close()
+    print("standings {0:>7} players {1:>8} matches  view join {2:7.4f}s  materialized {3:7.4f}s  "
+          "with a round to refresh {4:7.4f}s  refresh {5:7.4f}s".format(
+              num_players, rounds * (num_players // 2), view_join, refreshed, tail, refresh_time))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['standings']:
+        for size in [int(size) for size in sys.argv[2:]] or STANDINGS_SIZES:
+            benchStandings(size)
+        sys.exit()
+    sizes = [int(size) for size in sys.argv[1:]] or SIZES
+    for size in sizes:
+        simulate(size)
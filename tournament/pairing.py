@@ -0,0 +1,766 @@
+#!/usr/bin/env python
+#
+# pairing.py -- pairing engines for swissPairings
+#
+# An engine takes the current standings and the opponents every player has
+# already met, and returns the pairs for the next round:
+#
+#   engine(standings, played, had_bye=()) -> [(id1, name1, id2, name2), ...]
+#
+#   standings: list of (id, name, wins, matches) tuples, best player first
+#   played: dict of player id -> set of opponent ids
+#   had_bye: ids of players who already had a bye
+#
+# With an odd number of players one pair is (id, name, 'bye', 'bye').
+#
+
+import heapq
+import itertools
+import time
+import warnings
+
+BYE = 'bye'
+
+
+def greedyPairings(standings, played, had_bye=()):
+    """The original pairer.
+
+    Walks down the standings and pairs every player with the first player
+    below him or her that they have not met yet.  Fast, but it can paint
+    itself into a corner and raise ValueError although a pairing exists.
+    """
+    standings, bye = _takeBye(standings, had_bye)
+    count = len(standings)
+    assigned = set()
+    pairs = list()
+    for x in range(count):
+        p1_id = standings[x][0]
+        p1_name = standings[x][1]
+        if p1_id in assigned:
+            continue
+        candidate_found = False
+        for y in range(x+1, count):
+            p2_id = standings[y][0]
+            p2_name = standings[y][1]
+            if p2_id in assigned:
+                continue
+            if p2_id not in played.get(p1_id, ()):
+                candidate_found = True
+                pairs.append((p1_id, p1_name, p2_id, p2_name))
+                assigned.add(p2_id)
+                break
+        if not candidate_found:
+            raise ValueError("unable to find a new opponent for player {0}".format(p1_name))
+    return pairs + bye
+
+
+def matchingPairings(standings, played, had_bye=(), block_size=16):
+    """Pairs players with a minimum cost perfect matching.
+
+    Players who already met are never paired again.  Among the remaining
+    pairings the engine minimizes the sum of squared score differences, and
+    then the distance between the two players in the standings, so without
+    rematches to avoid it pairs neighbours (1st-2nd, 3rd-4th, ...) exactly
+    like swissPairings_old.
+
+    For speed, neighbours are paired directly until the first rematch in the
+    standings; from there on the next block_size players are matched with
+    the weighted matching, and whoever cannot be paired inside the block
+    floats down into the next one, like in a score bracket.  If the last
+    block cannot be completed it is merged with the blocks above it and
+    matched again.  block_size=None matches the whole field at once (exact,
+    but cubic in the number of players).
+
+    Raises ValueError if no pairing without rematches exists.
+    """
+    if len(standings) % 2 == 0:
+        return _matchBlocks(standings, played, block_size)
+    # the bye goes to the lowest ranked player who has not had one yet, as
+    # long as the rest of the field can still be paired
+    for x in reversed(range(len(standings))):
+        if standings[x][0] in had_bye:
+            continue
+        rest = standings[:x] + standings[x+1:]
+        try:
+            pairs = _matchBlocks(rest, played, block_size)
+        except ValueError:
+            continue
+        return pairs + [(standings[x][0], standings[x][1], BYE, BYE)]
+    raise ValueError("unable to find a pairing with a bye for an odd number of players")
+
+
+def lookaheadPairings(standings, played, had_bye=(), rounds_left=1, time_budget=1.0, block_size=16):
+    """Pairs the round like matchingPairings, without spoiling later rounds.
+
+    A pairing without rematches for this round can still leave the bottom
+    players with nobody new to play a round or two later.  This engine only
+    returns a pairing after which all the remaining rounds can be completed
+    without rematches (and without a second bye for anyone).
+
+    In the usual case the check is cheap: while every player can still meet
+    more than half the field in the remaining rounds, every one of those
+    rounds has a perfect matching left whatever is paired now (Dirac's
+    theorem).  Otherwise the pairings of this round are tried best first,
+    and for each one a backtracking search looks for the pairings of all
+    the rounds after it.
+
+    Args:
+      rounds_left: rounds still to play, this one included.
+      time_budget: seconds to spend on the search.  If they run out before
+        a pairing is proven safe, the best pairing for this round alone is
+        returned with a RuntimeWarning.
+      block_size: see matchingPairings.
+
+    Raises ValueError if no pairing of this round leaves the remaining rounds
+    a pairing without rematches.
+    """
+    deadline = time.time() + time_budget
+    best = matchingPairings(standings, played, had_bye, block_size)
+    if rounds_left <= 1:
+        return best
+    if _dirac(rounds_left, *_degrees(standings, played, had_bye)):
+        return best
+    graph = _openGraph(standings, played, had_bye)
+
+    ranks = dict((row[0], x) for (x, row) in enumerate(standings))
+    counter = itertools.count()
+    seen = set([_pairKeys(best)])
+    heap = [(_pairingCost(ranks, standings, best), next(counter), best, frozenset())]
+    try:
+        while heap:
+            _, _, pairs, excluded = heapq.heappop(heap)
+            edges = [(id1, id2) for (id1, _, id2, _) in pairs]
+            if _completes(_withoutEdges(graph, edges), rounds_left - 1, deadline):
+                return pairs
+            # the next best pairings each avoid one more of the pairs of this one
+            for key in _pairKeys(pairs) - excluded:
+                _checkDeadline(deadline)
+                candidate_excluded = excluded | frozenset([key])
+                try:
+                    candidate = matchingPairings(standings, *_exclude(played, had_bye, candidate_excluded),
+                                                 block_size=block_size)
+                except ValueError:
+                    continue
+                candidate_key = _pairKeys(candidate)
+                if candidate_key in seen:
+                    continue
+                seen.add(candidate_key)
+                heapq.heappush(heap, (_pairingCost(ranks, standings, candidate), next(counter), candidate,
+                                      candidate_excluded))
+    except _OutOfTime:
+        warnings.warn("could not make sure within {0}s that the remaining {1} rounds can be paired".format(
+            time_budget, rounds_left - 1), RuntimeWarning)
+        return best
+    raise ValueError("unable to find a pairing that lets the remaining {0} rounds be paired without "
+                     "rematches".format(rounds_left - 1))
+
+
+ENGINES = {
+    'greedy': greedyPairings,
+    'matching': matchingPairings,
+    'lookahead': lookaheadPairings,
+}
+
+
+def pair(standings, played, had_bye=(), engine='matching', **options):
+    """Pairs the next round with the named (or given) engine.
+
+    Args:
+      engine: a name from ENGINES, or any callable with the engine signature.
+      options: extra keyword arguments for the engine (e.g. block_size).
+    """
+    if not callable(engine):
+        engine = ENGINES[engine]
+    return engine(standings, played, had_bye, **options)
+
+
+def _takeBye(standings, had_bye):
+    """Splits off the lowest ranked player without a bye when the count is odd."""
+    if len(standings) % 2 == 0:
+        return standings, []
+    for x in reversed(range(len(standings))):
+        if standings[x][0] not in had_bye:
+            bye = [(standings[x][0], standings[x][1], BYE, BYE)]
+            return standings[:x] + standings[x+1:], bye
+    raise ValueError("Unable to setup bye match, every players already had bye match")
+
+
+def _matchBlocks(standings, played, block_size):
+    count = len(standings)
+    if not block_size or block_size >= count:
+        pairs, floaters = _matchPlayers(standings, played, perfect=True)
+        if floaters:
+            raise ValueError("unable to find a pairing without rematches")
+        return pairs
+    # every entry is (players of the block, pairs found in the block)
+    blocks = list()
+    floaters = list()
+    start = 0
+    while start < count:
+        # pair neighbours directly up to the first rematch
+        while not floaters and start + 1 < count and \
+                standings[start+1][0] not in played.get(standings[start][0], ()):
+            p1, p2 = standings[start], standings[start+1]
+            blocks.append(([p1, p2], [(p1[0], p1[1], p2[0], p2[1])]))
+            start += 2
+        if start >= count:
+            break
+        players = floaters + standings[start:start+block_size]
+        start += block_size
+        last = start >= count
+        pairs, floaters = _matchPlayers(players, played, perfect=last)
+        while floaters and last:
+            if not blocks:
+                raise ValueError("unable to find a pairing without rematches")
+            # merge with the blocks above and try again
+            merged = list()
+            while blocks and len(merged) < block_size:
+                above, _ = blocks.pop()
+                merged = above + merged
+            ids = set(p[0] for p in merged)
+            players = merged + [p for p in players if p[0] not in ids]
+            pairs, floaters = _matchPlayers(players, played, perfect=True)
+        blocks.append((players, pairs))
+    return [pair for _, pairs in blocks for pair in pairs]
+
+
+def _matchPlayers(players, played, perfect):
+    """Matches a block of players.
+
+    Returns:
+      (pairs, floaters): the pairs found, and the players left unpaired, in
+      standings order.  With perfect=True floaters is only non-empty when no
+      perfect matching exists.
+    """
+    count = len(players)
+    neighbours_ok = count % 2 == 0 or not perfect
+    pairs = list()
+    for x in range(0, count - 1, 2):
+        if players[x+1][0] in played.get(players[x][0], ()):
+            neighbours_ok = False
+            break
+        pairs.append((players[x][0], players[x][1], players[x+1][0], players[x+1][1]))
+    if neighbours_ok:
+        # neighbours in the standings are the cheapest pairing there is
+        return pairs, players[len(pairs) * 2:]
+
+    scale = count * count + 1
+    max_cost = 0
+    costs = list()
+    for i in range(count):
+        met = played.get(players[i][0], ())
+        for j in range(i + 1, count):
+            if players[j][0] in met:
+                continue
+            score_gap = players[i][2] - players[j][2]
+            cost = score_gap * score_gap * scale + (j - i)
+            max_cost = max(max_cost, cost)
+            costs.append((i, j, cost))
+    edges = [(i, j, max_cost + 1 - cost) for (i, j, cost) in costs]
+    mate = maxWeightMatching(edges, maxcardinality=True)
+    mate += [-1] * (count - len(mate))
+    pairs = [(players[i][0], players[i][1], players[mate[i]][0], players[mate[i]][1])
+             for i in range(count) if mate[i] > i]
+    floaters = [players[i] for i in range(count) if mate[i] == -1]
+    return pairs, floaters
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def _checkDeadline(deadline):
+    if time.time() > deadline:
+        raise _OutOfTime()
+
+
+def _openGraph(standings, played, had_bye):
+    """Returns {vertex: set of vertices} of the pairs that can still be played.
+
+    With an odd number of players the bye is a vertex too, next to every
+    player who has not had one yet.
+    """
+    field = set(row[0] for row in standings)
+    graph = dict((x, field.difference(played.get(x, ())).difference([x])) for x in field)
+    if len(field) % 2:
+        graph[BYE] = field.difference(had_bye)
+        for x in graph[BYE]:
+            graph[x].add(BYE)
+    return graph
+
+
+def _withoutEdges(graph, edges):
+    graph = dict((x, set(neighbours)) for (x, neighbours) in graph.items())
+    for (x, y) in edges:
+        graph[x].discard(y)
+        graph[y].discard(x)
+    return graph
+
+
+def _degrees(standings, played, had_bye):
+    """Returns (smallest degree, vertices) of the graph of _openGraph, without building it."""
+    field = set(row[0] for row in standings)
+    degrees = [len(field) - 1 - len(field.intersection(played.get(x, ()))) for x in field]
+    if len(field) % 2 == 0:
+        return min(degrees), len(field)
+    byes = field.difference(had_bye)
+    degrees = [degree + (x in byes) for (x, degree) in zip(field, degrees)]
+    return min(degrees + [len(byes)]), len(field) + 1
+
+
+def _dirac(rounds, min_degree, vertices):
+    """Whether the degrees alone prove that rounds more rounds can be paired.
+
+    A graph with an even number of vertices, each next to at least half of
+    them, has a perfect matching; taking one away lowers every degree by one.
+    """
+    return (min_degree - (rounds - 1)) * 2 >= vertices
+
+
+def _completes(graph, rounds, deadline):
+    """Whether rounds perfect matchings without common edges exist in graph."""
+    if rounds <= 0 or not graph:
+        return True
+    if min(len(neighbours) for neighbours in graph.values()) < rounds:
+        return False
+    if _dirac(rounds, min(len(neighbours) for neighbours in graph.values()), len(graph)):
+        return True
+    for matching in _perfectMatchings(graph, set(graph), deadline):
+        if _completes(_withoutEdges(graph, matching), rounds - 1, deadline):
+            return True
+    return False
+
+
+def _perfectMatchings(graph, free, deadline):
+    """Yields the perfect matchings of the free vertices, most constrained vertex first."""
+    if not free:
+        yield []
+        return
+    _checkDeadline(deadline)
+    x = min(free, key=lambda v: len(graph[v] & free))
+    for y in sorted(graph[x] & free, key=lambda v: len(graph[v] & free)):
+        for matching in _perfectMatchings(graph, free - set([x, y]), deadline):
+            yield [(x, y)] + matching
+
+
+def _pairKeys(pairs):
+    return frozenset(frozenset([id1, id2]) for (id1, _, id2, _) in pairs)
+
+
+def _exclude(played, had_bye, keys):
+    """Returns played and had_bye as if the pairs in keys had been played."""
+    played = dict((x, set(opponents)) for (x, opponents) in played.items())
+    had_bye = set(had_bye)
+    for key in keys:
+        x, y = sorted(key, key=lambda v: v == BYE)
+        if y == BYE:
+            had_bye.add(x)
+        else:
+            played.setdefault(x, set()).add(y)
+            played.setdefault(y, set()).add(x)
+    return played, had_bye
+
+
+def _pairingCost(ranks, standings, pairs):
+    """The cost matchingPairings minimizes, with the bye costing its distance to the bottom."""
+    count = len(standings)
+    scale = count * count + 1
+    cost = 0
+    for (id1, _, id2, _) in pairs:
+        if id2 == BYE:
+            cost += count - 1 - ranks[id1]
+            continue
+        i, j = ranks[id1], ranks[id2]
+        score_gap = standings[i][2] - standings[j][2]
+        cost += score_gap * score_gap * scale + abs(j - i)
+    return cost
+
+
+def maxWeightMatching(edges, maxcardinality=False):
+    """Computes a maximum weight matching of a general graph.
+
+    Edmonds' blossom algorithm with a primal-dual method, O(n^3).  This
+    follows the well known formulation by Galil ("Efficient algorithms for
+    finding maximum matching in graphs", 1986) and the structure of Joris van
+    Rantwijk's public domain mwmatching.py.
+
+    Args:
+      edges: a list of (i, j, weight) tuples, vertices numbered from 0.
+      maxcardinality: only consider maximum cardinality matchings, and
+        return the heaviest of those.
+
+    Returns:
+      A list mate, where mate[i] is the vertex matched to i, or -1.
+    """
+    if not edges:
+        return []
+
+    nedge = len(edges)
+    nvertex = 0
+    for (i, j, w) in edges:
+        assert i >= 0 and j >= 0 and i != j
+        if i >= nvertex:
+            nvertex = i + 1
+        if j >= nvertex:
+            nvertex = j + 1
+    maxweight = max(0, max([w for (i, j, w) in edges]))
+    integer_weights = all(isinstance(w, int) for (i, j, w) in edges)
+
+    # endpoint[p] is the vertex of endpoint p; edge k has endpoints 2k and 2k+1
+    endpoint = [edges[p // 2][p % 2] for p in range(2 * nedge)]
+    # neighbend[v] lists the remote endpoints of the edges incident to v
+    neighbend = [[] for i in range(nvertex)]
+    for k in range(nedge):
+        (i, j, w) = edges[k]
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    # mate[v] is the remote endpoint of v's matched edge, or -1
+    mate = nvertex * [-1]
+    # labels of top-level blossoms: 0 free, 1 S, 2 T (5 is a breadcrumb)
+    label = (2 * nvertex) * [0]
+    labelend = (2 * nvertex) * [-1]
+    inblossom = list(range(nvertex))
+    blossomparent = (2 * nvertex) * [-1]
+    blossomchilds = (2 * nvertex) * [None]
+    blossombase = list(range(nvertex)) + nvertex * [-1]
+    blossomendps = (2 * nvertex) * [None]
+    bestedge = (2 * nvertex) * [-1]
+    blossombestedges = (2 * nvertex) * [None]
+    unusedblossoms = list(range(nvertex, 2 * nvertex))
+    dualvar = nvertex * [maxweight] + nvertex * [0]
+    allowedge = nedge * [False]
+    queue = []
+
+    def slack(k):
+        (i, j, w) = edges[k]
+        return dualvar[i] + dualvar[j] - 2 * w
+
+    def blossomLeaves(b):
+        if b < nvertex:
+            yield b
+        else:
+            for t in blossomchilds[b]:
+                if t < nvertex:
+                    yield t
+                else:
+                    for v in blossomLeaves(t):
+                        yield v
+
+    def assignLabel(w, t, p):
+        b = inblossom[w]
+        label[w] = label[b] = t
+        labelend[w] = labelend[b] = p
+        bestedge[w] = bestedge[b] = -1
+        if t == 1:
+            queue.extend(blossomLeaves(b))
+        elif t == 2:
+            base = blossombase[b]
+            assignLabel(endpoint[mate[base]], 1, mate[base] ^ 1)
+
+    def scanBlossom(v, w):
+        # trace back from v and w to find a new blossom or an augmenting path
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if labelend[b] == -1:
+                v = -1
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def addBlossom(base, k):
+        (v, w, wt) = edges[k]
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        while bv != bb:
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+        while bw != bb:
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        for v in blossomLeaves(b):
+            if label[inblossom[v]] == 2:
+                queue.append(v)
+            inblossom[v] = b
+        # compute the least-slack edges from the new blossom to other S-blossoms
+        bestedgeto = (2 * nvertex) * [-1]
+        for bv in path:
+            if blossombestedges[bv] is None:
+                nblists = [[p // 2 for p in neighbend[v]] for v in blossomLeaves(bv)]
+            else:
+                nblists = [blossombestedges[bv]]
+            for nblist in nblists:
+                for k in nblist:
+                    (i, j, wt) = edges[k]
+                    if inblossom[j] == b:
+                        i, j = j, i
+                    bj = inblossom[j]
+                    if (bj != b and label[bj] == 1 and
+                            (bestedgeto[bj] == -1 or slack(k) < slack(bestedgeto[bj]))):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = [k for k in bestedgeto if k != -1]
+        bestedge[b] = -1
+        for k in blossombestedges[b]:
+            if bestedge[b] == -1 or slack(k) < slack(bestedge[b]):
+                bestedge[b] = k
+
+    def expandBlossom(b, endstage):
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < nvertex:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                expandBlossom(s, endstage)
+            else:
+                for v in blossomLeaves(s):
+                    inblossom[v] = s
+        if (not endstage) and label[b] == 2:
+            # relabel the sub-blossoms on the even path through the blossom
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            j = blossomchilds[b].index(entrychild)
+            if j & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            p = labelend[b]
+            while j != 0:
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[blossomendps[b][j - endptrick] ^ endptrick ^ 1]] = 0
+                assignLabel(endpoint[p ^ 1], 2, p)
+                allowedge[blossomendps[b][j - endptrick] // 2] = True
+                j += jstep
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                allowedge[p // 2] = True
+                j += jstep
+            bv = blossomchilds[b][j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            j += jstep
+            while blossomchilds[b][j] != entrychild:
+                bv = blossomchilds[b][j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                for v in blossomLeaves(bv):
+                    if label[v] != 0:
+                        break
+                if label[v] != 0:
+                    label[v] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assignLabel(v, 2, labelend[v])
+                j += jstep
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augmentBlossom(b, v):
+        # swap matched and unmatched edges along the path from v to the base
+        t = v
+        while blossomparent[t] != b:
+            t = blossomparent[t]
+        if t >= nvertex:
+            augmentBlossom(t, v)
+        i = j = blossomchilds[b].index(t)
+        if i & 1:
+            j -= len(blossomchilds[b])
+            jstep = 1
+            endptrick = 0
+        else:
+            jstep = -1
+            endptrick = 1
+        while j != 0:
+            j += jstep
+            t = blossomchilds[b][j]
+            p = blossomendps[b][j - endptrick] ^ endptrick
+            if t >= nvertex:
+                augmentBlossom(t, endpoint[p])
+            j += jstep
+            t = blossomchilds[b][j]
+            if t >= nvertex:
+                augmentBlossom(t, endpoint[p ^ 1])
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+        blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augmentMatching(k):
+        (v, w, wt) = edges[k]
+        for (s, p) in ((v, 2 * k + 1), (w, 2 * k)):
+            while True:
+                bs = inblossom[s]
+                if bs >= nvertex:
+                    augmentBlossom(bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    break
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if bt >= nvertex:
+                    augmentBlossom(bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    for stage in range(nvertex):
+        label[:] = (2 * nvertex) * [0]
+        bestedge[:] = (2 * nvertex) * [-1]
+        blossombestedges[nvertex:] = nvertex * [None]
+        allowedge[:] = nedge * [False]
+        queue[:] = []
+        for v in range(nvertex):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assignLabel(v, 1, -1)
+
+        augmented = False
+        while True:
+            while queue and not augmented:
+                v = queue.pop()
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    if inblossom[v] == inblossom[w]:
+                        continue
+                    if not allowedge[k]:
+                        kslack = slack(k)
+                        if kslack <= 0:
+                            allowedge[k] = True
+                    if allowedge[k]:
+                        if label[inblossom[w]] == 0:
+                            assignLabel(w, 2, p ^ 1)
+                        elif label[inblossom[w]] == 1:
+                            base = scanBlossom(v, w)
+                            if base >= 0:
+                                addBlossom(base, k)
+                            else:
+                                augmentMatching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            label[w] = 2
+                            labelend[w] = p ^ 1
+                    elif label[inblossom[w]] == 1:
+                        b = inblossom[v]
+                        if bestedge[b] == -1 or kslack < slack(bestedge[b]):
+                            bestedge[b] = k
+                    elif label[w] == 0:
+                        if bestedge[w] == -1 or kslack < slack(bestedge[w]):
+                            bestedge[w] = k
+            if augmented:
+                break
+
+            # no augmenting path yet: update the dual variables
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+            if not maxcardinality:
+                deltatype = 1
+                delta = min(dualvar[:nvertex])
+            for v in range(nvertex):
+                if label[inblossom[v]] == 0 and bestedge[v] != -1:
+                    d = slack(bestedge[v])
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[v]
+            for b in range(2 * nvertex):
+                if blossomparent[b] == -1 and label[b] == 1 and bestedge[b] != -1:
+                    kslack = slack(bestedge[b])
+                    d = kslack // 2 if integer_weights else kslack / 2.0
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[b]
+            for b in range(nvertex, 2 * nvertex):
+                if (blossombase[b] >= 0 and blossomparent[b] == -1 and label[b] == 2 and
+                        (deltatype == -1 or dualvar[b] < delta)):
+                    delta = dualvar[b]
+                    deltatype = 4
+                    deltablossom = b
+            if deltatype == -1:
+                # no further improvement possible; optimum reached
+                deltatype = 1
+                delta = max(0, min(dualvar[:nvertex]))
+
+            for v in range(nvertex):
+                if label[inblossom[v]] == 1:
+                    dualvar[v] -= delta
+                elif label[inblossom[v]] == 2:
+                    dualvar[v] += delta
+            for b in range(nvertex, 2 * nvertex):
+                if blossombase[b] >= 0 and blossomparent[b] == -1:
+                    if label[b] == 1:
+                        dualvar[b] += delta
+                    elif label[b] == 2:
+                        dualvar[b] -= delta
+
+            if deltatype == 1:
+                break
+            elif deltatype == 2:
+                allowedge[deltaedge] = True
+                (i, j, wt) = edges[deltaedge]
+                if label[inblossom[i]] == 0:
+                    i, j = j, i
+                queue.append(i)
+            elif deltatype == 3:
+                allowedge[deltaedge] = True
+                (i, j, wt) = edges[deltaedge]
+                queue.append(i)
+            elif deltatype == 4:
+                expandBlossom(deltablossom, False)
+
+        if not augmented:
+            break
+
+        # end of a stage: expand all S-blossoms which have a zero dual
+        for b in range(nvertex, 2 * nvertex):
+            if (blossomparent[b] == -1 and blossombase[b] >= 0 and
+                    label[b] == 1 and dualvar[b] == 0):
+                expandBlossom(b, True)
+
+    for v in range(nvertex):
+        if mate[v] >= 0:
+            mate[v] = endpoint[mate[v]]
+    return mate
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# pool.py -- thread aware connection pool for the tournament databases
+#
+
+import contextlib
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+class ConnectionPool(object):
+    """A bounded pool of PostgreSQL connections.
+
+    Connections are checked out per thread: a thread that already holds a
+    connection gets the same one back from getconn(), so a decorated function
+    calling another decorated function keeps working inside one connection.
+    The connection only goes back to the pool once the outermost caller
+    returns it.
+
+    Args:
+      dsn: libpq connection string, e.g. "dbname=tournament_extra".
+      size: maximum number of open connections.
+      health_check: check idle connections before handing them out.  Closed
+        or broken connections are always replaced; connections idle for more
+        than ping_after seconds are also pinged with "select 1".
+      ping_after: idle time (in seconds) after which a connection is pinged.
+      timeout: seconds to wait for a free connection once the pool is
+        exhausted, None to wait forever.
+      events: a metrics.MetricsSink told about every connection the pool
+        opens and closes, or None.
+      read_only: open read only connections in autocommit mode, for queries
+        that need no transaction of their own; their connection class
+        defaults to ReadOnlyConnection.
+      connect_kwargs: extra keyword arguments for psycopg2.connect().
+    """
+
+    def __init__(self, dsn, size=10, health_check=True, ping_after=30,
+                 timeout=None, events=None, read_only=False, **connect_kwargs):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.dsn = dsn
+        self.size = size
+        self.health_check = health_check
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self.events = events
+        self.read_only = read_only
+        if read_only:
+            connect_kwargs.setdefault('connection_factory', ReadOnlyConnection)
+        self.connect_kwargs = connect_kwargs
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @property
+    def depth(self):
+        """How many nested getconn() calls the current thread has open."""
+        return getattr(self._local, 'depth', 0)
+
+    def getconn(self):
+        """Returns the connection of the current thread, checking one out if needed."""
+        local = self._local
+        if self.depth:
+            local.depth += 1
+            return local.conn
+        conn = self._checkout()
+        local.conn = conn
+        local.depth = 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Gives back a connection obtained from getconn().
+
+        Only the outermost putconn() of a thread actually returns the
+        connection; any transaction still open at that point is rolled back.
+        """
+        local = self._local
+        if not self.depth or local.conn is not conn:
+            raise PoolError("connection was not checked out by this thread")
+        local.depth -= 1
+        if local.depth:
+            return
+        local.conn = None
+        self._checkin(conn, discard)
+
+    @contextlib.contextmanager
+    def dedicated(self):
+        """Checks out a connection of its own, not the one getconn() shares.
+
+        For work that stays open while the thread makes other calls, e.g. a
+        streaming export: those calls still commit on their own connection.
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn, False)
+
+    def closeall(self):
+        """Closes every idle connection and refuses further checkouts."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _connect(self):
+        start = time.time()
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        if self.read_only:
+            conn.set_session(readonly=True, autocommit=True)
+        if self.events is not None:
+            self.events.connectionOpened(time.time() - start)
+        return conn
+
+    def _close(self, conn):
+        conn.close()
+        if self.events is not None:
+            self.events.connectionClosed()
+
+    def _checkout(self):
+        while True:
+            with self._cond:
+                entry = self._reserve()
+            if entry is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            conn, idle_since = entry
+            if self._healthy(conn, idle_since):
+                return conn
+            self._discard(conn)
+
+    def _reserve(self):
+        """Pops an idle connection, or reserves a slot for a new one (None)."""
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while True:
+            if self._closed:
+                raise PoolError("connection pool is closed")
+            if self._idle:
+                return self._idle.pop()
+            if self._opened < self.size:
+                self._opened += 1
+                return None
+            if deadline is None:
+                self._cond.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolError("connection pool exhausted")
+                self._cond.wait(remaining)
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        status = conn.get_transaction_status()
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.time() - idle_since < self.ping_after:
+            return True
+        try:
+            c = conn.cursor()
+            c.execute("select 1")
+            c.close()
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _checkin(self, conn, discard):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                self._opened -= 1
+            else:
+                self._idle.append((conn, time.time()))
+                self._cond.notify()
+                return
+        self._close(conn)
+
+    def _discard(self, conn):
+        try:
+            self._close(conn)
+        except psycopg2.Error:
+            pass
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+
+class ReadOnlyConnection(psycopg2.extensions.connection):
+    """A connection that remembers the statements prepared on it.
+
+    Prepared statements live as long as the connection, so the names in
+    prepared are those that can be executed without preparing them again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ReadOnlyConnection, self).__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class NullPool(ConnectionPool):
+    """Same interface as ConnectionPool, but opens a new connection for every
+    checkout and closes it on checkin (the behaviour before pooling)."""
+
+    def __init__(self, dsn, **connect_kwargs):
+        super(NullPool, self).__init__(dsn, size=1, health_check=False, **connect_kwargs)
+
+    def _checkout(self):
+        return self._connect()
+
+    def _checkin(self, conn, discard):
+        self._close(conn)
+
+    def closeall(self):
+        pass
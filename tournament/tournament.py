@@ -3,24 +3,67 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import functools
+
 import psycopg2
 
+import pairing
+import pool
+
+DSN = "dbname=tournament"
+POOL_SIZE = 10
+
+_pool = None
+
 
 def connect():
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+    return psycopg2.connect(DSN)
+
+
+def getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = pool.ConnectionPool(DSN, size=POOL_SIZE)
+    return _pool
+
+
+def configurePool(size=POOL_SIZE, health_check=True, enabled=True, **kwargs):
+    """Replaces the shared connection pool.
+
+    Args:
+      size: maximum number of pooled connections.
+      health_check: check idle connections before reusing them.
+      enabled: with False, every call opens and closes its own connection.
+      kwargs: passed on to pool.ConnectionPool (timeout, ping_after, ...),
+        or to pool.NullPool, so connection arguments apply either way.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+    if enabled:
+        _pool = pool.ConnectionPool(DSN, size=size, health_check=health_check, **kwargs)
+    else:
+        _pool = pool.NullPool(DSN, **kwargs)
+    return _pool
 
 
 def connect_db(func):
     """decorator to streamline db connection related code"""
+    @functools.wraps(func)
     def connect_db_and_call(*args, **kwargs):
-        db = connect()
-        c = db.cursor()
-        kwargs['c'] = c
-        result = func(*args, **kwargs)
-        c.close()
-        db.commit()
-        db.close()
+        db_pool = getPool()
+        db = db_pool.getconn()
+        try:
+            c = db.cursor()
+            kwargs['c'] = c
+            result = func(*args, **kwargs)
+            c.close()
+            if db_pool.depth == 1:
+                db.commit()
+        finally:
+            db_pool.putconn(db)
         return result
     return connect_db_and_call
 
@@ -29,6 +72,8 @@ def connect_db(func):
 def deleteMatches(c=None):
     """Remove all the match records from the database."""
     c.execute("delete from matches")
+    c.execute("delete from opponents")
+    c.execute("delete from standings")
 
 
 @connect_db
@@ -58,6 +103,43 @@ def registerPlayer(name, c=None):
     c.execute("insert into players (name) values (%s);", (name,))
 
 
+# the materialized standings plus the matches reported since the last
+# refresh (the tail), see tournament.sql
+STANDINGS_QUERY = """
+    select
+        players.id,
+        players.name,
+        COALESCE(standings.wins, 0) + COALESCE(tail.wins, 0) as wins,
+        COALESCE(standings.matches, 0) + COALESCE(tail.matches, 0) as matches
+    from
+        players
+        left join
+            standings
+        on
+            players.id = standings.player
+        left join
+        (
+            select
+                result.player,
+                sum(result.win) as wins,
+                count(*) as matches
+            from
+            (
+                select winner, 1 from matches where id > (select through from standings_refreshed)
+                union all
+                select loser, 0 from matches where loser is not null and id > (select through from standings_refreshed)
+            ) as result (player, win)
+            group by
+                result.player
+        ) as tail
+        on
+            players.id = tail.player
+    order by
+        wins desc,
+        players.id
+"""
+
+
 @connect_db
 def playerStandings(c=None):
     """Returns a list of the players and their win records, sorted by wins.
@@ -65,6 +147,9 @@ def playerStandings(c=None):
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
 
+    The records are read from the standings table, which refreshStandings
+    brings up to date once per round, plus the matches reported since.
+
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
         id: the player's unique id (assigned by the database)
@@ -72,22 +157,64 @@ def playerStandings(c=None):
         wins: the number of matches the player has won
         matches: the number of matches the player has played
     """
-    c.execute("""
-        select
-            id, name,
-            COALESCE(wins, 0) as wins,
-            COALESCE(wins, 0) + COALESCE(losses, 0) as matches
-        from
-            players
-                left join winners on players.id = winners.winner
-                left join losers on players.id = losers.loser
-        order by
-            wins desc;
-    """)
+    c.execute(STANDINGS_QUERY)
     rows = c.fetchall()
     return rows
 
 
+REFRESH_QUERY = """
+    insert into standings (player, wins, matches)
+    select
+        result.player,
+        sum(result.win),
+        count(*)
+    from
+    (
+        select winner, 1 from matches where id > %(after)s and id <= %(through)s
+        union all
+        select loser, 0 from matches where loser is not null and id > %(after)s and id <= %(through)s
+    ) as result (player, win)
+    group by
+        result.player
+    on conflict (player) do update
+    set
+        wins = standings.wins + excluded.wins,
+        matches = standings.matches + excluded.matches
+"""
+
+
+@connect_db
+def refreshStandings(c=None):
+    """Brings the standings table up to date with the matches.
+
+    Incremental: only the players of the matches reported since the last
+    refresh are touched.  Reads go on during a refresh and see the
+    standings before it until it commits; new matches wait for it, so keep
+    the transaction short.  swissPairings refreshes once per round, in a
+    transaction of its own.
+
+    Returns:
+      The number of players whose standings changed.
+    """
+    c.execute("""select exists (select 1 from matches
+                 where id > (select through from standings_refreshed))""")
+    if not c.fetchone()[0]:
+        return 0
+    # waits for the matches being reported and keeps new ones out (or a
+    # match numbered below the refresh could commit after it)
+    c.execute("lock table matches in share row exclusive mode")
+    c.execute("select through from standings_refreshed")
+    after = c.fetchone()[0]
+    c.execute("select max(id) from matches where id > %s", (after, ))
+    through = c.fetchone()[0]
+    if through is None:
+        return 0
+    c.execute(REFRESH_QUERY, {'after': after, 'through': through})
+    changed = c.rowcount
+    c.execute("update standings_refreshed set through = %s", (through, ))
+    return changed
+
+
 @connect_db
 def reportMatch(winner, loser, c=None):
     """Records the outcome of a single match between two players.
@@ -97,6 +224,39 @@ def reportMatch(winner, loser, c=None):
       loser:  the id number of the player who lost
     """
     c.execute("insert into matches (winner, loser) values (%s, %s)", (winner, loser))
+    c.execute("insert into opponents (player, opponent) values (%s, %s), (%s, %s) on conflict do nothing",
+              (winner, loser, loser, winner))
+
+
+@connect_db
+def reportByeMatch(winner, c=None):
+    """Records a bye, which counts as a match won.
+
+    Args:
+      winner:  the id number of the player who got the bye
+    """
+    c.execute("insert into matches (winner) values (%s)", (winner, ))
+
+
+@connect_db
+def playersWithBye(c=None):
+    """Returns the set of the ids of the players who already had a bye."""
+    c.execute("select distinct winner from matches where loser is null")
+    return set(row[0] for row in c.fetchall())
+
+
+@connect_db
+def playerOpponents(c=None):
+    """Returns a dict of player id -> set of the ids of everyone he or she played.
+
+    Reads the opponents table, which holds each pair of players once per
+    direction however often they met.
+    """
+    opponents = dict()
+    c.execute("select player, opponent from opponents")
+    for player, opponent in c.fetchall():
+        opponents.setdefault(player, set()).add(opponent)
+    return opponents
 
 
 def swissPairings_old():
@@ -123,13 +283,27 @@ def swissPairings_old():
 
 
 @connect_db
-def swissPairings(c=None):
+def _pairingRecords(c=None):
+    """Returns the standings, opponents and byes the next round is paired on."""
+    return playerStandings(), playerOpponents(), playersWithBye()
+
+
+def swissPairings(engine='matching', **options):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings and is paired with a
+    player he or she has not played yet, with an equal or nearly-equal win
+    record.  With an odd number of players the lowest ranked player who has
+    not had a bye yet gets one, paired with ('bye', 'bye'); report it with
+    reportByeMatch.
+
+    Args:
+      engine: the pairing engine to use, see pairing.ENGINES.  'greedy' is
+        the original pairer, 'matching' (the default) never gets stuck when
+        a pairing without rematches exists, 'lookahead' also makes sure the
+        rounds after this one can still be paired without rematches.
+      options: passed on to the engine, e.g. rounds_left and time_budget
+        for 'lookahead'.
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -137,45 +311,11 @@ def swissPairings(c=None):
         name1: the first player's name
         id2: the second player's unique id
         name2: the second player's name
-    """
-
-    # we need to create a map to keep track which players already played which players
-    matches_map = dict()
-    c.execute("select winner, loser from matches")
-    for p1, p2 in c.fetchall():
-        if p1 in matches_map:
-            matches_map[p1].add(p2)
-        else:
-            matches_map[p1] = set([p2])
-        if p2 in matches_map:
-            matches_map[p2].add(p1)
-        else:
-            matches_map[p2] = set([p1])
-
-    # try to group match base on standinds
-    standings = playerStandings()
-    count = len(standings)
-    assigned = set()
-    pairs = list()
-    for x in range(count):
-        p1_id = standings[x][0]
-        p1_name = standings[x][1]
-        if p1_id in assigned:
-            continue
-        candidate_found = False
-        for y in range(x+1, count):
-            p2_id = standings[y][0]
-            p2_name = standings[y][1]
-            if p2_id in assigned:
-                continue
-            if p2_id not in matches_map[p1_id]:
-                candidate_found = True
-                pairs.append((p1_id, p1_name, p2_id, p2_name))
-                assigned.add(p2_id)
-                break
-        if not candidate_found:
-            raise ValueError("unable to find a new opponent for player {0}".format(p1_name))
-    return pairs
-
-
 
+    A new round starts here, so the standings are refreshed first.  The
+    refresh commits before the records are read and paired, so matches can
+    be reported while the pairing runs.
+    """
+    refreshStandings()
+    standings, played, had_bye = _pairingRecords()
+    return pairing.pair(standings, played, had_bye, engine=engine, **options)
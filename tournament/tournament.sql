@@ -12,6 +12,9 @@
 -- reset everything
 drop table IF EXISTS players CASCADE;
 drop table IF EXISTS matches CASCADE;
+drop table IF EXISTS opponents CASCADE;
+drop table IF EXISTS standings CASCADE;
+drop table IF EXISTS standings_refreshed CASCADE;
 drop view IF EXISTS winners;
 drop view IF EXISTS losers;
 
@@ -21,13 +24,39 @@ create table players(
   name varchar (50)
 );
 
--- matches
+-- matches; a bye is a match without a loser
 create table matches(
   id serial primary key,
   winner integer references players(id),
   loser integer references players(id)
 );
 
+-- who already had a bye, for swissPairings
+create index matches_byes on matches (winner) where loser is null;
+
+-- who played whom, one row per player and opponent, kept up to date by
+-- reportMatch so that pairing does not need to read every match
+create table opponents(
+  player integer references players(id),
+  opponent integer references players(id),
+  primary key (player, opponent)
+);
+
+-- standings materialized by refreshStandings(): the wins and matches of
+-- every player who played, counting the matches up to and including
+-- standings_refreshed.through.  playerStandings adds the matches after it;
+-- a refresh only touches the players of those matches.
+create table standings(
+  player integer primary key references players(id) ON DELETE CASCADE,
+  wins integer not null default 0,
+  matches integer not null default 0
+);
+
+create table standings_refreshed(
+  through integer not null
+);
+insert into standings_refreshed (through) values (0);
+
 -- views
 CREATE VIEW winners AS
   select
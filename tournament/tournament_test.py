@@ -2,6 +2,10 @@
 #
 # Test cases for tournament.py
 
+import warnings
+
+import psycopg2
+
 from tournament import *
 
 
@@ -126,6 +130,175 @@ def testPairings():
     print "8. After one match, players with one win are paired."
 
 
+def testPairingsWithoutRematches():
+    deleteMatches()
+    deletePlayers()
+    for name in ("A", "B", "C", "D", "E", "F"):
+        registerPlayer(name)
+    played = dict()
+    for round_number in range(3):
+        pairings = swissPairings()
+        if len(pairings) != 3:
+            raise ValueError("For six players, swissPairings should return three pairs.")
+        paired = set()
+        for (pid1, pname1, pid2, pname2) in pairings:
+            if pid2 in played.get(pid1, ()):
+                raise ValueError("swissPairings should not pair players who already met.")
+            paired.update([pid1, pid2])
+            played.setdefault(pid1, set()).add(pid2)
+            played.setdefault(pid2, set()).add(pid1)
+            reportMatch(pid1, pid2)
+        if len(paired) != 6:
+            raise ValueError("Each player should appear exactly once in the pairings.")
+    # greedy pairs 1-2 and 3-4 first and then gets stuck on 5-6
+    standings = [(x, str(x), 0, 0) for x in range(1, 7)]
+    played = {5: set([6]), 6: set([5])}
+    try:
+        pairing.greedyPairings(standings, played)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("greedy pairer was expected to get stuck.")
+    pairs = set(frozenset([p[0], p[2]]) for p in pairing.matchingPairings(standings, played))
+    if frozenset([5, 6]) in pairs or len(pairs) != 3:
+        raise ValueError("matching pairer should find a pairing without rematches.")
+    print "9. swissPairings avoids rematches where the greedy pairer gets stuck."
+
+
+def testOpponents():
+    deleteMatches()
+    deletePlayers()
+    for name in ("A", "B", "C", "D"):
+        registerPlayer(name)
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings()]
+    reportMatch(id1, id2)
+    reportMatch(id2, id1)
+    reportMatch(id3, id1)
+    expected = {id1: set([id2, id3]), id2: set([id1]), id3: set([id1])}
+    if playerOpponents() != expected:
+        raise ValueError("playerOpponents should list everyone each player played, once.")
+    deleteMatches()
+    if playerOpponents() != {}:
+        raise ValueError("After deleting matches, nobody has played anyone.")
+    print "10. Opponents are recorded with every match."
+
+
+def testLookaheadPairings():
+    # 3, 4, 5 and 6 played a cycle: pairing 1-2 now leaves them nobody next round
+    standings = [(x, str(x), 0, 2) for x in range(1, 7)]
+    played = {3: set([4, 6]), 4: set([3, 5]), 5: set([4, 6]), 6: set([3, 5])}
+    pairs = set(frozenset([p[0], p[2]]) for p in pairing.matchingPairings(standings, played))
+    if frozenset([1, 2]) not in pairs:
+        raise ValueError("matching pairer was expected to pair the top two players.")
+    pairs = pairing.lookaheadPairings(standings, played, rounds_left=2)
+    if frozenset([1, 2]) in set(frozenset([p[0], p[2]]) for p in pairs):
+        raise ValueError("lookahead pairer should leave opponents for the next round.")
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        pairing.lookaheadPairings(standings, played, rounds_left=2, time_budget=0)
+    if not caught or not issubclass(caught[0].category, RuntimeWarning):
+        raise ValueError("lookahead pairer should warn when it runs out of time.")
+    try:
+        pairing.lookaheadPairings(standings, played, rounds_left=4)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("3 cannot play three more rounds, lookahead pairer should refuse.")
+    # a full round robin, every round paired without rematches
+    deleteMatches()
+    deletePlayers()
+    for name in ("A", "B", "C", "D", "E", "F"):
+        registerPlayer(name)
+    met = set()
+    for round_number in range(5):
+        for (pid1, pname1, pid2, pname2) in swissPairings('lookahead', rounds_left=5 - round_number):
+            met.add(frozenset([pid1, pid2]))
+            reportMatch(pid1, pid2)
+    if len(met) != 15:
+        raise ValueError("Six players should meet each other exactly once in five rounds.")
+    print "11. Lookahead pairings leave every remaining round a pairing without rematches."
+
+
+def testMaterializedStandings():
+    deleteMatches()
+    deletePlayers()
+    for name in ("A", "B", "C", "D", "E", "F"):
+        registerPlayer(name)
+    [id1, id2, id3, id4, id5, id6] = [row[0] for row in playerStandings()]
+    reportMatch(id1, id2)
+    reportMatch(id3, id4)
+    standings = playerStandings()
+    if [row[2:] for row in standings[:2]] != [(1, 1), (1, 1)] or standings[-1][2:] != (0, 0):
+        raise ValueError("Standings should count the matches reported since the last refresh.")
+    if refreshStandings() != 4 or refreshStandings() != 0:
+        raise ValueError("A refresh should update the players of the new matches, once.")
+    if playerStandings() != standings:
+        raise ValueError("A refresh should not change the standings.")
+    reportMatch(id1, id3)
+    if refreshStandings() != 2:
+        raise ValueError("A refresh should only touch the players whose results changed.")
+    db = connect()
+    c = db.cursor()
+    c.execute("select player, wins, matches from standings order by player")
+    if c.fetchall() != [(id1, 2, 2), (id2, 0, 1), (id3, 1, 2), (id4, 0, 1)]:
+        raise ValueError("The standings table should hold the refreshed records.")
+    # the view-join query the standings table replaces
+    c.execute("""
+        select id, name, COALESCE(wins, 0), COALESCE(wins, 0) + COALESCE(losses, 0)
+        from players left join winners on players.id = winners.winner left join losers on players.id = losers.loser
+    """)
+    if sorted(c.fetchall()) != sorted(playerStandings()):
+        raise ValueError("Materialized standings should equal the winners and losers views.")
+    db.close()
+    reportMatch(id5, id6)
+    swissPairings()
+    if refreshStandings() != 0:
+        raise ValueError("swissPairings should refresh the standings before pairing a round.")
+
+    def reportWhilePairing(standings, played, had_bye):
+        db = connect()
+        c = db.cursor()
+        c.execute("set lock_timeout = '1s'")
+        try:
+            c.execute("insert into matches (winner, loser) values (%s, %s)", (id2, id4))
+            db.commit()
+        except psycopg2.OperationalError:
+            raise ValueError("The standings refresh should commit before the round is paired.")
+        finally:
+            db.close()
+        return []
+    reportMatch(id2, id5)
+    swissPairings(engine=reportWhilePairing)
+    deleteMatches()
+    if [row[2:] for row in playerStandings()] != [(0, 0)] * 6:
+        raise ValueError("After deleting matches, nobody has a record.")
+    print "12. Standings are materialized and refreshed incrementally per round."
+
+
+def testByes():
+    deleteMatches()
+    deletePlayers()
+    for name in ("A", "B", "C", "D", "E"):
+        registerPlayer(name)
+    byes = list()
+    met = set()
+    for round_number in range(5):
+        for (pid1, pname1, pid2, pname2) in swissPairings():
+            if pid2 == 'bye':
+                byes.append(pid1)
+                reportByeMatch(pid1)
+            else:
+                met.add(frozenset([pid1, pid2]))
+                reportMatch(pid1, pid2)
+    if len(set(byes)) != 5 or playersWithBye() != set(byes):
+        raise ValueError("In an odd field every player should get one bye, and nobody a second one.")
+    if len(met) != 10 or [row[3] for row in playerStandings()] != [5] * 5:
+        raise ValueError("A bye should count as a match, and the others should be played once each.")
+    if sum(row[2] for row in playerStandings()) != 15:
+        raise ValueError("A bye should count as a win.")
+    print "13. In an odd field the bye goes to a player who has not had one yet."
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -135,4 +308,9 @@ if __name__ == '__main__':
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testPairingsWithoutRematches()
+    testOpponents()
+    testLookaheadPairings()
+    testMaterializedStandings()
+    testByes()
     print "Success!  All tests pass!"
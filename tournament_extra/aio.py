@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# aio.py -- asyncio version of the tournament_extra API
+#
+# Every public function of tournament.py has a coroutine of the same name and
+# arguments here.  The coroutine runs the function of tournament.py on a
+# thread of a pool as big as the connection pool, so the event loop goes on
+# while it waits for the database.  The calls share everything with
+# tournament.py: its connection pools, standings cache, metrics and storage
+# backend (configurePool, configureBackend, ... of tournament.py apply
+# here too), and there is no SQL of its own here to keep in step.  Requires
+# Python 3.7+.
+#
+#   import aio
+#
+#   async def nextRound(tournament):
+#       pairs = await aio.swissPairings(tournament)
+#       ...
+#       await aio.reportRound(tournament, results)
+#
+# Many tournaments can be paired and reported at the same time, e.g. with
+# asyncio.gather(); each call holds a thread and a pooled connection only
+# while it runs.  Call closePool() before the event loop ends.
+#
+# This is a thread offload, not an asynchronous driver: every call blocks a
+# thread while it waits for the database, and at most POOL_SIZE calls (the
+# size given to configurePool) run at once.  The others wait for a thread;
+# the event loop itself never blocks.  aio_test.py checks this.
+#
+# The streaming exports are asynchronous generators, reading fetch_size rows
+# per step on a thread:
+#
+#   async for line in aio.streamHistory(tournament, output='csv'):
+#       ...
+#
+
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+
+import tournament as api
+
+_executor = None
+# threads of the executor, the size of the connection pool
+_threads = api.POOL_SIZE
+
+
+def _getExecutor():
+    """Returns the threads the calls run on, creating them on first use."""
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(_threads, thread_name_prefix='aio')
+    return _executor
+
+
+async def _inThread(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_getExecutor(), functools.partial(func, *args, **kwargs))
+
+
+async def getPool():
+    """Returns the connection pool of tournament.py."""
+    return api.getPool()
+
+
+async def configurePool(size=api.POOL_SIZE, **kwargs):
+    """Replaces the connection pools, see tournament.configurePool, and the
+    threads the calls run on."""
+    global _executor, _threads
+    db_pool = await _inThread(api.configurePool, size, **kwargs)
+    executor, _executor, _threads = _executor, None, size
+    if executor is not None:
+        executor.shutdown(wait=False)
+    return db_pool
+
+
+async def getReadPool():
+    """Returns the read pool of tournament.py, see tournament.configureReadPool."""
+    return api.getReadPool()
+
+
+async def configureReadPool(dsn=None, size=api.POOL_SIZE, **kwargs):
+    """Replaces the pool the read only queries run on, see tournament.configureReadPool."""
+    return await _inThread(api.configureReadPool, dsn, size, **kwargs)
+
+
+async def closePool():
+    """Closes every pooled connection and the threads; the next call opens
+    new ones."""
+    global _executor
+    await _inThread(api.closePool)
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def _threaded(func):
+    """Returns a coroutine function calling func on a thread."""
+    @functools.wraps(func)
+    async def call_in_thread(*args, **kwargs):
+        return await _inThread(func, *args, **kwargs)
+    return call_in_thread
+
+
+def _streamed(func):
+    """Returns an asynchronous generator function yielding the items of the
+    generator func returns, fetch_size at a time from a thread."""
+    @functools.wraps(func)
+    async def stream(*args, **kwargs):
+        items = func(*args, **kwargs)
+        fetch_size = kwargs.get('fetch_size', api.STREAM_FETCH_SIZE)
+        try:
+            while True:
+                chunk = await _inThread(list, itertools.islice(items, fetch_size))
+                for item in chunk:
+                    yield item
+                if len(chunk) < fetch_size:
+                    return
+        finally:
+            # gives back the connection of the export
+            await _inThread(items.close)
+    return stream
+
+
+deleteMatches = _threaded(api.deleteMatches)
+deletePlayers = _threaded(api.deletePlayers)
+deleteTournamentPlayers = _threaded(api.deleteTournamentPlayers)
+deleteTournaments = _threaded(api.deleteTournaments)
+archiveTournament = _threaded(api.archiveTournament)
+countPlayers = _threaded(api.countPlayers)
+countTournamentPlayers = _threaded(api.countTournamentPlayers)
+registerPlayer = _threaded(api.registerPlayer)
+registerTournament = _threaded(api.registerTournament)
+registerTournamentPlayer = _threaded(api.registerTournamentPlayer)
+bulkRegisterPlayers = _threaded(api.bulkRegisterPlayers)
+bulkRegisterTournamentPlayers = _threaded(api.bulkRegisterTournamentPlayers)
+tournamentPlayerStandings = _threaded(api.tournamentPlayerStandings)
+setTiebreaks = _threaded(api.setTiebreaks)
+tournamentTiebreaks = _threaded(api.tournamentTiebreaks)
+columnarStandings = _threaded(api.columnarStandings)
+rollupStandings = _threaded(api.rollupStandings)
+reportMatch = _threaded(api.reportMatch)
+reportTiedMatch = _threaded(api.reportTiedMatch)
+reportByeMatch = _threaded(api.reportByeMatch)
+reportRound = _threaded(api.reportRound)
+reportResults = _threaded(api.reportResults)
+tournamentHistory = _threaded(api.tournamentHistory)
+tournamentOpponents = _threaded(api.tournamentOpponents)
+swissPairings = _threaded(api.swissPairings)
+pairAllTournaments = _threaded(api.pairAllTournaments)
+currentRound = _threaded(api.currentRound)
+openRound = _threaded(api.openRound)
+tournamentPairings = _threaded(api.tournamentPairings)
+
+streamStandings = _streamed(api.streamStandings)
+streamPairings = _streamed(api.streamPairings)
+streamHistory = _streamed(api.streamHistory)
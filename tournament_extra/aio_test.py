@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Test cases for aio.py, run with Python 3.7+:
+#
+#   python3 aio_test.py
+#
+# Like tournament_test.py this wipes the tournament_extra database (or runs
+# on the backend TOURNAMENT_BACKEND names).
+
+import asyncio
+import threading
+import time
+
+import aio
+import tournament as api
+
+
+async def resetDatabase():
+    await aio.deleteMatches()
+    await aio.deletePlayers()
+    await aio.deleteTournamentPlayers()
+    await aio.deleteTournaments()
+
+
+async def setupTournament(name, num_players):
+    tournament = await aio.registerTournament(name)
+    players = await aio.bulkRegisterPlayers("{0} Player {1}".format(name, x) for x in range(num_players))
+    return tournament, await aio.bulkRegisterTournamentPlayers(tournament, players)
+
+
+async def testConcurrentReportsAndStandings():
+    await resetDatabase()
+    tournaments = await asyncio.gather(*[setupTournament("Async Open {0}".format(x), 8) for x in range(12)])
+
+    async def playRound(tournament):
+        results = list()
+        for (id1, name1, id2, name2) in await aio.swissPairings(tournament, avoid_rematches=True):
+            results.append(('bye', id2 if id1 == 'bye' else id1) if 'bye' in (id1, id2) else ('win', id1, id2))
+        await aio.reportRound(tournament, results)
+        return results
+
+    async def readStandings(tournament):
+        return [row[2:] for row in await aio.tournamentPlayerStandings(tournament)]
+
+    played = dict((tournament, list()) for (tournament, _) in tournaments)
+    for _ in range(3):
+        calls = list()
+        for (tournament, _) in tournaments:
+            calls.append(playRound(tournament))
+            calls.extend(readStandings(tournament) for _ in range(3))
+        done = await asyncio.gather(*calls)
+        for (tournament, _), results in zip(tournaments, done[::4]):
+            played[tournament].extend(results)
+    for (tournament, players) in tournaments:
+        wins = dict((player, 0) for player in players)
+        matches = dict((player, 0) for player in players)
+        for result in played[tournament]:
+            wins[result[1]] += 1
+            for player in result[1:]:
+                matches[player] += 1
+        standings = await aio.tournamentPlayerStandings(tournament)
+        if sorted((row[0], row[2], row[3]) for row in standings) != \
+                sorted((player, wins[player], matches[player]) for player in players):
+            raise ValueError("Concurrent reports should all count in the standings.")
+        if standings != api.tournamentPlayerStandings(tournament):
+            raise ValueError("The coroutines should read what tournament.py reads.")
+    print("1. Concurrent reports and standings of many tournaments all count")
+
+
+async def testThreadOffload():
+    await resetDatabase()
+    tournament, players = await setupTournament("Offload Open", 4)
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def blocking(seconds):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(seconds)
+        with lock:
+            running[0] -= 1
+
+    ticks = list()
+
+    async def tick():
+        while len(ticks) < 5:
+            ticks.append(time.time())
+            await asyncio.sleep(0.01)
+
+    calls = [aio._inThread(blocking, 0.05) for _ in range(2 * aio._threads)]
+    await asyncio.gather(tick(), *calls)
+    if running[1] != aio._threads:
+        raise ValueError("At most one call per thread of the pool should run at a time.")
+    if ticks[-1] - ticks[0] > 0.5:
+        raise ValueError("The event loop should go on while the calls wait on their threads.")
+    await aio.reportRound(tournament, [('win', players[0], players[1]), ('win', players[2], players[3])])
+    history = [line async for line in aio.streamHistory(tournament, output='csv', fetch_size=1)]
+    if history != list(api.streamHistory(tournament, output='csv')):
+        raise ValueError("Asynchronous exports should yield the lines of tournament.py.")
+    print("2. Calls run on a thread each, up to the size of the pool, while the loop goes on")
+
+
+async def main():
+    try:
+        await testConcurrentReportsAndStandings()
+        await testThreadOffload()
+    finally:
+        await aio.closePool()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- rough performance numbers for tournament.py
+#
+# Like tournament_test.py this runs against the tournament_extra database and
+# wipes it first.  Run all benchmarks, or only some of them by name:
+#
+#   python benchmark.py
+#   python benchmark.py reportMatch
+#   python benchmark.py pairAll
+#   python benchmark.py tiebreaks
+#   python benchmark.py polling
+#   python benchmark.py archive
+#
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+import psycopg2.extensions
+
+import columnar
+import tiebreaks
+from tournament import *
+
+
+def resetDatabase():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+
+
+def setupTournament(num_players, name='Benchmark Open'):
+    """Registers num_players players into a new tournament.
+
+    Returns:
+      (tournament id, list of tournament player ids)
+    """
+    tournament = registerTournament(name)
+    ids = [registerTournamentPlayer(registerPlayer("Player {0}".format(x)), tournament)
+           for x in range(num_players)]
+    return tournament, ids
+
+
+def timed(func, *args, **kwargs):
+    """Returns (elapsed seconds, result) of a single call."""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def benchReportMatch(calls=2000):
+    """reportMatch calls per second with and without the connection pool."""
+    for pooled in (False, True):
+        configurePool(enabled=pooled)
+        resetDatabase()
+        tournament, ids = setupTournament(64)
+        start = time.time()
+        for x in range(calls):
+            reportMatch(tournament, ids[x % 64], ids[(x + 1) % 64])
+        elapsed = time.time() - start
+        print("reportMatch pooled={0}: {1} calls in {2:.2f}s, {3:.0f} calls/s".format(
+            pooled, calls, elapsed, calls / elapsed))
+    configurePool()
+
+
+def benchStandings(num_players=10000, num_matches=100000):
+    """tournamentPlayerStandings against the per-row opponent_match_wins() query."""
+    resetDatabase()
+    tournament, ids = setupTournament(num_players)
+    rng = random.Random(2015)
+    for x in range(0, num_matches, num_players // 2):
+        shuffled = ids[:]
+        rng.shuffle(shuffled)
+        reportRound(tournament, [('win', shuffled[y], shuffled[y+1]) for y in range(0, num_players, 2)])
+    # opponent_match_wins() reads the rolled up counters
+    rollupStandings(tournament)
+    db = connect()
+    c = db.cursor()
+    c.execute("analyze")
+    legacy_time, _ = timed(c.execute, """
+        select tournament_players.id, players.name, tournament_players.wins, tournament_players.matches
+        from tournament_players join players on tournament_players.player = players.id
+        where tournament_players.tournament = %s
+        order by wins desc, opponent_match_wins(tournament_players.id) desc, tournament_players.id
+    """, (tournament, ))
+    legacy = c.fetchall()
+    db.close()
+    elapsed, standings = timed(tournamentPlayerStandings, tournament)
+    print("standings {0} players / {1} matches: opponent_match_wins() {2:.2f}s, set-based {3:.2f}s, same order: {4}".format(
+        num_players, num_matches, legacy_time, elapsed, legacy == standings))
+
+
+def rowsSize(rows):
+    """Rough bytes held by a list of standings tuples."""
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+                                     for row in rows)
+
+
+def columnsSize(standings):
+    """Rough bytes held by columnar standings."""
+    size = sys.getsizeof(standings.names) + sum(sys.getsizeof(name) for name in standings.names)
+    for column in (standings.ids, standings.wins, standings.matches, standings.tiebreaks, standings.had_bye):
+        size += column.nbytes if hasattr(column, 'nbytes') else column.itemsize * len(column)
+    return size
+
+
+def benchColumnar(num_players=50000, rounds=5):
+    """Tuple standings and pairings against columnar ones for a large field."""
+    configureStandingsCache(0)
+    resetDatabase()
+    tournament = registerTournament('Columnar Open')
+    bulkRegisterTournamentPlayers(tournament, bulkRegisterPlayers(
+        "Player {0}".format(x) for x in range(num_players)))
+    rng = random.Random(2015)
+    for x in range(rounds):
+        pairs = swissPairings(tournament, use_columnar=True)
+        reportRound(tournament, [('win', p[0], p[2]) if rng.random() < 0.5 else ('win', p[2], p[0])
+                                 for p in pairs if 'bye' not in (p[0], p[2])])
+    rows_time, rows = timed(tournamentPlayerStandings, tournament, with_bye=True)
+    columns_time, columns = timed(columnarStandings, tournament)
+    pairs_time, _ = timed(pairStandings, rows)
+    column_pairs_time, _ = timed(columns.pairs)
+    print("standings {0} players: tuples {1:.2f}s {2:.1f}MB, columns ({3}) {4:.2f}s {5:.1f}MB".format(
+        num_players, rows_time, rowsSize(rows) / 1e6, 'numpy' if columnar.numpy else 'array',
+        columns_time, columnsSize(columns) / 1e6))
+    print("pairing {0} players: tuples {1:.3f}s, columns {2:.3f}s".format(num_players, pairs_time, column_pairs_time))
+    configureStandingsCache()
+
+
+def benchPairAll(num_tournaments=200, num_players=500, rounds=3, workers=(1, 2, 4, 8)):
+    """pairAllTournaments with 1, 2, 4 and 8 worker processes."""
+    configureStandingsCache(0)
+    resetDatabase()
+    tournaments = list()
+    for x in range(num_tournaments):
+        tournament = registerTournament("Parallel Open {0}".format(x))
+        bulkRegisterTournamentPlayers(tournament, bulkRegisterPlayers(
+            "Player {0}-{1}".format(x, y) for y in range(num_players)))
+        tournaments.append(tournament)
+    rng = random.Random(2015)
+    for x in range(rounds):
+        for tournament, pairs in pairAllTournaments(tournaments).items():
+            reportRound(tournament, [('bye', p[0]) if p[2] == 'bye' else
+                                     ('win', p[0], p[2]) if rng.random() < 0.5 else ('win', p[2], p[0])
+                                     for p in pairs])
+    baseline = None
+    db = connect()
+    c = db.cursor()
+    for count in workers:
+        # the round is paired once; drop it to pair it again
+        c.execute("delete from rounds where round > %s", (rounds, ))
+        db.commit()
+        elapsed, pairings = timed(pairAllTournaments, tournaments, workers=count)
+        if baseline is None:
+            baseline = elapsed, pairings
+        print("pairAllTournaments {0} tournaments x {1} players, {2} workers: {3:.2f}s, speedup {4:.1f}x, "
+              "same pairs: {5}".format(num_tournaments, num_players, count, elapsed, baseline[0] / elapsed,
+                                       pairings == baseline[1]))
+    db.close()
+    configureStandingsCache()
+
+
+def benchTiebreaks(num_players=10000, rounds=5, names=('omw', 'buchholz', 'cumulative')):
+    """Standings ranked by the default tiebreak against bulk computed ones."""
+    configureStandingsCache(0)
+    resetDatabase()
+    tournament = registerTournament('Tiebreak Open')
+    ids = bulkRegisterTournamentPlayers(tournament, bulkRegisterPlayers(
+        "Player {0}".format(x) for x in range(num_players)))
+    rng = random.Random(2015)
+    for x in range(rounds):
+        rng.shuffle(ids)
+        reportRound(tournament, [('tie', ids[y], ids[y+1]) if rng.random() < 0.1 else ('win', ids[y], ids[y+1])
+                                 for y in range(0, num_players, 2)])
+    default_time, _ = timed(tournamentPlayerStandings, tournament)
+    setTiebreaks(tournament, names)
+    elapsed, standings = timed(tournamentPlayerStandings, tournament)
+    db = connect()
+    c = db.cursor()
+    c.execute("select winner, loser, p1, p2 from matches where tournament = %s order by id", (tournament, ))
+    results = c.fetchall()
+    db.close()
+    compute_time, _ = timed(tiebreaks.computeTiebreaks, [row[0] for row in standings],
+                            [row[2] for row in standings], results, names)
+    print("standings {0} players / {1} rounds: opponent_match_wins {2:.2f}s, {3} {4:.2f}s "
+          "(computing the tiebreaks with {5} {6:.3f}s)".format(
+              num_players, rounds, default_time, '+'.join(names), elapsed,
+              'numpy' if tiebreaks.numpy else 'python', compute_time))
+    configureStandingsCache()
+
+
+def percentile(latencies, fraction):
+    """Returns the fraction (e.g. 0.99) percentile of sorted latencies, in ms."""
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+def benchPolling(num_players=64, rounds=3, calls=2000):
+    """Latency of a dashboard poll (uncached standings and player count)
+    with the read queries sent as text and as prepared statements."""
+    configureStandingsCache(0)
+    resetDatabase()
+    tournament, ids = setupTournament(num_players)
+    rng = random.Random(2015)
+    for x in range(rounds):
+        rng.shuffle(ids)
+        reportRound(tournament, [('win', ids[y], ids[y+1]) for y in range(0, num_players, 2)])
+    db = connect()
+    db.autocommit = True
+    db.cursor().execute("analyze")
+    db.close()
+    for prepared in (False, True):
+        # plain connections do not keep track of prepared statements
+        configureReadPool(**({} if prepared else {'connection_factory': psycopg2.extensions.connection}))
+        latencies = []
+        for x in range(calls):
+            start = time.time()
+            tournamentPlayerStandings(tournament)
+            countTournamentPlayers(tournament)
+            latencies.append(time.time() - start)
+        latencies.sort()
+        print("polling {0} players, prepared={1}: p50 {2:.2f}ms, p99 {3:.2f}ms, {4:.0f} polls/s".format(
+            num_players, prepared, percentile(latencies, 0.5), percentile(latencies, 0.99), calls / sum(latencies)))
+    configureReadPool()
+    configureStandingsCache()
+
+
+def benchArchive(num_players=10000, rounds=10):
+    """Removing a finished tournament: its rows deleted one by one, as
+    before the tables were partitioned, against deleteTournaments and
+    archiveTournament, which detach its partitions."""
+    resetDatabase()
+    players = bulkRegisterPlayers("Player {0}".format(x) for x in range(num_players))
+    rng = random.Random(2015)
+    tournaments = []
+    for name in ('Deleted Open', 'Dropped Open', 'Archived Open'):
+        tournament = registerTournament(name)
+        ids = bulkRegisterTournamentPlayers(tournament, players)
+        for x in range(rounds):
+            rng.shuffle(ids)
+            reportRound(tournament, [('win', ids[y], ids[y+1]) for y in range(0, num_players, 2)])
+        tournaments.append(tournament)
+    deleted, dropped, archived = tournaments
+
+    def deleteRows():
+        db = connect()
+        c = db.cursor()
+        c.execute("delete from tournament_players where tournament = %s", (deleted, ))
+        db.commit()
+        db.close()
+
+    times = [('row by row', timed(deleteRows)[0]),
+             ('deleteTournaments', timed(deleteTournaments, dropped)[0])]
+    with open(os.devnull, 'w') as out:
+        elapsed, tables = timed(archiveTournament, archived, out)
+    times.append(('archiveTournament (with the export)', elapsed))
+    print("removing a tournament of {0} players / {1} matches: {2}".format(
+        num_players, rounds * num_players // 2, ', '.join("{0} {1:.3f}s".format(*pair) for pair in times)))
+    db = connect()
+    db.cursor().execute("drop table {0}".format(', '.join(tables)))
+    db.commit()
+    db.close()
+    deleteTournaments(deleted)
+
+
+BENCHMARKS = [
+    ('reportMatch', benchReportMatch),
+    ('standings', benchStandings),
+    ('columnar', benchColumnar),
+    ('pairAll', benchPairAll),
+    ('tiebreaks', benchTiebreaks),
+    ('polling', benchPolling),
+    ('archive', benchArchive),
+]
+
+
+if __name__ == '__main__':
+    selected = sys.argv[1:]
+    for name, bench in BENCHMARKS:
+        if not selected or name in selected:
+            bench()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# benchmark_aio.py -- throughput of aio.py with many concurrent tournaments
+#
+# Needs Python 3.7+.  Like benchmark.py this runs against the
+# tournament_extra database and wipes it first.  Every tournament plays its
+# rounds (pair, then report the whole round) while the others do the same,
+# on one event loop and one pool:
+#
+#   python3 benchmark_aio.py
+#   python3 benchmark_aio.py 1 10 100
+#
+
+import asyncio
+import random
+import sys
+import time
+
+import aio
+
+CONCURRENCY = [1, 10, 100]
+
+
+async def resetDatabase():
+    await aio.deleteMatches()
+    await aio.deletePlayers()
+    await aio.deleteTournamentPlayers()
+    await aio.deleteTournaments()
+
+
+async def setupTournament(num_players, name):
+    tournament = await aio.registerTournament(name)
+    for x in range(num_players):
+        await aio.registerTournamentPlayer(await aio.registerPlayer("Player {0}".format(x)), tournament)
+    return tournament
+
+
+async def playTournament(tournament, rounds, rng):
+    """Pairs and reports rounds of a tournament, picking winners at random."""
+    for _ in range(rounds):
+        results = list()
+        for (id1, name1, id2, name2) in await aio.swissPairings(tournament):
+            if 'bye' in (id1, id2):
+                results.append(('bye', id2 if id1 == 'bye' else id1))
+            else:
+                results.append(('win', id1, id2) if rng.random() < 0.5 else ('win', id2, id1))
+        await aio.reportRound(tournament, results)
+
+
+async def benchConcurrentTournaments(concurrency, num_players=32, rounds=5):
+    await resetDatabase()
+    tournaments = await asyncio.gather(*[
+        setupTournament(num_players, "Concurrent Open {0}".format(x)) for x in range(concurrency)])
+    rng = random.Random(2015)
+    start = time.time()
+    await asyncio.gather(*[playTournament(tournament, rounds, rng) for tournament in tournaments])
+    elapsed = time.time() - start
+    print("{0:>4} concurrent tournaments x {1} rounds of {2} players: {3:.2f}s, {4:.0f} rounds/s".format(
+        concurrency, rounds, num_players, elapsed, concurrency * rounds / elapsed))
+
+
+async def main(levels):
+    try:
+        for concurrency in levels:
+            await benchConcurrentTournaments(concurrency)
+    finally:
+        await aio.closePool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or CONCURRENCY))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# cache.py -- bounded LRU cache for tournament standings
+#
+
+import collections
+import threading
+
+
+class StandingsCache(object):
+    """Keeps the standings of the most recently read tournaments.
+
+    Entries are dropped by invalidate() whenever a tournament changes.  A
+    reader that loaded standings while a write was committing could put an
+    outdated entry back; put() therefore takes the generation(key) read
+    before loading, and ignores the entry if that key (or the whole cache)
+    was invalidated since.  Writes to other tournaments do not matter.
+
+    The cache lives in one process: writes made by other processes are not
+    seen until the entry is invalidated or evicted here.
+    """
+
+    def __init__(self, maxsize=256):
+        """
+        Args:
+          maxsize: the number of tournaments to keep, 0 disables the cache.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        # invalidations of every entry, and of each key since the last one
+        self._cleared = 0
+        self._generations = dict()
+        self._lock = threading.Lock()
+
+    def generation(self, key):
+        with self._lock:
+            return self._cleared, self._generations.get(key, 0)
+
+    def get(self, key):
+        """Returns the cached value, or None (counted as a miss)."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # most recently used entries go to the end
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != (self._cleared, self._generations.get(key, 0)) or not self.maxsize:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Drops the entry for key, or every entry if key is None."""
+        with self._lock:
+            if key is None:
+                self._cleared += 1
+                self._generations.clear()
+                self._entries.clear()
+            else:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# columnar.py -- column-oriented standings for very large tournaments
+#
+# tournamentPlayerStandings returns one tuple per player, i.e. half a dozen
+# Python objects per row.  ColumnarStandings keeps one array per column
+# instead: ids, wins, matches, tiebreaks and bye flags as NumPy arrays when
+# NumPy is installed, as array.array columns otherwise.  Only the names stay
+# a list of strings.
+#
+#   standings = tournament.columnarStandings(tournament)
+#   for wins, group in standings.scoreGroups():
+#       ...
+#   pairs = standings.pairs()       # same pairs as swissPairings
+#   rows = list(standings)          # same tuples as tournamentPlayerStandings
+#
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _column(typecode, values):
+    if numpy is not None:
+        return numpy.array(values, dtype={'l': numpy.int64, 'b': numpy.bool_}[typecode])
+    return array.array(typecode, values)
+
+
+def _take(column, indices):
+    if numpy is not None:
+        return column[numpy.asarray(indices, dtype=numpy.int64)]
+    return array.array(column.typecode, [column[i] for i in indices])
+
+
+class ColumnarStandings(object):
+    """Standings of one tournament, stored by column, in standings order.
+
+    Rows are ranked like tournamentPlayerStandings: wins, then tiebreaks (the
+    wins of the opponents each player beat), both descending, then id.
+    """
+
+    def __init__(self, ids, names, wins, matches, tiebreaks, had_bye, ranked=True):
+        """
+        Args:
+          ids, names, wins, matches, tiebreaks, had_bye: the columns, any
+            sequences of the same length.
+          ranked: whether the rows are in standings order already; if not
+            they are sorted.
+        """
+        self.ids = _column('l', ids)
+        self.names = list(names)
+        self.wins = _column('l', wins)
+        self.matches = _column('l', matches)
+        self.tiebreaks = _column('l', tiebreaks)
+        self.had_bye = _column('b', had_bye)
+        if not ranked:
+            self._reorder(self.ranking())
+
+    @classmethod
+    def fromRows(cls, rows, ranked=True):
+        """Builds the columns from (id, name, wins, matches, had_bye, tiebreak) rows."""
+        columns = list(zip(*rows)) or [()] * 6
+        ids, names, wins, matches, had_bye, tiebreaks = columns
+        return cls(ids, names, wins, matches, tiebreaks, had_bye, ranked)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return self.rows()
+
+    def __getitem__(self, index):
+        """The row at index as a legacy (id, name, wins, matches) tuple."""
+        return (int(self.ids[index]), self.names[index], int(self.wins[index]), int(self.matches[index]))
+
+    def rows(self, with_bye=False):
+        """Yields the legacy tuples of tournamentPlayerStandings, in order."""
+        columns = [self.ids.tolist(), self.names, self.wins.tolist(), self.matches.tolist()]
+        if with_bye:
+            columns.append([bool(had_bye) for had_bye in self.had_bye.tolist()])
+        for row in zip(*columns):
+            yield row
+
+    def ranking(self):
+        """Returns the row indices in standings order."""
+        if numpy is not None:
+            # lexsort sorts by the last key first
+            return numpy.lexsort((self.ids, -self.tiebreaks, -self.wins))
+        wins, tiebreaks, ids = self.wins, self.tiebreaks, self.ids
+        return sorted(range(len(ids)), key=lambda i: (-wins[i], -tiebreaks[i], ids[i]))
+
+    def sort(self):
+        """Puts the rows back in standings order, e.g. after changing wins."""
+        self._reorder(self.ranking())
+        return self
+
+    def _reorder(self, indices):
+        self.ids = _take(self.ids, indices)
+        self.names = [self.names[i] for i in indices]
+        self.wins = _take(self.wins, indices)
+        self.matches = _take(self.matches, indices)
+        self.tiebreaks = _take(self.tiebreaks, indices)
+        self.had_bye = _take(self.had_bye, indices)
+
+    def slice(self, start, stop):
+        """Returns rows start to stop as ColumnarStandings (NumPy columns are views)."""
+        part = ColumnarStandings.__new__(ColumnarStandings)
+        part.ids = self.ids[start:stop]
+        part.names = self.names[start:stop]
+        part.wins = self.wins[start:stop]
+        part.matches = self.matches[start:stop]
+        part.tiebreaks = self.tiebreaks[start:stop]
+        part.had_bye = self.had_bye[start:stop]
+        return part
+
+    def scoreGroupBounds(self):
+        """Returns (wins, start, stop) of each run of equal wins, top group first."""
+        wins = self.wins
+        if not len(wins):
+            return []
+        if numpy is not None:
+            starts = [0] + (numpy.flatnonzero(wins[1:] != wins[:-1]) + 1).tolist()
+        else:
+            starts = [0] + [i for i in range(1, len(wins)) if wins[i] != wins[i - 1]]
+        stops = starts[1:] + [len(wins)]
+        return [(int(wins[start]), start, stop) for start, stop in zip(starts, stops)]
+
+    def scoreGroups(self):
+        """Returns (wins, ColumnarStandings) of each score group, top group first."""
+        return [(wins, self.slice(start, stop)) for wins, start, stop in self.scoreGroupBounds()]
+
+    def byeIndex(self):
+        """Index of the player who gets the bye, None with an even field.
+
+        Same rule as tournament.pairStandings: the best ranked player who did
+        not have a bye yet.
+        """
+        if len(self) % 2 == 0:
+            return None
+        if numpy is not None:
+            candidates = numpy.flatnonzero(~self.had_bye)
+            index = int(candidates[0]) if len(candidates) else None
+        else:
+            index = next((i for i in range(len(self)) if not self.had_bye[i]), None)
+        if index is None:
+            raise ValueError("Unable to setup bye match, every players already had bye match")
+        return index
+
+    def pairs(self):
+        """Same pairs as tournament.pairStandings.
+
+        The bye is seated right below the player who gets it; this only
+        copies the id and name columns, not whole rows.
+        """
+        bye = self.byeIndex()
+        ids = self.ids.tolist()
+        names = self.names
+        if bye is not None:
+            ids = ids[:bye + 1] + ['bye'] + ids[bye + 1:]
+            names = names[:bye + 1] + ['bye'] + names[bye + 1:]
+        return list(zip(ids[0::2], names[0::2], ids[1::2], names[1::2]))
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+# metrics.py -- instrumentation of the tournament_extra API
+#
+# Off by default.  Once a sink is configured every call of a decorated API
+# function is measured: latency, time spent waiting for a connection, in
+# statements and in the commit, the number of statements and of rows they
+# returned or changed, and whether it failed.  The pool reports every
+# connection it opens or closes (connection churn).
+#
+#   registry = tournament.configureMetrics(metrics.Registry())
+#   ...
+#   registry.stats()['reportRound']['p99_seconds']
+#   print(registry.prometheusText())
+#
+# A sink is any object with the methods of MetricsSink; Registry keeps the
+# numbers in the process.  profileCall runs a single call under cProfile.
+#
+
+import bisect
+import cProfile
+import pstats
+import threading
+import time
+
+import psycopg2.extensions
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the calls running on the current thread, innermost last
+_local = threading.local()
+
+
+class CallStats(object):
+    """What one API call did."""
+
+    __slots__ = ('function', 'seconds', 'connect_seconds', 'statements', 'statement_seconds', 'rows',
+                 'commits', 'commit_seconds', 'error')
+
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0.0
+        self.connect_seconds = 0.0
+        self.statements = 0
+        self.statement_seconds = 0.0
+        self.rows = 0
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self.error = False
+
+
+class MetricsSink(object):
+    """Interface of a metrics sink."""
+
+    def recordCall(self, stats):
+        """Called with the CallStats of every finished call."""
+        raise NotImplementedError
+
+    def connectionOpened(self, seconds):
+        """Called for every new database connection, with the time it took."""
+        raise NotImplementedError
+
+    def connectionClosed(self):
+        """Called for every database connection closed."""
+        raise NotImplementedError
+
+
+class Registry(MetricsSink):
+    """Keeps counters and latency histograms per API function in the process."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._functions = dict()
+            self.connections_opened = 0
+            self.connections_closed = 0
+            self.connect_seconds = 0.0
+
+    def recordCall(self, stats):
+        with self._lock:
+            entry = self._functions.get(stats.function)
+            if entry is None:
+                entry = self._functions[stats.function] = {
+                    'calls': 0, 'errors': 0, 'seconds': 0.0, 'connect_seconds': 0.0, 'statements': 0,
+                    'statement_seconds': 0.0, 'rows': 0, 'commits': 0, 'commit_seconds': 0.0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                }
+            entry['calls'] += 1
+            entry['errors'] += stats.error
+            entry['seconds'] += stats.seconds
+            entry['connect_seconds'] += stats.connect_seconds
+            entry['statements'] += stats.statements
+            entry['statement_seconds'] += stats.statement_seconds
+            entry['rows'] += stats.rows
+            entry['commits'] += stats.commits
+            entry['commit_seconds'] += stats.commit_seconds
+            entry['buckets'][bisect.bisect_left(self.buckets, stats.seconds)] += 1
+
+    def connectionOpened(self, seconds):
+        with self._lock:
+            self.connections_opened += 1
+            self.connect_seconds += seconds
+
+    def connectionClosed(self):
+        with self._lock:
+            self.connections_closed += 1
+
+    def stats(self):
+        """Returns {function: dict of its counters}, with latency percentiles
+        estimated from the histogram (the upper bound of the bucket)."""
+        with self._lock:
+            functions = dict((name, dict(entry, buckets=list(entry['buckets'])))
+                             for (name, entry) in self._functions.items())
+        for entry in functions.values():
+            for p in (50, 90, 99):
+                entry['p{0}_seconds'.format(p)] = self._percentile(entry['buckets'], entry['calls'], p)
+        return functions
+
+    def _percentile(self, counts, calls, p):
+        rank = calls * p / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'), ), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def prometheusText(self, prefix='tournament'):
+        """Returns the metrics in the Prometheus text exposition format."""
+        functions = self.stats()
+        lines = list()
+
+        def metric(name, kind, description, samples):
+            lines.append('# HELP {0}_{1} {2}'.format(prefix, name, description))
+            lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+            for labels, value in samples:
+                lines.append('{0}_{1}{2} {3}'.format(prefix, name, labels, _number(value)))
+
+        def perFunction(key):
+            return [('{{function="{0}"}}'.format(name), functions[name][key]) for name in sorted(functions)]
+
+        samples = list()
+        for name in sorted(functions):
+            entry = functions[name]
+            seen = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), entry['buckets']):
+                seen += count
+                samples.append(('_bucket{{function="{0}",le="{1}"}}'.format(name, _number(bound)), seen))
+            samples.append(('_sum{{function="{0}"}}'.format(name), entry['seconds']))
+            samples.append(('_count{{function="{0}"}}'.format(name), entry['calls']))
+        metric('call_seconds', 'histogram', 'Latency of API calls.', samples)
+        metric('call_errors_total', 'counter', 'API calls that raised.', perFunction('errors'))
+        metric('connect_wait_seconds_total', 'counter', 'Time API calls waited for a connection.',
+               perFunction('connect_seconds'))
+        metric('statements_total', 'counter', 'SQL statements run by API calls.', perFunction('statements'))
+        metric('statement_seconds_total', 'counter', 'Time spent in SQL statements.',
+               perFunction('statement_seconds'))
+        metric('rows_total', 'counter', 'Rows returned or changed by SQL statements.', perFunction('rows'))
+        metric('commits_total', 'counter', 'Transactions committed by API calls.', perFunction('commits'))
+        metric('commit_seconds_total', 'counter', 'Time spent committing.', perFunction('commit_seconds'))
+        metric('connections_opened_total', 'counter', 'Database connections opened.',
+               [('', self.connections_opened)])
+        metric('connections_closed_total', 'counter', 'Database connections closed.',
+               [('', self.connections_closed)])
+        metric('connect_seconds_total', 'counter', 'Time spent opening connections.',
+               [('', self.connect_seconds)])
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def startCall(function):
+    """Starts measuring a call; returns its CallStats."""
+    stats = CallStats(function)
+    calls = getattr(_local, 'calls', None)
+    if calls is None:
+        calls = _local.calls = list()
+    calls.append(stats)
+    return stats
+
+
+def finishCall(sink, stats, start):
+    stats.seconds = time.time() - start
+    _local.calls.pop()
+    sink.recordCall(stats)
+
+
+def _countStatement(seconds, rows):
+    # a statement of a nested call counts for the calls around it as well
+    for stats in getattr(_local, 'calls', ()):
+        stats.statements += 1
+        stats.statement_seconds += seconds
+        stats.rows += max(rows, 0)
+
+
+_cursor_classes = dict()
+
+
+def meteredCursor(db):
+    """Returns a cursor of db that counts its statements for the running calls.
+
+    The cursor class extends the connection's own cursor_factory, so
+    connection factories with cursors of their own keep working.
+    """
+    base = db.cursor_factory or psycopg2.extensions.cursor
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        cls = _cursor_classes[base] = _meteredCursorClass(base)
+    return db.cursor(cursor_factory=cls)
+
+
+def _meteredCursorClass(base):
+    class MeteredCursor(base):
+        def execute(self, query, vars=None):
+            start = time.time()
+            try:
+                return base.execute(self, query, vars)
+            finally:
+                _countStatement(time.time() - start, self.rowcount)
+
+        def executemany(self, query, vars_list):
+            start = time.time()
+            try:
+                return base.executemany(self, query, vars_list)
+            finally:
+                _countStatement(time.time() - start, self.rowcount)
+
+        def copy_expert(self, sql, file, size=8192):
+            start = time.time()
+            try:
+                return base.copy_expert(self, sql, file, size)
+            finally:
+                _countStatement(time.time() - start, self.rowcount)
+
+    return MeteredCursor
+
+
+def profileCall(func, *args, **kwargs):
+    """Runs func(*args, **kwargs) under cProfile.
+
+    Returns:
+      (result, stats): what func returned and its pstats.Stats, e.g.
+      stats.sort_stats('cumulative').print_stats(20).
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, pstats.Stats(profiler)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# migrate.py -- versioned schema migrations for the tournament_extra database
+#
+# Every file in migrations/ is named NNNN_description.sql and is applied
+# once, in order, inside its own transaction.  Applied versions are recorded
+# in the schema_migrations table.
+#
+#   python migrate.py            apply all pending migrations
+#   python migrate.py --list     show applied and pending migrations
+#   python migrate.py --reset    drop everything, then apply all migrations
+#
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+
+from tournament import connect
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# any constant works, it only keeps two migrate.py runs from racing
+MIGRATION_LOCK = 20150501
+
+
+def availableMigrations(directory=MIGRATIONS_DIR):
+    """Returns a sorted list of (version, name, path) for every migration file."""
+    migrations = list()
+    for filename in os.listdir(directory):
+        match = re.match(r'^(\d+)_(\w+)\.sql$', filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("two migrations share the same version number")
+    return migrations
+
+
+def appliedVersions(c):
+    """Returns the set of migration versions already applied."""
+    c.execute("""
+        create table if not exists schema_migrations(
+          version integer primary key,
+          name text,
+          applied_at timestamp default now()
+        )
+    """)
+    c.execute("select version from schema_migrations")
+    return set(row[0] for row in c.fetchall())
+
+
+def migrate(target=None, verbose=False):
+    """Applies every pending migration up to and including version target.
+
+    Returns:
+      A list of the versions that were applied.
+    """
+    db = connect()
+    c = db.cursor()
+    applied = list()
+    try:
+        c.execute("select pg_advisory_lock(%s)", (MIGRATION_LOCK, ))
+        done = appliedVersions(c)
+        db.commit()
+        for version, name, path in availableMigrations():
+            if version in done or (target is not None and version > target):
+                continue
+            with open(path) as sql:
+                c.execute(sql.read())
+            c.execute("insert into schema_migrations (version, name) values (%s, %s)", (version, name))
+            db.commit()
+            applied.append(version)
+            if verbose:
+                print("applied {0:04d}_{1}".format(version, name))
+        c.execute("select pg_advisory_unlock(%s)", (MIGRATION_LOCK, ))
+        db.commit()
+    finally:
+        db.close()
+    return applied
+
+
+def reset():
+    """Drops every table, view and function of the database, and the
+    archived tournaments."""
+    db = connect()
+    c = db.cursor()
+    c.execute("drop schema if exists archive cascade")
+    c.execute("drop schema public cascade")
+    c.execute("create schema public")
+    db.commit()
+    db.close()
+
+
+def listMigrations():
+    db = connect()
+    c = db.cursor()
+    done = appliedVersions(c)
+    db.commit()
+    db.close()
+    for version, name, _ in availableMigrations():
+        print("{0:04d}_{1} {2}".format(version, name, 'applied' if version in done else 'pending'))
+
+
+if __name__ == '__main__':
+    if '--list' in sys.argv:
+        listMigrations()
+    else:
+        if '--reset' in sys.argv:
+            reset()
+        migrate(verbose=True)
@@ -1,18 +1,7 @@
--- Table definitions for the tournament project.
+-- 0001: table definitions for the tournament project.
 --
--- Put your SQL 'create table' statements in this file; also 'create view'
--- statements if you choose to use it.
---
--- You can write comments in this file by starting them with two dashes, like
--- these lines here.
-
-
--- reset everything
-drop table IF EXISTS matches CASCADE;
-drop table IF EXISTS tournament_players CASCADE;
-drop table IF EXISTS tournaments CASCADE;
-drop table IF EXISTS players CASCADE;
-drop function IF EXISTS opponent_match_wins(winner_id text);
+-- Migrations are applied in order by migrate.py, each one exactly once, so
+-- this file only creates things and never drops them.
 
 -- player table
 create table players(
@@ -0,0 +1,19 @@
+-- 0002: indexes for the standings, opponent and rematch lookups.
+--
+-- None of the foreign keys had an index, so every standings query, tiebreak
+-- and delete (including the ON DELETE CASCADE chains) scanned whole tables.
+
+-- standings and player counts of one tournament, best player first; covers
+-- everything tournamentPlayerStandings reads from tournament_players
+create index tournament_players_standings
+  on tournament_players (tournament, wins desc, id) include (matches, had_bye, player);
+
+-- every match of one tournament, e.g. to find who already played whom
+create index matches_tournament on matches (tournament) include (winner, loser, p1, p2);
+
+-- opponents a player beat (tiebreaks) or lost to, and the cascades from
+-- tournament_players
+create index matches_winner on matches (winner) include (loser);
+create index matches_loser on matches (loser) include (winner);
+create index matches_p1 on matches (p1) include (p2);
+create index matches_p2 on matches (p2) include (p1);
@@ -0,0 +1,78 @@
+-- 0003: integer surrogate keys for tournament_players.
+--
+-- tournament_players used the text "<tournament>-<player>" as its primary
+-- key, and the four player columns of matches referenced it.  Every join,
+-- index and foreign key check in the standings and tiebreaks was done on
+-- text.  Existing rows get a serial id, the matches are rewritten to point
+-- at it, and (tournament, player) becomes a unique key instead.
+
+-- drop everything that depends on the text keys
+alter table matches
+  drop constraint matches_winner_fkey,
+  drop constraint matches_loser_fkey,
+  drop constraint matches_p1_fkey,
+  drop constraint matches_p2_fkey;
+drop index matches_tournament, matches_winner, matches_loser, matches_p1, matches_p2;
+drop index tournament_players_standings;
+drop function opponent_match_wins(winner_id text);
+
+-- new keys for tournament_players
+alter table tournament_players rename column id to legacy_id;
+alter table tournament_players drop constraint tournament_players_pkey;
+alter table tournament_players add column id serial primary key;
+alter table tournament_players
+  add constraint tournament_players_tournament_player_key unique (tournament, player);
+
+-- point matches at the new keys
+alter table matches
+  rename column winner to legacy_winner;
+alter table matches
+  rename column loser to legacy_loser;
+alter table matches
+  rename column p1 to legacy_p1;
+alter table matches
+  rename column p2 to legacy_p2;
+alter table matches
+  add column winner integer references tournament_players(id) ON DELETE CASCADE,
+  add column loser integer references tournament_players(id) ON DELETE CASCADE,
+  add column p1 integer references tournament_players(id) ON DELETE CASCADE,
+  add column p2 integer references tournament_players(id) ON DELETE CASCADE;
+update matches
+set
+  winner = (select id from tournament_players where legacy_id = matches.legacy_winner),
+  loser = (select id from tournament_players where legacy_id = matches.legacy_loser),
+  p1 = (select id from tournament_players where legacy_id = matches.legacy_p1),
+  p2 = (select id from tournament_players where legacy_id = matches.legacy_p2);
+alter table matches
+  drop column legacy_winner,
+  drop column legacy_loser,
+  drop column legacy_p1,
+  drop column legacy_p2;
+alter table tournament_players drop column legacy_id;
+
+-- the indexes of 0002, on the new columns
+create index tournament_players_standings
+  on tournament_players (tournament, wins desc, id) include (matches, had_bye, player);
+create index matches_tournament on matches (tournament) include (winner, loser, p1, p2);
+create index matches_winner on matches (winner) include (loser);
+create index matches_loser on matches (loser) include (winner);
+create index matches_p1 on matches (p1) include (p2);
+create index matches_p2 on matches (p2) include (p1);
+
+CREATE OR REPLACE FUNCTION opponent_match_wins(winner_id INTEGER) RETURNS BIGINT AS $$
+  SELECT
+    COALESCE(sum(wins), 0)
+  FROM
+    tournament_players
+    JOIN
+    (
+      SELECT
+        loser
+      FROM
+        matches
+      WHERE
+        winner = winner_id
+    ) AS opponents
+    ON
+      tournament_players.id = opponents.loser
+$$ LANGUAGE SQL;
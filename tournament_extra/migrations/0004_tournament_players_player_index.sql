@@ -0,0 +1,7 @@
+-- 0004: index the player column of tournament_players.
+--
+-- Deleting players cascades to tournament_players by player, which had no
+-- index of its own (the unique key starts with tournament), so every deleted
+-- player cost a sequential scan.  With rosters imported in bulk that turned
+-- deletePlayers() into minutes.
+create index tournament_players_player on tournament_players (player);
@@ -0,0 +1,24 @@
+-- 0005: who played whom, per tournament.
+--
+-- One row per tournament player and opponent, however often they met, kept
+-- up to date by the report functions.  Pairing code can load the opponents
+-- of one tournament with a single index scan instead of reading its matches.
+-- A tournament player id belongs to one tournament, so (player, opponent) is
+-- the key; tournament is there to load a whole tournament at once.
+create table opponents(
+  tournament integer,
+  player integer references tournament_players(id) ON DELETE CASCADE,
+  opponent integer references tournament_players(id) ON DELETE CASCADE,
+  primary key (player, opponent)
+);
+
+insert into opponents (tournament, player, opponent)
+select tournament, player, opponent from matches, lateral (values (winner, loser), (loser, winner)) as pair (player, opponent)
+where loser is not null
+union
+select tournament, player, opponent from matches, lateral (values (p1, p2), (p2, p1)) as pair (player, opponent)
+where p1 is not null;
+
+create index opponents_tournament on opponents (tournament, player, opponent);
+-- deleting a tournament player cascades by opponent too
+create index opponents_opponent on opponents (opponent);
@@ -0,0 +1,14 @@
+-- 0006: idempotency keys of reported results.
+--
+-- Scorekeeping tablets retry a report when it times out, which recorded the
+-- same result twice.  A report can carry a key chosen by the client; the key
+-- is stored in the transaction of the results, so a report repeating a
+-- stored key changes nothing, and two concurrent reports with the same key
+-- wait for each other on the primary key.
+create table result_reports(
+  key text primary key,
+  tournament integer not null references tournaments(id) ON DELETE CASCADE,
+  reported_at timestamp not null default now()
+);
+
+create index result_reports_tournament on result_reports (tournament);
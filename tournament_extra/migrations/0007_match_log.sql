@@ -0,0 +1,43 @@
+-- 0007: matches become the log the standings are derived from.
+--
+-- Every report used to update the wins/matches/had_bye counters of its
+-- players in place, so concurrent reports queued on the same rows.  Reports
+-- now only append to matches.  The counters of tournament_players are a
+-- rollup: they count the matches of their tournament up to and including
+-- tournaments.rolled_up_through, and the standings add the matches after it
+-- (the tail).  rollupStandings() folds the tail into the counters.
+
+alter table tournaments add column rolled_up_through integer not null default 0;
+
+-- every standings query looks up where the tail of its tournament starts
+create index tournaments_rolled_up_through on tournaments (id) include (rolled_up_through);
+
+-- the tail of one tournament is a range scan of this index
+drop index matches_tournament;
+create index matches_tournament on matches (tournament, id) include (winner, loser, p1, p2);
+
+-- rebuild the counters from the log and roll everything up
+update tournament_players
+set
+  wins = COALESCE(log.wins, 0),
+  matches = COALESCE(log.matches, 0),
+  had_bye = COALESCE(log.had_bye, FALSE)
+from
+  tournament_players as current
+  left join
+  (
+    select result.player, sum(result.win) as wins, count(*) as matches, bool_or(result.bye) as had_bye
+    from
+      matches
+      cross join lateral
+        (values (winner, 1, loser is null), (loser, 0, FALSE), (p1, 0, FALSE), (p2, 0, FALSE))
+        as result (player, win, bye)
+    where result.player is not null
+    group by result.player
+  ) as log
+  on current.id = log.player
+where
+  tournament_players.id = current.id;
+
+update tournaments
+set rolled_up_through = COALESCE((select max(id) from matches where tournament = tournaments.id), 0);
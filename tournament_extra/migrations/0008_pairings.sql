@@ -0,0 +1,16 @@
+-- 0008: pairings of the rounds pairAllTournaments() generated.
+--
+-- One row per board: player2 is null for a bye.  Rounds are numbered per
+-- tournament, from 1.
+create table pairings(
+  tournament integer not null references tournaments(id) ON DELETE CASCADE,
+  round integer not null,
+  board integer not null,
+  player1 integer not null references tournament_players(id) ON DELETE CASCADE,
+  player2 integer references tournament_players(id) ON DELETE CASCADE,
+  primary key (tournament, round, board)
+);
+
+-- deleting a tournament player cascades by both columns
+create index pairings_player1 on pairings (player1);
+create index pairings_player2 on pairings (player2);
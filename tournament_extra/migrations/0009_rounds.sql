@@ -0,0 +1,26 @@
+-- 0009: rounds are paired once and then served from the pairings.
+--
+-- Every client asking for the current round used to compute its own pairing
+-- from the standings, so two clients could get different ones.  A round is
+-- now stored when it is paired, and served until all of its pairings are
+-- reported.  Reports are checked against the pairings of that open round.
+create table rounds(
+  tournament integer not null references tournaments(id) ON DELETE CASCADE,
+  round integer not null,
+  paired_at timestamp not null default now(),
+  primary key (tournament, round)
+);
+
+insert into rounds (tournament, round)
+select distinct tournament, round from pairings;
+
+alter table pairings
+  add foreign key (tournament, round) references rounds ON DELETE CASCADE;
+
+-- nothing recorded which of the stored pairings were played, so none of the
+-- rounds paired so far stays open
+alter table pairings add column reported boolean not null default FALSE;
+update pairings set reported = TRUE;
+
+-- the open round of a tournament is the last one with unreported pairings
+create index pairings_unreported on pairings (tournament, round) where not reported;
@@ -0,0 +1,6 @@
+-- 0010: tiebreaks chosen per tournament.
+--
+-- The names of the tiebreaks ranking players with equal wins, in order, see
+-- tiebreaks.py.  Null is the default, the wins of the opponents a player
+-- beat, which the standings query computes itself.
+alter table tournaments add column tiebreaks text[];
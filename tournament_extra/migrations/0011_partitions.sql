@@ -0,0 +1,116 @@
+-- 0011: matches and tournament_players are partitioned by tournament.
+--
+-- Deleting a tournament deleted its players and matches row by row, through
+-- chains of ON DELETE CASCADE, which bloated both tables and locked them for
+-- as long as that took.  Every tournament now has a partition of each,
+-- tournament_players_<id> and matches_<id>, created with the tournament, so
+-- deleting or archiving a tournament detaches and drops tables instead, see
+-- tournament.deleteTournaments and tournament.archiveTournament.  Archived
+-- partitions are moved to the archive schema.
+--
+-- The keys of a partitioned table include its partition key, so the primary
+-- keys become (tournament, id) and the foreign keys to tournament_players
+-- include the tournament: a match, opponent or pairing can no longer name a
+-- player of another tournament.  Foreign keys to a partitioned table need
+-- PostgreSQL 12.
+
+create schema if not exists archive;
+
+create function create_tournament_partitions(tournament integer) returns void as $$
+begin
+  execute format('create table if not exists tournament_players_%s partition of tournament_players for values in (%s)',
+                 tournament, tournament);
+  execute format('create table if not exists matches_%s partition of matches for values in (%s)',
+                 tournament, tournament);
+end;
+$$ language plpgsql;
+
+create function tournaments_create_partitions() returns trigger as $$
+begin
+  perform create_tournament_partitions(new.id);
+  return null;
+end;
+$$ language plpgsql;
+
+-- the old tables go once their rows are copied, their ids go on
+alter table opponents
+  drop constraint opponents_player_fkey,
+  drop constraint opponents_opponent_fkey;
+alter table pairings
+  drop constraint pairings_player1_fkey,
+  drop constraint pairings_player2_fkey;
+alter sequence tournament_players_id_seq owned by none;
+alter sequence matches_id_seq owned by none;
+alter table tournament_players rename to unpartitioned_tournament_players;
+alter table matches rename to unpartitioned_matches;
+
+create table tournament_players(
+  id integer not null default nextval('tournament_players_id_seq'),
+  wins integer DEFAULT 0,
+  matches integer DEFAULT 0,
+  had_bye boolean default false,
+  player integer,
+  tournament integer not null
+) partition by list (tournament);
+
+create table matches(
+  id integer not null default nextval('matches_id_seq'),
+  tournament integer not null,
+  winner integer,
+  p1 integer,
+  p2 integer,
+  loser integer
+) partition by list (tournament);
+
+select create_tournament_partitions(id) from tournaments;
+
+create trigger tournaments_create_partitions after insert on tournaments
+  for each row execute function tournaments_create_partitions();
+
+-- rows without a tournament have no partition; nothing ever wrote them
+insert into tournament_players (id, wins, matches, had_bye, player, tournament)
+select id, wins, matches, had_bye, player, tournament from unpartitioned_tournament_players
+where tournament is not null;
+
+insert into matches (id, tournament, winner, p1, p2, loser)
+select id, tournament, winner, p1, p2, loser from unpartitioned_matches
+where tournament is not null;
+
+drop table unpartitioned_matches;
+drop table unpartitioned_tournament_players;
+alter sequence tournament_players_id_seq owned by tournament_players.id;
+alter sequence matches_id_seq owned by matches.id;
+
+-- the keys and indexes of 0002 to 0007, per partition
+alter table tournament_players
+  add primary key (tournament, id),
+  add constraint tournament_players_tournament_player_key unique (tournament, player),
+  add foreign key (player) references players(id) ON DELETE CASCADE,
+  add foreign key (tournament) references tournaments(id) ON DELETE CASCADE;
+create index tournament_players_standings
+  on tournament_players (tournament, wins desc, id) include (matches, had_bye, player);
+create index tournament_players_player on tournament_players (player);
+-- a bye is reported by tournament player id alone
+create index tournament_players_id on tournament_players (id);
+
+-- the tail of one tournament is a range scan of the primary key
+alter table matches
+  add primary key (tournament, id) include (winner, loser, p1, p2),
+  add foreign key (tournament) references tournaments(id) ON DELETE CASCADE,
+  add foreign key (tournament, winner) references tournament_players ON DELETE CASCADE,
+  add foreign key (tournament, loser) references tournament_players ON DELETE CASCADE,
+  add foreign key (tournament, p1) references tournament_players ON DELETE CASCADE,
+  add foreign key (tournament, p2) references tournament_players ON DELETE CASCADE;
+create index matches_winner on matches (winner) include (loser);
+create index matches_loser on matches (loser) include (winner);
+create index matches_p1 on matches (p1) include (p2);
+create index matches_p2 on matches (p2) include (p1);
+
+alter table opponents
+  alter column tournament set not null,
+  add foreign key (tournament, player) references tournament_players ON DELETE CASCADE,
+  add foreign key (tournament, opponent) references tournament_players ON DELETE CASCADE;
+
+alter table pairings
+  add foreign key (tournament, player1) references tournament_players ON DELETE CASCADE,
+  add foreign key (tournament, player2) references tournament_players ON DELETE CASCADE;
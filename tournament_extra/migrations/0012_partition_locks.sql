@@ -0,0 +1,48 @@
+-- 0012: registering, archiving or deleting a tournament no longer locks the
+-- tables of every other tournament.
+--
+-- Creating a partition takes an ACCESS EXCLUSIVE lock on matches and
+-- tournament_players, and a SHARE ROW EXCLUSIVE lock on tournaments (for
+-- the foreign keys of the partition); every registration took those locks.
+-- register_tournament now creates the partitions of the next ids ahead of
+-- time, a batch at once, so most registrations only insert a row.  A
+-- partition that already exists is not created again and locks nothing.
+--
+-- A closed tournament takes no more reports (see tournament._appendLock);
+-- archiving or deleting a tournament closes it first, then detaches its
+-- partitions concurrently, outside a transaction.
+
+alter table tournaments add column closed boolean not null default false;
+
+create function create_missing_partitions(first integer, count integer) returns void as $$
+begin
+  perform create_tournament_partitions(tournament)
+  from generate_series(first, first + count - 1) as tournament
+  where to_regclass(format('tournament_players_%s', tournament)) is null or
+        to_regclass(format('matches_%s', tournament)) is null;
+end;
+$$ language plpgsql;
+
+create function register_tournament(tournament_name text, ahead integer) returns integer as $$
+declare
+  tournament integer := nextval('tournaments_id_seq');
+begin
+  if to_regclass(format('tournament_players_%s', tournament)) is null then
+    -- the lock creating the partitions takes, before the insert: registrations
+    -- creating partitions take turns instead of deadlocking, and the ones that
+    -- waited find the partitions created
+    lock table tournaments in share row exclusive mode;
+    perform create_missing_partitions(tournament, ahead);
+  end if;
+  insert into tournaments (id, name) values (tournament, tournament_name);
+  return tournament;
+end;
+$$ language plpgsql;
+
+-- other inserts into tournaments still get their partitions
+create or replace function tournaments_create_partitions() returns trigger as $$
+begin
+  perform create_missing_partitions(new.id, 1);
+  return null;
+end;
+$$ language plpgsql;
@@ -0,0 +1 @@
+../tournament/pairing.py
\ No newline at end of file
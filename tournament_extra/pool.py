@@ -0,0 +1 @@
+../tournament/pool.py
\ No newline at end of file
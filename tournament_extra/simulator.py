@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# simulator.py -- plays whole Swiss events through the tournament API
+#
+# Like tournament_test.py this runs against the tournament_extra database and
+# wipes it first.  Every simulated tournament registers its players, then
+# plays its rounds: pair, report the results, read the standings.  Results
+# are random, or follow the players' Elo ratings.  Several tournaments run at
+# the same time on their own threads, sharing the connection pool.
+#
+# For every API call the simulator records the latency, and it counts the
+# round trips to the database (statements and commits).  The report is JSON,
+# so the numbers of two commits can be compared:
+#
+#   python simulator.py --players 8,1000 --tournaments 4 > before.json
+#   python simulator.py --players 50000 --results elo --report match
+#   python simulator.py --players 50000 --backend memory
+#
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+
+import tournament as api
+
+# round trips of the current thread, see CountingConnection
+_counter = threading.local()
+
+
+def roundTrips():
+    """Returns the number of round trips the current thread made so far."""
+    return getattr(_counter, 'round_trips', 0)
+
+
+def _countRoundTrip():
+    _counter.round_trips = roundTrips() + 1
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """A cursor that counts its statements as round trips."""
+
+    def execute(self, query, vars=None):
+        _countRoundTrip()
+        return super(CountingCursor, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        for vars in vars_list:
+            self.execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        _countRoundTrip()
+        return super(CountingCursor, self).copy_expert(sql, file, size)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """A connection that counts its statements and commits as round trips.
+
+    Install it with tournament.configurePool(connection_factory=CountingConnection).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingConnection, self).__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
+
+    def commit(self):
+        _countRoundTrip()
+        return super(CountingConnection, self).commit()
+
+    def rollback(self):
+        _countRoundTrip()
+        return super(CountingConnection, self).rollback()
+
+
+class Recorder(object):
+    """Collects latency and round trips of API calls, by operation name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = dict()
+        self._round_trips = dict()
+
+    def call(self, operation, func, *args, **kwargs):
+        trips = roundTrips()
+        start = time.time()
+        result = func(*args, **kwargs)
+        elapsed = time.time() - start
+        with self._lock:
+            self._latencies.setdefault(operation, []).append(elapsed)
+            self._round_trips[operation] = self._round_trips.get(operation, 0) + roundTrips() - trips
+        return result
+
+    def report(self, elapsed):
+        operations = dict()
+        for operation, latencies in sorted(self._latencies.items()):
+            latencies = sorted(latencies)
+            operations[operation] = {
+                'calls': len(latencies),
+                'calls_per_second': len(latencies) / elapsed if elapsed else None,
+                'total_seconds': sum(latencies),
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p90_ms': percentile(latencies, 90) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': latencies[-1] * 1000,
+                'round_trips': self._round_trips[operation],
+                'round_trips_per_call': float(self._round_trips[operation]) / len(latencies),
+            }
+        return operations
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def playMatch(rng, results, ratings, p1, p2, tie_rate):
+    """Returns ('win', winner, loser) or ('tie', p1, p2) for one match.
+
+    With results 'elo' p1 wins with the Elo expected score of the two
+    ratings; with 'random' either player wins with the same odds.
+    """
+    if rng.random() < tie_rate:
+        return ('tie', p1, p2)
+    expected = 0.5
+    if results == 'elo':
+        expected = 1.0 / (1 + 10 ** ((ratings[p2] - ratings[p1]) / 400.0))
+    return ('win', p1, p2) if rng.random() < expected else ('win', p2, p1)
+
+
+def simulateTournament(recorder, name, num_players, rounds, rng, results='random', report='round',
+                       tie_rate=0.1):
+    """Registers and plays one tournament through the API."""
+    tournament = recorder.call('registerTournament', api.registerTournament, name)
+    players = recorder.call('bulkRegisterPlayers', api.bulkRegisterPlayers,
+                            ("{0} player {1}".format(name, x) for x in range(num_players)))
+    ids = recorder.call('bulkRegisterTournamentPlayers', api.bulkRegisterTournamentPlayers,
+                        tournament, players)
+    ratings = dict((player, rng.gauss(1500, 200)) for player in ids)
+    for _ in range(rounds):
+        round_results = list()
+        for (id1, name1, id2, name2) in recorder.call('swissPairings', api.swissPairings, tournament):
+            if 'bye' in (id1, id2):
+                round_results.append(('bye', id2 if id1 == 'bye' else id1))
+            else:
+                round_results.append(playMatch(rng, results, ratings, id1, id2, tie_rate))
+        if report == 'round':
+            recorder.call('reportRound', api.reportRound, tournament, round_results)
+        else:
+            for result in round_results:
+                if result[0] == 'win':
+                    recorder.call('reportMatch', api.reportMatch, tournament, result[1], result[2])
+                elif result[0] == 'tie':
+                    recorder.call('reportTiedMatch', api.reportTiedMatch, tournament, result[1], result[2])
+                else:
+                    recorder.call('reportByeMatch', api.reportByeMatch, result[1])
+        recorder.call('tournamentPlayerStandings', api.tournamentPlayerStandings, tournament)
+
+
+def simulate(num_players, tournaments=1, rounds=None, results='random', report='round', tie_rate=0.1,
+             seed=2015):
+    """Plays tournaments concurrent tournaments of num_players players each.
+
+    Args:
+      rounds: rounds per tournament, by default enough to find a single
+        winner (ceil(log2(num_players))).
+      results: 'random' or 'elo'.
+      report: 'round' reports each round with reportRound, 'match' reports
+        every match with its own call.
+
+    Returns:
+      A dict with the settings, the elapsed time and, per operation, the
+      calls, latency percentiles, throughput and round trips.
+    """
+    if rounds is None:
+        rounds = max(1, int(math.ceil(math.log(num_players, 2))))
+    recorder = Recorder()
+    errors = list()
+
+    def run(x):
+        try:
+            simulateTournament(recorder, "Sim {0}".format(x), num_players, rounds,
+                               random.Random(seed + x), results, report, tie_rate)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(x, )) for x in range(tournaments)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if errors:
+        raise errors[0]
+    return {
+        'players': num_players,
+        'tournaments': tournaments,
+        'rounds': rounds,
+        'results': results,
+        'report': report,
+        'elapsed_seconds': elapsed,
+        'operations': recorder.report(elapsed),
+    }
+
+
+def resetDatabase():
+    api.deleteMatches()
+    api.deletePlayers()
+    api.deleteTournamentPlayers()
+    api.deleteTournaments()
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Simulate Swiss tournaments through the tournament API.")
+    parser.add_argument('--players', default='8,64,1000',
+                        help="comma separated field sizes, one simulation each (default 8,64,1000)")
+    parser.add_argument('--tournaments', type=int, default=1, help="concurrent tournaments")
+    parser.add_argument('--rounds', type=int, help="rounds per tournament (default log2 of players)")
+    parser.add_argument('--results', choices=['random', 'elo'], default='random')
+    parser.add_argument('--report', choices=['round', 'match'], default='round')
+    parser.add_argument('--tie-rate', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=2015)
+    parser.add_argument('--pool-size', type=int, default=api.POOL_SIZE)
+    parser.add_argument('--no-cache', action='store_true', help="disable the standings cache")
+    parser.add_argument('--backend', choices=['postgresql', 'memory'],
+                        help="storage backend (default TOURNAMENT_BACKEND, or postgresql)")
+    args = parser.parse_args(argv)
+
+    if args.backend:
+        api.configureBackend(args.backend)
+
+    api.configurePool(size=args.pool_size, connection_factory=CountingConnection)
+    if args.no_cache:
+        api.configureStandingsCache(0)
+    runs = list()
+    for num_players in [int(size) for size in args.players.split(',')]:
+        resetDatabase()
+        runs.append(simulate(num_players, args.tournaments, args.rounds, args.results, args.report,
+                             args.tie_rate, args.seed))
+    resetDatabase()
+    json.dump({'revision': gitRevision(), 'runs': runs}, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#
+# state.py -- in-memory tournament engine with write-behind persistence
+#
+# During a live event every swissPairings call re-reads and re-sorts the
+# whole tournament in SQL.  A TournamentState loads the tournament once and
+# keeps standings, tiebreaks, byes and opponents up to date in memory as
+# results come in; results are written to PostgreSQL in batches by a
+# background thread.
+#
+#   state = TournamentState.load(tournament)
+#   for (id1, name1, id2, name2) in state.swissPairings():
+#       ...
+#   state.reportMatch(winner, loser)
+#   state.close()
+#
+
+import threading
+
+import psycopg2
+
+import tiebreaks
+import tournament as api
+
+
+class TournamentState(object):
+    """In-memory standings of one tournament.
+
+    Reads (standings() and swissPairings()) never touch the database.  The
+    report methods update the state immediately and queue the result;
+    queued results are written with tournament.reportResults() every
+    flush_interval seconds, or as soon as batch_size results are waiting.
+    Results that were not flushed yet are lost if the process dies, so call
+    flush() where a result must be durable (e.g. at the end of a round).
+
+    A batch the database refuses for good (anything but an OperationalError,
+    e.g. a result of players another client paired differently) is not
+    retried: it is moved to rejected, as (results, error), and the error is
+    raised by flush(), or by the next report or flush after the background
+    writer met it.  The rejected results stay in the in-memory standings.
+
+    The state can always be rebuilt from the matches table with load().
+    """
+
+    def __init__(self, tournament, players, results=(), flush_interval=1.0, batch_size=500,
+                 write_behind=True, names=None, open_round=(None, [])):
+        """
+        Args:
+          tournament: the id of the tournament.
+          players: list of (id, name) tuples of the tournament players.
+          results: results already recorded in the database, replayed
+            without writing them again.
+          flush_interval: seconds between background flushes.
+          batch_size: flush early once this many results are waiting.
+          write_behind: with False nothing is written to the database.
+          names: the tiebreaks of the tournament, see tiebreaks.TIEBREAKS;
+            None for the default.
+          open_round: (round, pairs) of the round being played and its pairs
+            not reported yet, see tournament.openRound.
+        """
+        self.tournament = tournament
+        self.tiebreaks = tiebreaks.checkTiebreaks(names)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.names = dict()
+        self.wins = dict()
+        self.matches = dict()
+        self.had_bye = dict()
+        # sum of the wins of the opponents each player beat
+        self.opponent_wins = dict()
+        # player -> players who beat him or her (once per match)
+        self.beaten_by = dict()
+        # player -> everyone he or she played
+        self.opponents = dict()
+        # (winner, loser, p1, p2) of every result, for other tiebreaks
+        self.log = list()
+        # the open round and its pairs not reported yet
+        self.round, self.round_pairs = open_round[0], list(open_round[1])
+        self._standings = None
+        self._lock = threading.RLock()
+        self._pending = list()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self.last_error = None
+        self.rejected = list()
+        # an error of the background writer, raised by the next call
+        self._failure = None
+        for player, name in players:
+            self._addPlayer(player, name)
+        for result in results:
+            self._apply(result)
+        self._writer = None
+        if write_behind:
+            self._writer = threading.Thread(target=self._writeBehind)
+            self._writer.daemon = True
+            self._writer.start()
+
+    @classmethod
+    def load(cls, tournament, **options):
+        """Builds the state of a tournament from its players, matches,
+        tiebreaks and open round."""
+        players, results = api.tournamentHistory(tournament)
+        options.setdefault('names', api.tournamentTiebreaks(tournament))
+        options.setdefault('open_round', api.openRound(tournament))
+        return cls(tournament, players, results, **options)
+
+    def standings(self, with_bye=False):
+        """Same rows, in the same order, as tournament.tournamentPlayerStandings."""
+        with self._lock:
+            if self._standings is None and self.tiebreaks == tiebreaks.DEFAULT_TIEBREAKS:
+                self._standings = sorted(
+                    self.names, key=lambda p: (-self.wins[p], -self.opponent_wins[p], p))
+            elif self._standings is None:
+                rows = tiebreaks.rankStandings([(p, None, self.wins[p]) for p in self.names], self.log,
+                                               self.tiebreaks)
+                self._standings = [row[0] for row in rows]
+            if with_bye:
+                return [(p, self.names[p], self.wins[p], self.matches[p], self.had_bye[p])
+                        for p in self._standings]
+            return [(p, self.names[p], self.wins[p], self.matches[p]) for p in self._standings]
+
+    def swissPairings(self):
+        """The pairs of the open round still to be reported, if a round is
+        open; otherwise the pairs of tournament.swissPairings(tournament,
+        avoid_rematches=True), from memory."""
+        with self._lock:
+            if self.round_pairs:
+                return list(self.round_pairs)
+            return api.pairStandings(self.standings(with_bye=True), self.opponents)
+
+    def reportMatch(self, winner, loser):
+        self.reportRound([('win', winner, loser)])
+
+    def reportTiedMatch(self, p1, p2):
+        self.reportRound([('tie', p1, p2)])
+
+    def reportByeMatch(self, winner):
+        self.reportRound([('bye', winner)])
+
+    def reportRound(self, results):
+        """Records results, see tournament.reportRound for their format.
+
+        They are checked like tournament.reportRound checks them, so that
+        the database takes them later: every player once and registered,
+        and while a round is open only its pairs still to be reported.
+        """
+        results = list(results)
+        with self._lock:
+            self._raiseFailure()
+            if self._closed:
+                raise ValueError("tournament state is closed")
+            players = [player for result in results for player in result[1:]]
+            if len(set(players)) != len(players):
+                raise ValueError("a player appears more than once in the round")
+            for result in results:
+                for player in result[1:]:
+                    if player not in self.names:
+                        raise ValueError("no player {0} in tournament {1}".format(player, self.tournament))
+                if result[0] not in ('win', 'tie', 'bye'):
+                    raise ValueError("unknown match result {0!r}".format(result[0]))
+            paired = self._roundPairs(results)
+            for result in results:
+                self._apply(result)
+            self.round_pairs = [pair for pair in self.round_pairs if pair not in paired]
+            self._pending.extend(results)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def flush(self):
+        """Writes every queued result to the database before returning, then
+        raises the error of a batch the background writer had rejected."""
+        self._flushPending()
+        with self._lock:
+            self._raiseFailure()
+
+    def _flushPending(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, list()
+            if not batch:
+                return
+            try:
+                api.reportResults(self.tournament, batch)
+            except psycopg2.OperationalError as e:
+                # worth another try: keep the batch, in front of anything
+                # queued meanwhile
+                with self._lock:
+                    self._pending[:0] = batch
+                    self.last_error = e
+                raise
+            except Exception as e:
+                # would fail again, and hold up every result queued after it
+                with self._lock:
+                    self.rejected.append((batch, e))
+                    self.last_error = e
+                raise
+            self.last_error = None
+
+    def close(self):
+        """Stops the background writer and flushes what is left."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+
+    def _writeBehind(self):
+        while True:
+            with self._lock:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self._flushPending()
+            except psycopg2.OperationalError:
+                # last_error is set and the batch is retried on the next run
+                pass
+            except Exception as e:
+                with self._lock:
+                    self._failure = e
+
+    def _raiseFailure(self):
+        """Raises the error of a batch the background writer had rejected."""
+        failure, self._failure = self._failure, None
+        if failure is not None:
+            raise failure
+
+    def _roundPairs(self, results):
+        """Returns the pairs of the open round the results report; raises
+        ValueError if a result is not one of them."""
+        if not self.round_pairs:
+            return []
+        pairs = dict()
+        for pair in self.round_pairs:
+            pairs[(pair[0], pair[2])] = pairs[(pair[2], pair[0])] = pair
+        try:
+            return [pairs[(result[1], result[2] if len(result) > 2 else 'bye')] for result in results]
+        except KeyError:
+            raise ValueError(api._unpairedMessage(self.tournament, self.round))
+
+    def _addPlayer(self, player, name):
+        self.names[player] = name
+        self.wins[player] = 0
+        self.matches[player] = 0
+        self.had_bye[player] = False
+        self.opponent_wins[player] = 0
+        self.beaten_by[player] = list()
+        self.opponents[player] = set()
+
+    def _addWin(self, player):
+        self.wins[player] += 1
+        for winner in self.beaten_by[player]:
+            self.opponent_wins[winner] += 1
+
+    def _apply(self, result):
+        kind = result[0]
+        if kind == 'win':
+            winner, loser = result[1:]
+            self.opponent_wins[winner] += self.wins[loser]
+            self.beaten_by[loser].append(winner)
+            self._addWin(winner)
+            self.matches[winner] += 1
+            self.matches[loser] += 1
+            self.opponents[winner].add(loser)
+            self.opponents[loser].add(winner)
+            self.log.append((winner, loser, None, None))
+        elif kind == 'tie':
+            p1, p2 = result[1:]
+            self.matches[p1] += 1
+            self.matches[p2] += 1
+            self.opponents[p1].add(p2)
+            self.opponents[p2].add(p1)
+            self.log.append((None, None, p1, p2))
+        else:
+            winner, = result[1:]
+            self._addWin(winner)
+            self.matches[winner] += 1
+            self.had_bye[winner] = True
+            self.log.append((winner, None, None, None))
+        self._standings = None
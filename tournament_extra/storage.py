@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+#
+# storage.py -- storage backends for the tournament_extra API
+#
+# tournament.py stores everything in PostgreSQL unless another backend is
+# selected, either in code
+#
+#   tournament.configureBackend('memory')
+#
+# or for a whole run with the TOURNAMENT_BACKEND environment variable:
+#
+#   TOURNAMENT_BACKEND=memory python tournament_test.py
+#
+# The memory backend keeps the data in the process and needs no database, for
+# development, CI and what-if simulations.  Its data is lost when the process
+# ends.
+#
+
+import functools
+import itertools
+import threading
+
+from psycopg2 import IntegrityError
+
+import columnar
+import tiebreaks
+import tournament as api
+
+
+class StorageBackend(object):
+    """Interface of a storage backend.
+
+    A backend implements the functions of the tournament API below, with the
+    same arguments (without the cursor c), results and errors.  The
+    PostgreSQL backend is tournament.py itself, used when no other backend
+    is configured.
+    """
+
+    def deleteMatches(self, tournament=None):
+        raise NotImplementedError
+
+    def deletePlayers(self):
+        raise NotImplementedError
+
+    def deleteTournamentPlayers(self, tournament=None):
+        raise NotImplementedError
+
+    def deleteTournaments(self, tournament=None):
+        raise NotImplementedError
+
+    def archiveTournament(self, tournament, out):
+        raise NotImplementedError
+
+    def countPlayers(self):
+        raise NotImplementedError
+
+    def countTournamentPlayers(self, tournament=None):
+        raise NotImplementedError
+
+    def registerPlayer(self, name):
+        raise NotImplementedError
+
+    def registerTournament(self, name):
+        raise NotImplementedError
+
+    def registerTournamentPlayer(self, player, tournament):
+        raise NotImplementedError
+
+    def bulkRegisterPlayers(self, names):
+        raise NotImplementedError
+
+    def bulkRegisterTournamentPlayers(self, tournament, players, ignore_duplicates=True):
+        raise NotImplementedError
+
+    def tournamentPlayerStandings(self, tournament, with_bye=False):
+        raise NotImplementedError
+
+    def columnarStandings(self, tournament):
+        raise NotImplementedError
+
+    def rollupStandings(self, tournament):
+        raise NotImplementedError
+
+    def reportMatch(self, tournament, winner, loser, key=None):
+        raise NotImplementedError
+
+    def reportTiedMatch(self, tournament, p1, p2, key=None):
+        raise NotImplementedError
+
+    def reportByeMatch(self, winner, key=None):
+        raise NotImplementedError
+
+    def reportRound(self, tournament, results, key=None):
+        raise NotImplementedError
+
+    def reportResults(self, tournament, results, key=None):
+        raise NotImplementedError
+
+    def tournamentHistory(self, tournament):
+        raise NotImplementedError
+
+    def tournamentOpponents(self, tournament):
+        raise NotImplementedError
+
+    def tournamentPairings(self, tournament, round=None):
+        raise NotImplementedError
+
+    def openRound(self, tournament):
+        raise NotImplementedError
+
+    def setTiebreaks(self, tournament, names):
+        raise NotImplementedError
+
+    def tournamentTiebreaks(self, tournament):
+        raise NotImplementedError
+
+    # the parts of tournament.pairAllTournaments around the pairing
+    def _openRounds(self, tournaments):
+        raise NotImplementedError
+
+    def _pairingInputs(self, tournaments):
+        raise NotImplementedError
+
+    def _storePairings(self, pairings):
+        raise NotImplementedError
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def call_locked(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return call_locked
+
+
+class TournamentPlayer(object):
+    __slots__ = ('player', 'tournament', 'wins', 'matches', 'had_bye')
+
+    def __init__(self, player, tournament):
+        self.player = player
+        self.tournament = tournament
+        self.wins = 0
+        self.matches = 0
+        self.had_bye = False
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps players, tournaments and matches in dicts of this process.
+
+    Behaves like the PostgreSQL schema: serial ids, deletes cascade the way
+    the foreign keys do, unknown or duplicate registrations raise
+    psycopg2.IntegrityError, and a bad batch of results changes nothing.
+    The counters are updated as results come in (one lock guards them
+    anyway), so there is nothing to roll up.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._players = dict()
+        self._tournaments = dict()
+        self._tournament_players = dict()
+        # match id -> (tournament, winner, loser, p1, p2), in id order
+        self._matches = dict()
+        self._next_player = itertools.count(1)
+        self._next_tournament = itertools.count(1)
+        self._next_tournament_player = itertools.count(1)
+        self._next_match = itertools.count(1)
+        # idempotency key -> tournament of the report that used it
+        self._report_keys = dict()
+        # tournament -> the [pair, reported] of each stored round, first round first
+        self._pairings = dict()
+        # tournament -> its tiebreaks, unless they are the default ones
+        self._tiebreaks = dict()
+        self._reindex()
+
+    def _reindex(self):
+        # tournament -> its tournament player ids, (tournament, player) -> id
+        self._rosters = dict()
+        self._registrations = dict()
+        for tp_id, tp in self._tournament_players.items():
+            self._rosters.setdefault(tp.tournament, set()).add(tp_id)
+            self._registrations[(tp.tournament, tp.player)] = tp_id
+        # winner -> losers he or she beat, for the opponent wins tiebreak
+        self._beaten = dict()
+        for (tournament, winner, loser, p1, p2) in self._matches.values():
+            if loser is not None:
+                self._beaten.setdefault(winner, []).append(loser)
+
+    def _deleteWhere(self, tournament_players=(), matches=None):
+        """Deletes tournament players and the matches that name them."""
+        gone = set(tournament_players)
+        for tp_id in gone:
+            del self._tournament_players[tp_id]
+        for rounds in self._pairings.values():
+            for entries in rounds:
+                entries[:] = [entry for entry in entries if not gone.intersection(entry[0][0::2])]
+        for match_id, match in list(self._matches.items()):
+            if (matches is not None and matches(match)) or gone.intersection(match[1:]):
+                del self._matches[match_id]
+        self._reindex()
+
+    def _ids(self, ids):
+        """Like tournament._tournamentPlayerIds, against the registrations."""
+        ids = list(ids)
+        legacy = api._legacyIds(ids)
+        if not legacy:
+            return [int(value) for value in ids]
+        rows = [key + (self._registrations[key], ) for key in set(legacy.values()) if key in self._registrations]
+        return api._translateIds(ids, legacy, rows)
+
+    def _insertMatch(self, tournament, winner=None, loser=None, p1=None, p2=None):
+        for tp_id in (winner, loser, p1, p2):
+            if tp_id is not None and tp_id not in self._tournament_players:
+                raise IntegrityError("no tournament player {0}".format(tp_id))
+        if tournament not in self._tournaments:
+            raise IntegrityError("no tournament {0}".format(tournament))
+        self._matches[next(self._next_match)] = (tournament, winner, loser, p1, p2)
+        if loser is not None:
+            self._beaten.setdefault(winner, []).append(loser)
+
+    def _openRound(self, tournament):
+        """Returns the number of the open round of a tournament, or None."""
+        rounds = self._pairings.get(tournament, [])
+        for number in range(len(rounds), 0, -1):
+            if not all(reported for (_, reported) in rounds[number - 1]):
+                return number
+        return None
+
+    def _unreportedPairings(self, tournament, matches):
+        """Like tournament._reportPairings, except that it returns the
+        [pair, reported] entries for the caller to mark once the matches
+        are recorded."""
+        number = self._openRound(tournament)
+        if number is None:
+            return []
+        keys = set(zip(*api._pairingKeys(matches)))
+        entries = [entry for entry in self._pairings[tournament][number - 1]
+                   if not entry[1] and (entry[0][0], None if entry[0][2] == 'bye' else entry[0][2]) in keys]
+        if len(entries) != len(matches):
+            raise ValueError(api._unpairedMessage(tournament, number))
+        return entries
+
+    def _forgetReportKeys(self, tournament=None):
+        for key, reported in list(self._report_keys.items()):
+            if tournament is None or reported == tournament:
+                del self._report_keys[key]
+
+    @_locked
+    def deleteMatches(self, tournament=None):
+        if tournament:
+            self._deleteWhere(matches=lambda match: match[0] == tournament)
+        else:
+            self._deleteWhere(matches=lambda match: True)
+        self._forgetReportKeys(tournament or None)
+        if tournament:
+            self._pairings.pop(tournament, None)
+        else:
+            self._pairings.clear()
+        for tp in self._tournament_players.values():
+            if not tournament or tp.tournament == tournament:
+                tp.wins, tp.matches, tp.had_bye = 0, 0, False
+
+    @_locked
+    def deletePlayers(self):
+        self._players.clear()
+        self._pairings.clear()
+        self._deleteWhere(self._tournament_players)
+        self._forgetReportKeys()
+
+    @_locked
+    def deleteTournamentPlayers(self, tournament=None):
+        if tournament:
+            self._pairings.pop(tournament, None)
+            self._deleteWhere(self._rosters.get(tournament, ()))
+        else:
+            self._pairings.clear()
+            self._deleteWhere(self._tournament_players)
+        self._forgetReportKeys(tournament or None)
+
+    @_locked
+    def deleteTournaments(self, tournament=None):
+        if tournament:
+            self._tournaments.pop(tournament, None)
+            self._pairings.pop(tournament, None)
+            self._tiebreaks.pop(tournament, None)
+            self._deleteWhere(self._rosters.get(tournament, ()), lambda match: match[0] == tournament)
+        else:
+            self._tournaments.clear()
+            self._pairings.clear()
+            self._tiebreaks.clear()
+            self._deleteWhere(self._tournament_players, lambda match: True)
+        self._forgetReportKeys(tournament or None)
+
+    @_locked
+    def archiveTournament(self, tournament, out):
+        # there are no tables to keep, only the export
+        if tournament not in self._tournaments:
+            raise ValueError("no tournament {0}".format(tournament))
+        players, results = self.tournamentHistory(tournament)
+        rounds = [(round, self.tournamentPairings(tournament, round))
+                  for round in range(1, len(self._pairings.get(tournament, [])) + 1)]
+        out.writelines(api._archiveLines(tournament, self._tournaments[tournament],
+                                         self.tournamentTiebreaks(tournament), players, results, rounds))
+        self.deleteTournaments(tournament)
+        return []
+
+    @_locked
+    def countPlayers(self):
+        return len(self._players)
+
+    @_locked
+    def countTournamentPlayers(self, tournament=None):
+        if tournament:
+            return len(self._rosters.get(tournament, ()))
+        return len(self._tournament_players)
+
+    @_locked
+    def registerPlayer(self, name):
+        player = next(self._next_player)
+        self._players[player] = name
+        return player
+
+    @_locked
+    def registerTournament(self, name):
+        tournament = next(self._next_tournament)
+        self._tournaments[tournament] = name
+        return tournament
+
+    @_locked
+    def registerTournamentPlayer(self, player, tournament):
+        if player not in self._players or tournament not in self._tournaments:
+            raise IntegrityError("no player {0} or no tournament {1}".format(player, tournament))
+        if (tournament, player) in self._registrations:
+            raise IntegrityError("player {0} is already registered in tournament {1}".format(player, tournament))
+        tp_id = next(self._next_tournament_player)
+        self._tournament_players[tp_id] = TournamentPlayer(player, tournament)
+        self._rosters.setdefault(tournament, set()).add(tp_id)
+        self._registrations[(tournament, player)] = tp_id
+        return tp_id
+
+    @_locked
+    def bulkRegisterPlayers(self, names):
+        return [self.registerPlayer(name) for name in api._bulkLines(names)]
+
+    @_locked
+    def bulkRegisterTournamentPlayers(self, tournament, players, ignore_duplicates=True):
+        players = [int(player) for player in api._bulkLines(players)]
+        for player in players:
+            if player not in self._players or tournament not in self._tournaments:
+                raise IntegrityError("no player {0} or no tournament {1}".format(player, tournament))
+        if not ignore_duplicates:
+            duplicates = sorted(set(player for player in players
+                                    if players.count(player) > 1 or (tournament, player) in self._registrations))
+            if duplicates:
+                raise ValueError("players registered more than once in tournament {0}: {1}".format(
+                    tournament, ', '.join(str(player) for player in duplicates[:10])))
+        ids = list()
+        for player in players:
+            if (tournament, player) not in self._registrations:
+                self.registerTournamentPlayer(player, tournament)
+            ids.append(self._registrations[(tournament, player)])
+        return ids
+
+    def _standings(self, tournament):
+        """Returns (id, name, wins, matches, had_bye, tiebreak) rows in standings order."""
+        roster = self._rosters.get(tournament, ())
+        tps = self._tournament_players
+        rows = list()
+        for tp_id in roster:
+            tp = tps[tp_id]
+            tiebreak = sum(tps[loser].wins for loser in self._beaten.get(tp_id, ()))
+            rows.append((tp_id, self._players[tp.player], tp.wins, tp.matches, tp.had_bye, tiebreak))
+        names = self._tiebreaks.get(tournament)
+        if names is not None:
+            results = [match[1:] for (_, match) in sorted(self._matches.items()) if match[0] == tournament]
+            return tiebreaks.rankStandings(rows, results, names)
+        rows.sort(key=lambda row: (-row[2], -row[5], row[0]))
+        return rows
+
+    @_locked
+    def tournamentPlayerStandings(self, tournament, with_bye=False):
+        if with_bye:
+            return [row[:5] for row in self._standings(tournament)]
+        return [row[:4] for row in self._standings(tournament)]
+
+    @_locked
+    def columnarStandings(self, tournament):
+        rows = self._standings(tournament)
+        if tournament in self._tiebreaks:
+            rows = api._columnarRows(rows)
+        return columnar.ColumnarStandings.fromRows(rows)
+
+    @_locked
+    def setTiebreaks(self, tournament, names):
+        names = tiebreaks.checkTiebreaks(names)
+        if tournament not in self._tournaments:
+            raise ValueError("no tournament {0}".format(tournament))
+        if names == tiebreaks.DEFAULT_TIEBREAKS:
+            self._tiebreaks.pop(tournament, None)
+        else:
+            self._tiebreaks[tournament] = names
+
+    @_locked
+    def tournamentTiebreaks(self, tournament):
+        return self._tiebreaks.get(tournament, tiebreaks.DEFAULT_TIEBREAKS)
+
+    def rollupStandings(self, tournament):
+        return 0
+
+    def _claimReportKey(self, key, tournament):
+        """Stores the idempotency key of a report; False if it was stored before.
+
+        Called once the report is known to succeed: a failed report leaves
+        its key unused, like the rolled back transaction in PostgreSQL.
+        """
+        if key is None:
+            return True
+        if key in self._report_keys:
+            return False
+        self._report_keys[key] = tournament
+        return True
+
+    @_locked
+    def reportMatch(self, tournament, winner, loser, key=None):
+        winner, loser = self._ids([winner, loser])
+        if key in self._report_keys:
+            return False
+        entries = self._unreportedPairings(tournament, [(tournament, winner, loser, None, None)])
+        self._insertMatch(tournament, winner=winner, loser=loser)
+        for entry in entries:
+            entry[1] = True
+        self._tournament_players[winner].wins += 1
+        self._tournament_players[winner].matches += 1
+        self._tournament_players[loser].matches += 1
+        return self._claimReportKey(key, tournament)
+
+    @_locked
+    def reportTiedMatch(self, tournament, p1, p2, key=None):
+        p1, p2 = self._ids([p1, p2])
+        if key in self._report_keys:
+            return False
+        entries = self._unreportedPairings(tournament, [(tournament, None, None, p1, p2)])
+        self._insertMatch(tournament, p1=p1, p2=p2)
+        for entry in entries:
+            entry[1] = True
+        self._tournament_players[p1].matches += 1
+        self._tournament_players[p2].matches += 1
+        return self._claimReportKey(key, tournament)
+
+    @_locked
+    def reportByeMatch(self, winner, key=None):
+        winner, = self._ids([winner])
+        tp = self._tournament_players.get(winner)
+        if tp is None:
+            raise ValueError("no tournament player {0}".format(winner))
+        if key in self._report_keys:
+            return False
+        entries = self._unreportedPairings(tp.tournament, [(tp.tournament, winner, None, None, None)])
+        tp.wins += 1
+        tp.matches += 1
+        tp.had_bye = True
+        self._insertMatch(tp.tournament, winner=winner)
+        for entry in entries:
+            entry[1] = True
+        return self._claimReportKey(key, tp.tournament)
+
+    @_locked
+    def reportRound(self, tournament, results, key=None):
+        players = self._ids([player for result in results for player in result[1:]])
+        if len(set(players)) != len(players):
+            raise ValueError("a player appears more than once in the round")
+        return self.reportResults(tournament, results, key)
+
+    @_locked
+    def reportResults(self, tournament, results, key=None):
+        matches, records = api._collectResults(tournament, results)
+        if key in self._report_keys:
+            return False
+        if not records:
+            return self._claimReportKey(key, tournament)
+        ids = dict(zip(records, self._ids(records)))
+        deltas, matches = api._resultRows(tournament, matches, records, ids)
+        for (tp_id, _, wins, played, had_bye) in deltas:
+            tp = self._tournament_players.get(tp_id)
+            if tp is None or tp.tournament != tournament:
+                raise ValueError("results name players who are not registered in tournament {0}".format(
+                    tournament))
+        if tournament not in self._tournaments:
+            raise IntegrityError("no tournament {0}".format(tournament))
+        entries = self._unreportedPairings(tournament, matches)
+        for entry in entries:
+            entry[1] = True
+        for (tp_id, _, wins, played, had_bye) in deltas:
+            tp = self._tournament_players[tp_id]
+            tp.wins += wins
+            tp.matches += played
+            tp.had_bye = tp.had_bye or had_bye
+        for match in matches:
+            self._insertMatch(*match)
+        return self._claimReportKey(key, tournament)
+
+    @_locked
+    def tournamentHistory(self, tournament):
+        players = [(tp_id, self._players[self._tournament_players[tp_id].player])
+                   for tp_id in sorted(self._rosters.get(tournament, ()))]
+        rows = [match[1:] for match_id, match in sorted(self._matches.items()) if match[0] == tournament]
+        return players, api._historyResults(rows)
+
+    @_locked
+    def tournamentOpponents(self, tournament):
+        matches = [match for match in self._matches.values() if match[0] == tournament]
+        return api._opponentsMap((player, opponent) for (_, player, opponent) in api._opponentRows(matches))
+
+    @_locked
+    def tournamentPairings(self, tournament, round=None):
+        rounds = self._pairings.get(tournament, [])
+        if round is None:
+            round = len(rounds)
+        if not 1 <= round <= len(rounds):
+            return []
+        return [pair for (pair, _) in rounds[round - 1]]
+
+    @_locked
+    def _openRounds(self, tournaments):
+        rounds = dict()
+        for tournament in tournaments:
+            number = self._openRound(tournament)
+            if number is not None:
+                rounds[tournament] = (number, self.tournamentPairings(tournament, number))
+        return rounds
+
+    @_locked
+    def openRound(self, tournament):
+        number = self._openRound(tournament)
+        if number is None:
+            return None, []
+        return number, [pair for (pair, reported) in self._pairings[tournament][number - 1] if not reported]
+
+    @_locked
+    def _pairingInputs(self, tournaments):
+        return [(tournament, [row[:5] for row in self._standings(tournament)], self.tournamentOpponents(tournament))
+                for tournament in tournaments]
+
+    @_locked
+    def _storePairings(self, pairings):
+        stored = self._openRounds(pairings)
+        new = [(tournament, pairs) for (tournament, pairs) in pairings.items() if tournament not in stored and pairs]
+        for (tournament, _) in new:
+            if tournament not in self._tournaments:
+                raise IntegrityError("no tournament {0}".format(tournament))
+        rounds = dict((tournament, (None, [])) for tournament in pairings)
+        for (tournament, pairs) in new:
+            entries = self._pairings.setdefault(tournament, [])
+            entries.append([[pair, False] for pair in pairs])
+            rounds[tournament] = (len(entries), list(pairs))
+        rounds.update(stored)
+        return rounds
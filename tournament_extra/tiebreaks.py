@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+# tiebreaks.py -- tiebreaks of a whole tournament, computed in one pass
+#
+# The standings rank players by wins; players with equal wins are ranked by
+# tiebreaks.  By default that is the wins of the opponents each player beat
+# ('opponent_match_wins').  A tournament can use others instead, see
+# tournament.setTiebreaks:
+#
+#   'omw'         opponent match-win percentage: the mean of the match-win
+#                 percentages (score / matches, at least OMW_FLOOR) of every
+#                 opponent, byes excluded
+#   'buchholz'    the sum of the scores of every opponent ('sos', sum of
+#                 opponents' scores, is the same)
+#   'cumulative'  the sum of the player's score after each of his or her
+#                 matches, so early wins count more
+#
+# Scores count a win or bye as 1 and a tie as 1/2.  Every opponent counts
+# once per match, ties included.  The match log is turned into one row per
+# player and match (player, points, opponent), i.e. the opponent matrix in
+# coordinate form, and every tiebreak is a weighted sum over its rows: one
+# numpy.bincount each when NumPy is installed, one loop otherwise.
+#
+#   columns = computeTiebreaks(ids, wins, results, ('omw', 'buchholz'))
+#   rows = rankStandings(rows, results, ('omw', 'buchholz'))
+#
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+TIEBREAKS = ('opponent_match_wins', 'omw', 'buchholz', 'sos', 'cumulative')
+DEFAULT_TIEBREAKS = ('opponent_match_wins', )
+
+# the match-win percentage counted for an opponent who won less
+OMW_FLOOR = 1.0 / 3
+
+# float tiebreaks are rounded, so equal values compare equal whatever order
+# they were summed in
+DIGITS = 9
+
+
+def checkTiebreaks(names):
+    """Returns the tiebreak names as a tuple, DEFAULT_TIEBREAKS for none.
+
+    Raises ValueError for an unknown name.
+    """
+    names = tuple(names or DEFAULT_TIEBREAKS)
+    unknown = [name for name in names if name not in TIEBREAKS]
+    if unknown:
+        raise ValueError("unknown tiebreak {0!r}, expected one of {1}".format(unknown[0], ', '.join(TIEBREAKS)))
+    return names
+
+
+def _edges(results):
+    """Yields (player, points, opponent) of each player of each result, in
+    order; opponent is None for a bye.
+
+    results are (winner, loser, p1, p2) rows of matches, in id order.
+    """
+    for (winner, loser, p1, p2) in results:
+        if p1 is not None:
+            yield p1, 0.5, p2
+            yield p2, 0.5, p1
+        elif loser is not None:
+            yield winner, 1.0, loser
+            yield loser, 0.0, winner
+        else:
+            yield winner, 1.0, None
+
+
+def computeTiebreaks(ids, wins, results, names):
+    """Computes tiebreaks of every player of a tournament.
+
+    Args:
+      ids: the player ids
+      wins: the wins of each player, as in the standings
+      results: the (winner, loser, p1, p2) rows of the tournament's matches,
+        in id order
+      names: the tiebreaks, see TIEBREAKS
+
+    Returns:
+      one column per name, a value per player of ids
+    """
+    names = checkTiebreaks(names)
+    index = dict((player, i) for (i, player) in enumerate(ids))
+    edges = [(index[player], points, None if opponent is None else index[opponent])
+             for (player, points, opponent) in _edges(results)]
+    if numpy is not None:
+        columns = _numpyTiebreaks(len(index), numpy.asarray(wins, dtype=numpy.float64), edges)
+        return [columns[name].tolist() for name in names]
+    columns = _pythonTiebreaks(len(index), wins, edges)
+    return [columns[name] for name in names]
+
+
+def _numpyTiebreaks(count, wins, edges):
+    player = numpy.array([edge[0] for edge in edges], dtype=numpy.int64)
+    points = numpy.array([edge[1] for edge in edges], dtype=numpy.float64)
+    opponent = numpy.array([-1 if edge[2] is None else edge[2] for edge in edges], dtype=numpy.int64)
+    score = numpy.bincount(player, weights=points, minlength=count)
+    played = numpy.bincount(player, minlength=count)
+    paired = opponent >= 0
+    source, target = player[paired], opponent[paired]
+    beaten = paired & (points == 1.0)
+    opponents = numpy.bincount(source, minlength=count)
+    percentage = numpy.maximum(OMW_FLOOR, score / numpy.maximum(played, 1))
+    omw = numpy.bincount(source, weights=percentage[target], minlength=count) / numpy.maximum(opponents, 1)
+    buchholz = numpy.bincount(source, weights=score[target], minlength=count)
+    # the k-th of a player's n matches adds its points to n - k running scores
+    order = numpy.argsort(player, kind='stable')
+    ordered = player[order]
+    position = numpy.arange(len(ordered)) - (numpy.cumsum(played) - played)[ordered]
+    cumulative = numpy.bincount(ordered, weights=points[order] * (played[ordered] - position), minlength=count)
+    return {
+        'opponent_match_wins': numpy.bincount(player[beaten], weights=wins[opponent[beaten]],
+                                              minlength=count).astype(numpy.int64),
+        'omw': numpy.round(omw, DIGITS),
+        'buchholz': buchholz,
+        'sos': buchholz,
+        'cumulative': cumulative,
+    }
+
+
+def _pythonTiebreaks(count, wins, edges):
+    score = [0.0] * count
+    played = [0] * count
+    for (player, points, _) in edges:
+        score[player] += points
+        played[player] += 1
+    opponent_match_wins = [0] * count
+    percentages = [0.0] * count
+    opponents = [0] * count
+    buchholz = [0.0] * count
+    cumulative = [0.0] * count
+    running = [0.0] * count
+    for (player, points, opponent) in edges:
+        running[player] += points
+        cumulative[player] += running[player]
+        if opponent is None:
+            continue
+        if points == 1.0:
+            opponent_match_wins[player] += wins[opponent]
+        percentages[player] += max(OMW_FLOOR, score[opponent] / played[opponent])
+        opponents[player] += 1
+        buchholz[player] += score[opponent]
+    omw = [round(total / number, DIGITS) if number else 0.0 for (total, number) in zip(percentages, opponents)]
+    return {
+        'opponent_match_wins': opponent_match_wins,
+        'omw': omw,
+        'buchholz': buchholz,
+        'sos': buchholz,
+        'cumulative': cumulative,
+    }
+
+
+def rankStandings(rows, results, names):
+    """Returns standings rows ranked by wins, then the tiebreaks, then id.
+
+    Args:
+      rows: standings rows, (id, name, wins, ...) tuples in any order
+      results: the (winner, loser, p1, p2) rows of the tournament's matches,
+        in id order
+      names: the tiebreaks, see TIEBREAKS
+    """
+    rows = list(rows)
+    ids = [row[0] for row in rows]
+    wins = [row[2] for row in rows]
+    columns = computeTiebreaks(ids, wins, results, names)
+    if numpy is not None:
+        # lexsort sorts by the last key first
+        keys = [numpy.asarray(ids)] + [-numpy.asarray(column) for column in reversed(columns)]
+        order = numpy.lexsort(keys + [-numpy.asarray(wins)]).tolist() if rows else []
+    else:
+        order = sorted(range(len(rows)),
+                       key=lambda i: (-wins[i], ) + tuple(-column[i] for column in columns) + (ids[i], ))
+    return [rows[i] for i in order]
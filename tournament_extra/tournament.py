@@ -3,83 +3,836 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
+import array
+import collections
+import contextlib
+import csv
+import functools
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+import warnings
+
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+import cache
+import columnar
+import metrics
+import pairing
+import pool
+import tiebreaks
+
+DSN = "dbname=tournament_extra"
+POOL_SIZE = 10
+STANDINGS_CACHE_SIZE = 256
+# bulk imports of at least this many rows refresh the planner statistics
+BULK_ANALYZE_ROWS = 10000
+# rows per round trip of the streaming exports
+STREAM_FETCH_SIZE = 2000
+# attempts of a report that hits a deadlock or serialization failure
+REPORT_ATTEMPTS = 5
+# where archiveTournament moves the partitions of a tournament
+ARCHIVE_SCHEMA = 'archive'
+# tournaments whose partitions deleteTournaments drops per transaction
+DROP_PARTITIONS_BATCH = 50
+# tournaments registerTournament creates the partitions of at once
+PARTITIONS_AHEAD = 32
+# the tables with a partition per tournament, see migrations/0011_partitions.sql;
+# matches references tournament_players, so it goes first
+PARTITIONED_TABLES = ('matches', 'tournament_players')
+
+_pool = None
+_read_pool = None
+# the DSN of a read replica, None to read from DSN, see configureReadPool
+_read_dsn = None
+# None stores everything in PostgreSQL, see configureBackend
+_backend = None
+_standings_cache = cache.StandingsCache(STANDINGS_CACHE_SIZE)
+# None turns the instrumentation off, see configureMetrics
+_metrics = None
+# callbacks waiting for the commit of the current thread's transaction
+_local = threading.local()
 
 
 def connect():
     """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament_extra")
+    return psycopg2.connect(DSN)
 
 
-def deleteMatches(tournament=None):
-    """Remove all the match records from the database."""
-    db = connect()
-    c = db.cursor()
+def getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = pool.ConnectionPool(DSN, size=POOL_SIZE, events=_metrics)
+    return _pool
+
+
+def configurePool(size=POOL_SIZE, health_check=True, enabled=True, **kwargs):
+    """Replaces the shared connection pool.
+
+    Args:
+      size: maximum number of pooled connections.
+      health_check: check idle connections before reusing them.
+      enabled: with False, every call opens and closes its own connection.
+      kwargs: passed on to pool.ConnectionPool (timeout, ping_after, ...).
+    """
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+    kwargs.setdefault('events', _metrics)
+    if enabled:
+        _pool = pool.ConnectionPool(DSN, size=size, health_check=health_check, **kwargs)
+    else:
+        _pool = pool.NullPool(DSN, **kwargs)
+    configureReadPool(_read_dsn, size=size, health_check=health_check, enabled=enabled, **kwargs)
+    return _pool
+
+
+def closePool():
+    """Closes every pooled connection; the next call opens new pools."""
+    global _pool, _read_pool
+    for db_pool in (_pool, _read_pool):
+        if db_pool is not None:
+            db_pool.closeall()
+    _pool = _read_pool = None
+
+
+def getReadPool():
+    """Returns the pool of read only connections, creating it on first use."""
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = pool.ConnectionPool(_read_dsn or DSN, size=POOL_SIZE, events=_metrics, read_only=True)
+    return _read_pool
+
+
+def configureReadPool(dsn=None, size=POOL_SIZE, health_check=True, enabled=True, **kwargs):
+    """Replaces the pool the read only queries run on, see read_db.
+
+    configurePool replaces it too, with the same settings and DSN.
+
+    Args:
+      dsn: libpq connection string of a read replica, None to read from DSN.
+        Standings read from a replica are not cached, and swissPairings
+        still reads the standings it pairs from DSN.
+      size: maximum number of pooled connections.
+      health_check: check idle connections before reusing them.
+      enabled: with False, every call opens and closes its own connection.
+      kwargs: passed on to pool.ConnectionPool (timeout, ping_after, ...).
+    """
+    global _read_pool, _read_dsn
+    if _read_pool is not None:
+        _read_pool.closeall()
+    _read_dsn = dsn
+    kwargs.setdefault('events', _metrics)
+    if enabled:
+        _read_pool = pool.ConnectionPool(dsn or DSN, size=size, health_check=health_check, read_only=True, **kwargs)
+    else:
+        _read_pool = pool.NullPool(dsn or DSN, read_only=True, **kwargs)
+    return _read_pool
+
+
+def configureBackend(backend=None):
+    """Selects where tournaments are stored.
+
+    Args:
+      backend: None or 'postgresql' for the PostgreSQL database, 'memory'
+        for a new storage.MemoryBackend, or any storage.StorageBackend.
+
+    Returns:
+      The backend, None for PostgreSQL.
+    """
+    global _backend
+    if backend in (None, 'postgresql'):
+        _backend = None
+    elif backend == 'memory':
+        import storage
+        _backend = storage.MemoryBackend()
+    elif hasattr(backend, 'reportResults'):
+        _backend = backend
+    else:
+        raise ValueError("unknown storage backend {0!r}".format(backend))
+    return _backend
+
+
+def getBackend():
+    """Returns the configured storage backend, None for PostgreSQL."""
+    return _backend
+
+
+def configureStandingsCache(size=STANDINGS_CACHE_SIZE):
+    """Replaces the standings cache with one of size tournaments (0 disables it)."""
+    global _standings_cache
+    _standings_cache = cache.StandingsCache(size)
+    return _standings_cache
+
+
+def standingsCacheStats():
+    """Returns a dict of the hits, misses, evictions and size of the standings cache."""
+    return _standings_cache.stats()
+
+
+def configureMetrics(sink=None):
+    """Turns the instrumentation of the API on or off.
+
+    Args:
+      sink: a metrics.MetricsSink (e.g. metrics.Registry()) that gets the
+        measurements of every call and connection, None to turn it off.
+
+    Returns:
+      The sink.
+    """
+    global _metrics
+    _metrics = sink
+    for db_pool in (_pool, _read_pool):
+        if db_pool is not None:
+            db_pool.events = sink
+    return sink
+
+
+def getMetrics():
+    """Returns the configured metrics sink, None if the instrumentation is off."""
+    return _metrics
+
+
+def connect_db(func):
+    """decorator to streamline db connection related code
+
+    With a storage backend configured, the call goes to the backend method
+    of the same name instead.  With a metrics sink configured, the call is
+    measured, see configureMetrics.
+    """
+    @functools.wraps(func)
+    def connect_db_and_call(*args, **kwargs):
+        if _metrics is not None:
+            return _meteredCall(func, args, kwargs)
+        return _callInTransaction(func, args, kwargs)
+    return connect_db_and_call
+
+
+def _callInTransaction(func, args, kwargs, stats=None):
+    if _backend is not None:
+        kwargs.pop('c', None)
+        return getattr(_backend, func.__name__)(*args, **kwargs)
+    db_pool = getPool()
+    if stats is None:
+        db = db_pool.getconn()
+    else:
+        start = time.time()
+        db = db_pool.getconn()
+        stats.connect_seconds = time.time() - start
+    outermost = db_pool.depth == 1
+    if outermost:
+        _local.after_commit = list()
+    try:
+        c = db.cursor() if stats is None else metrics.meteredCursor(db)
+        kwargs['c'] = c
+        result = func(*args, **kwargs)
+        c.close()
+        if outermost and stats is None:
+            db.commit()
+        elif outermost:
+            start = time.time()
+            db.commit()
+            stats.commits = 1
+            stats.commit_seconds = time.time() - start
+    finally:
+        db_pool.putconn(db)
+    if outermost:
+        for callback, callback_args in _local.after_commit:
+            callback(*callback_args)
+    return result
+
+
+def _meteredCall(func, args, kwargs, call=_callInTransaction):
+    sink = _metrics
+    stats = metrics.startCall(func.__name__)
+    start = time.time()
+    try:
+        return call(func, args, kwargs, stats)
+    except Exception:
+        stats.error = True
+        raise
+    finally:
+        metrics.finishCall(sink, stats, start)
+
+
+def read_db(func):
+    """decorator for functions that only read
+
+    Like connect_db, but the call runs on a connection of the read pool
+    (see configureReadPool): read only, in autocommit mode, so there is no
+    transaction to commit, and its statements are prepared once per
+    connection, see _executePrepared.  Called inside the transaction of a
+    connect_db function, it runs in that transaction instead, so it sees
+    the transaction's changes; within _readPrimary() it does too, if the
+    read pool is a replica.
+    """
+    @functools.wraps(func)
+    def read_db_and_call(*args, **kwargs):
+        if _backend is not None or getPool().depth or (_read_dsn is not None and getattr(_local, 'primary', 0)):
+            call = _callInTransaction
+        else:
+            call = _callReadOnly
+        if _metrics is not None:
+            return _meteredCall(func, args, kwargs, call)
+        return call(func, args, kwargs)
+    return read_db_and_call
+
+
+def _callReadOnly(func, args, kwargs, stats=None):
+    db_pool = getReadPool()
+    if stats is None:
+        db = db_pool.getconn()
+    else:
+        start = time.time()
+        db = db_pool.getconn()
+        stats.connect_seconds = time.time() - start
+    try:
+        c = db.cursor() if stats is None else metrics.meteredCursor(db)
+        kwargs['c'] = c
+        result = func(*args, **kwargs)
+        c.close()
+    finally:
+        db_pool.putconn(db)
+    return result
+
+
+@contextlib.contextmanager
+def _readPrimary():
+    """Runs the read_db calls of the block on DSN, even if the read pool is
+    a replica: for reads that must see every committed change."""
+    _local.primary = getattr(_local, 'primary', 0) + 1
+    try:
+        yield
+    finally:
+        _local.primary -= 1
+
+
+# the statements read_db functions prepare: name -> query
+PREPARED_QUERIES = dict()
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+
+def _prepareQuery(name, query):
+    """Registers query, with %s or %(name)s parameters, as the prepared
+    statement name and returns it."""
+    keys = list()
+
+    def number(match):
+        if match.group(0) == '%%':
+            return '%'
+        key = match.group(1) if match.group(1) else len(keys)
+        if key not in keys:
+            keys.append(key)
+        return '${0}'.format(keys.index(key) + 1)
+    PREPARED_QUERIES[name] = (query, _PLACEHOLDER.sub(number, query), keys)
+    return query
+
+
+def _executePrepared(c, name, params=()):
+    """Executes the statement name (see _prepareQuery) with params.
+
+    On a connection of the read pool the statement is prepared the first
+    time, and then executed by name with the plan the server cached; other
+    connections execute the query text.
+    """
+    query, numbered, keys = PREPARED_QUERIES[name]
+    prepared = getattr(c.connection, 'prepared', None)
+    if prepared is None:
+        c.execute(query, params)
+        return
+    if name not in prepared:
+        c.execute("prepare {0} as {1}".format(name, numbered))
+        prepared.add(name)
+    if not keys:
+        c.execute("execute {0}".format(name))
+        return
+    c.execute("execute {0}({1})".format(name, ', '.join(['%s'] * len(keys))), [params[key] for key in keys])
+
+
+def retry_on_conflict(func):
+    """decorator retrying a transaction PostgreSQL rolled back
+
+    A deadlock or serialization failure rolls the whole transaction back, so
+    the outermost call simply runs again, after a short random backoff, up to
+    REPORT_ATTEMPTS times.  A call inside another transaction leaves the
+    retry to the outermost one.
+    """
+    @functools.wraps(func)
+    def retry_and_call(*args, **kwargs):
+        if _backend is not None or getPool().depth:
+            return func(*args, **kwargs)
+        for attempt in range(REPORT_ATTEMPTS - 1):
+            try:
+                return func(*args, **kwargs)
+            except psycopg2.extensions.TransactionRollbackError:
+                time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+        return func(*args, **kwargs)
+    return retry_and_call
+
+
+def _afterCommit(callback, *args):
+    """Calls callback(*args) once the current transaction has committed.
+
+    Nothing is called if the transaction is rolled back.
+    """
+    _local.after_commit.append((callback, args))
+
+
+def _invalidateStandings(tournament=None):
+    """Drops the cached standings of tournament (of all tournaments if None).
+
+    This happens after the commit: invalidating earlier would let another
+    thread cache the standings as they were before the commit.
+    """
+    _afterCommit(_standings_cache.invalidate, None if tournament is None else int(tournament))
+
+
+def _tournamentPlayerIds(ids, c):
+    """Translates tournament player ids into the integer ids of the database.
+
+    Integer ids are returned as they are.  Legacy "<tournament>-<player>"
+    text ids (what registerTournamentPlayer returned before tournament_players
+    got integer keys) are looked up by (tournament, player); they are
+    deprecated and will stop working in a future version.
+
+    Raises ValueError for a legacy id of a player who is not registered.
+    """
+    ids = list(ids)
+    legacy = _legacyIds(ids)
+    if not legacy:
+        return [int(value) for value in ids]
+    c.execute(LEGACY_IDS_QUERY, (tuple(set(legacy.values())), ))
+    return _translateIds(ids, legacy, c.fetchall())
+
+
+REPORT_KEY_QUERY = "insert into result_reports (key, tournament) values (%s, %s) on conflict do nothing"
+
+APPEND_LOCK_QUERY = "select closed from tournaments where id = %s for key share"
+
+
+def _claimReportKey(key, tournament, c):
+    """Stores the idempotency key of a report.
+
+    Returns False if the key was stored before, i.e. the report is a repeat
+    and must change nothing.  Without a key every report is new.
+    """
+    if key is None:
+        return True
+    c.execute(REPORT_KEY_QUERY, (key, tournament))
+    return c.rowcount == 1
+
+
+def _appendLock(tournament, c):
+    """Takes the lock of a report appending matches to a tournament.
+
+    The foreign key check of the insert takes the same lock, but only once
+    the match has its id; taken first, it makes rollupStandings wait for
+    every match numbered before the ones it folds.  Reports do not block
+    each other.
+
+    Raises ValueError if the tournament is closed, i.e. being archived or
+    deleted.
+    """
+    c.execute(APPEND_LOCK_QUERY, (tournament, ))
+    row = c.fetchone()
+    if row is not None and row[0]:
+        raise ValueError("tournament {0} is closed".format(tournament))
+
+
+OPEN_ROUND_QUERY = "select max(round) from pairings where tournament = %s and not reported"
+
+# marks the pairings of the reported matches, given both ways round
+PAIRINGS_REPORT_QUERY = """
+    update pairings set reported = TRUE
+    from unnest(%(players1)s::integer[], %(players2)s::integer[]) as result (player1, player2)
+    where
+        pairings.tournament = %(tournament)s and pairings.round = %(round)s and not pairings.reported
+        and pairings.player1 = result.player1 and pairings.player2 is not distinct from result.player2
+"""
+
+
+def _reportPairings(tournament, matches, c):
+    """Checks reported matches against the open round of a tournament.
+
+    While the tournament has an open round, see currentRound, every match
+    has to be an unreported pairing of it; the pairings are marked
+    reported.  This needs no standings, only the pairings of the players.
+
+    Raises ValueError for a match that is not paired in the open round.
+    """
+    c.execute(OPEN_ROUND_QUERY, (tournament, ))
+    round = c.fetchone()[0]
+    if round is None:
+        return
+    players1, players2 = _pairingKeys(matches)
+    c.execute(PAIRINGS_REPORT_QUERY,
+              {'tournament': tournament, 'round': round, 'players1': players1, 'players2': players2})
+    if c.rowcount != len(matches):
+        raise ValueError(_unpairedMessage(tournament, round))
+
+
+def _pairingKeys(matches):
+    """Returns the (player1, player2) of the pairing of each row of matches,
+    both ways round, as two lists; player2 is None for a bye."""
+    players1 = list()
+    players2 = list()
+    for (_, winner, loser, p1, p2) in matches:
+        first, second = (winner, loser) if p1 is None else (p1, p2)
+        players1.append(first)
+        players2.append(second)
+        if second is not None:
+            players1.append(second)
+            players2.append(first)
+    return players1, players2
+
+
+def _unpairedMessage(tournament, round):
+    return "the results are not unreported pairings of round {0} of tournament {1}".format(round, tournament)
+
+
+LEGACY_IDS_QUERY = """
+    select tournament, player, id from tournament_players where (tournament, player) in %s
+"""
+
+
+def _legacyIds(ids):
+    """Returns {legacy id: (tournament, player)} for the legacy ids among ids."""
+    legacy = dict()
+    for value in ids:
+        if '-' in str(value):
+            tournament, player = str(value).split('-', 1)
+            if not (tournament.isdigit() and player.isdigit()):
+                raise ValueError("no tournament player {0}".format(value))
+            legacy[value] = (int(tournament), int(player))
+    if legacy:
+        warnings.warn('"<tournament>-<player>" tournament player ids are deprecated, '
+                      'use the integer ids returned by registerTournamentPlayer',
+                      DeprecationWarning, stacklevel=4)
+    return legacy
+
+
+def _translateIds(ids, legacy, rows):
+    """Translates ids with the rows of LEGACY_IDS_QUERY."""
+    found = dict(((tournament, player), tp_id) for tournament, player, tp_id in rows)
+    translated = list()
+    for value in ids:
+        if value not in legacy:
+            translated.append(int(value))
+        elif legacy[value] in found:
+            translated.append(found[legacy[value]])
+        else:
+            raise ValueError("no tournament player {0}".format(value))
+    return translated
+
+
+@connect_db
+def deleteMatches(tournament=None, c=None):
+    """Remove all the match records from the database.
+
+    The records of the players are derived from the matches, so they start
+    over at zero, and the stored rounds paired from them are deleted.  The
+    matches of a tournament are its own partition, which is truncated.
+    """
     if tournament:
-        c.execute("delete from matches where tournament = %s", (tournament, ))
+        if _lockTournament(tournament, c) is not None:
+            c.execute("truncate {0}".format(_partition('matches', tournament)))
+        c.execute("delete from opponents where tournament = %s", (tournament, ))
+        c.execute("delete from result_reports where tournament = %s", (tournament, ))
+        c.execute("delete from rounds where tournament = %s", (tournament, ))
+        c.execute("""update tournament_players set wins = 0, matches = 0, had_bye = FALSE
+                     where tournament = %s and matches > 0""", (tournament, ))
     else:
-        c.execute("delete from matches")
-    db.commit()
-    db.close()
+        c.execute("truncate matches, opponents, result_reports, pairings, rounds")
+        c.execute("update tournament_players set wins = 0, matches = 0, had_bye = FALSE where matches > 0")
+    _invalidateStandings(tournament or None)
 
 
-def deletePlayers():
+@connect_db
+def deletePlayers(c=None):
     """Remove all the player records from the database."""
-    db = connect()
-    c = db.cursor()
-    c.execute("delete from players")
-    db.commit()
-    db.close()
+    c.execute("truncate players, tournament_players, matches, opponents, pairings, rounds, result_reports")
+    _invalidateStandings()
 
 
-def deleteTournamentPlayers(tournament=None):
-    """Remove all the player records from the database."""
-    db = connect()
-    c = db.cursor()
+@connect_db
+def deleteTournamentPlayers(tournament=None, c=None):
+    """Remove all the player records from the database.
+
+    The matches of a tournament, its partition of matches, are truncated;
+    its players are deleted, one row each: their partition cannot be
+    truncated while matches references it, and replacing it would lock
+    matches and tournament_players for every other tournament.
+    """
     if tournament:
-        c.execute("delete from tournament_players where tournament = %s", (tournament, ))
+        if _lockTournament(tournament, c) is not None:
+            c.execute("delete from opponents where tournament = %s", (tournament, ))
+            c.execute("delete from pairings where tournament = %s", (tournament, ))
+            c.execute("truncate {0}".format(_partition('matches', tournament)))
+            c.execute("delete from tournament_players where tournament = %s", (tournament, ))
+        c.execute("delete from result_reports where tournament = %s", (tournament, ))
+        c.execute("delete from rounds where tournament = %s", (tournament, ))
     else:
-        c.execute("delete from tournament_players")
-    db.commit()
-    db.close()
+        c.execute("truncate tournament_players, matches, opponents, pairings, rounds, result_reports")
+    _invalidateStandings(tournament or None)
 
 
 def deleteTournaments(tournament=None):
-    """Remove all the player records from the database."""
-    db = connect()
-    c = db.cursor()
+    """Remove a tournament (every tournament if None).
+
+    A tournament is closed to reports, its partitions are detached
+    concurrently (see _detachPartitions) and dropped, not emptied row by
+    row; dropping them takes a brief ACCESS EXCLUSIVE lock on the tables
+    they referenced, tournaments, players and tournament_players.  Call it
+    outside a transaction.
+
+    Without a tournament every table is truncated, which locks them all,
+    and then the partitions are dropped DROP_PARTITIONS_BATCH tournaments
+    per transaction: a transaction holds a lock on every table, index and
+    constraint it drops, and there are only max_locks_per_transaction locks
+    per connection.
+    """
+    if _backend is not None:
+        return _backend.deleteTournaments(tournament)
     if tournament:
-        c.execute("delete from tournaments where id = %s", (tournament, ))
-    else:
-        c.execute("delete from tournaments")
-    db.commit()
-    db.close()
+        if _closeTournament(tournament):
+            _dropPartitions(tournament, _detachPartitions(tournament))
+        return
+    _deleteAllTournaments()
+    while _dropDeletedPartitions():
+        pass
+
+
+@connect_db
+def _deleteAllTournaments(c=None):
+    c.execute("truncate tournaments, tournament_players, matches, opponents, pairings, rounds, result_reports")
+    _invalidateStandings()
+
+
+@connect_db
+def _dropPartitions(tournament, partitions, c=None):
+    """Drops the detached partitions of a closed tournament, and then the tournament."""
+    c.execute("drop table if exists {0}".format(', '.join(partitions)))
+    c.execute("delete from tournaments where id = %s", (tournament, ))
+    _invalidateStandings(tournament)
+
+
+def archiveTournament(tournament, out):
+    """Exports a tournament, then moves it out of the tables of the API.
+
+    Meant for finished tournaments: out gets everything needed to rebuild
+    the tournament, see _archiveLines, and the tournament is closed, so
+    later reports raise ValueError.  Then its partitions are detached from
+    matches and tournament_players concurrently (see _detachPartitions) and
+    moved to the archive schema, where they keep their rows until they are
+    dropped.  Dropping the foreign keys of the detached tables takes a brief
+    ACCESS EXCLUSIVE lock on tournaments, players and tournament_players.
+    Call it outside a transaction.
+
+    Args:
+      tournament: the id of the tournament
+      out: a file the export is written to, as JSON lines
+
+    Returns:
+      The names of the archived tables.
+
+    Raises ValueError for an unknown tournament.
+    """
+    if _backend is not None:
+        return _backend.archiveTournament(tournament, out)
+    if not _closeTournament(tournament, out):
+        raise ValueError("no tournament {0}".format(tournament))
+    return _archivePartitions(tournament, _detachPartitions(tournament))
+
+
+@connect_db
+def _closeTournament(tournament, out=None, c=None):
+    """Closes a tournament to reports, see _appendLock, and returns False if
+    there is no such tournament.
+
+    The export of archiveTournament is written to out, if given, while the
+    tournament is locked.  The opponents and pairings of the tournament,
+    which reference its players, are deleted, so its partition of
+    tournament_players can be detached.
+    """
+    row = _lockTournament(tournament, c)
+    if row is None:
+        return False
+    if out is not None:
+        name, names = row
+        players, results = tournamentHistory(tournament)
+        c.execute(TOURNAMENT_ROUNDS_QUERY, (tournament, ))
+        rounds = sorted(_storedRounds(c.fetchall(), by_round=True).values())
+        out.writelines(_archiveLines(tournament, name, tiebreaks.checkTiebreaks(names), players, results, rounds))
+    c.execute("update tournaments set closed = TRUE where id = %s", (tournament, ))
+    c.execute("delete from opponents where tournament = %s", (tournament, ))
+    c.execute("delete from pairings where tournament = %s", (tournament, ))
+    return True
+
+
+@connect_db
+def _archivePartitions(tournament, partitions, c=None):
+    """Moves the detached partitions of a closed tournament to the archive
+    schema, deletes the tournament and returns the names of the tables.
+
+    The tables keep no foreign keys, so deleting tournaments or players
+    later does not reach into them.
+    """
+    tables = list()
+    for partition in partitions:
+        c.execute("select conname from pg_constraint where conrelid = %s::regclass and contype = 'f'", (partition, ))
+        for (constraint, ) in c.fetchall():
+            c.execute('alter table {0} drop constraint "{1}"'.format(partition, constraint))
+        c.execute("alter table {0} set schema {1}".format(partition, ARCHIVE_SCHEMA))
+        tables.append('{0}.{1}'.format(ARCHIVE_SCHEMA, partition))
+    c.execute("delete from tournaments where id = %s", (tournament, ))
+    _invalidateStandings(tournament)
+    return tables
+
+
+def _partition(table, tournament):
+    """Returns the name of the partition of table holding the rows of tournament."""
+    return '{0}_{1}'.format(table, int(tournament))
+
+
+def _lockTournament(tournament, c):
+    """Locks a tournament against reports and returns its (name, tiebreaks),
+    None if there is no such tournament."""
+    c.execute("select name, tiebreaks from tournaments where id = %s for update", (tournament, ))
+    return c.fetchone()
+
+
+# whether a partition is attached (False), being detached (True) or neither
+# (no row)
+PARTITION_STATE_QUERY = """
+    select inhdetachpending from pg_inherits where inhrelid = to_regclass(%s) and inhparent = %s::regclass
+"""
+
+
+def _detachPartitions(tournament):
+    """Detaches the partitions of a closed tournament and returns their names.
+
+    DETACH PARTITION CONCURRENTLY takes a SHARE UPDATE EXCLUSIVE lock on the
+    partitioned table, which reads and reports of other tournaments do not
+    conflict with, and waits for the transactions already using the table.
+    It cannot run in a transaction, so it runs on a connection of its own
+    in autocommit mode.  A detach that was interrupted is finished.
+    """
+    partitions = [_partition(table, tournament) for table in PARTITIONED_TABLES]
+    with getPool().dedicated() as db:
+        db.autocommit = True
+        try:
+            c = db.cursor()
+            for table, partition in zip(PARTITIONED_TABLES, partitions):
+                c.execute(PARTITION_STATE_QUERY, (partition, table))
+                row = c.fetchone()
+                if row is not None:
+                    c.execute("alter table {0} detach partition {1} {2}".format(
+                        table, partition, 'finalize' if row[0] else 'concurrently'))
+            c.close()
+        finally:
+            db.autocommit = False
+    return partitions
+
+
+# tournaments that are deleted but still have partitions; the partitions
+# registerTournament created for the next tournaments are kept
+DELETED_PARTITIONS_QUERY = """
+    select tournament
+    from
+        (
+            select substring(partitions.relname from '[0-9]+$')::integer
+            from pg_inherits join pg_class as partitions on pg_inherits.inhrelid = partitions.oid
+            where pg_inherits.inhparent = 'tournament_players'::regclass
+        ) as partitions (tournament)
+    where
+        tournament <= (select last_value from tournaments_id_seq)
+    except
+    select id from tournaments
+    limit %s
+"""
+
+
+@connect_db
+def _dropDeletedPartitions(c=None):
+    """Drops the partitions of up to DROP_PARTITIONS_BATCH deleted
+    tournaments and returns how many there were.
+
+    A partition of tournament_players is referenced by the foreign keys of
+    matches, so it is detached (once the partition of matches is dropped)
+    before it is dropped.
+    """
+    c.execute(DELETED_PARTITIONS_QUERY, (DROP_PARTITIONS_BATCH, ))
+    tournaments = [row[0] for row in c.fetchall()]
+    if not tournaments:
+        return 0
+    c.execute("drop table if exists {0}".format(
+        ', '.join(_partition('matches', tournament) for tournament in tournaments)))
+    for tournament in tournaments:
+        c.execute("alter table tournament_players detach partition {0}".format(
+            _partition('tournament_players', tournament)))
+    c.execute("drop table {0}".format(
+        ', '.join(_partition('tournament_players', tournament) for tournament in tournaments)))
+    return len(tournaments)
+
+
+ARCHIVE_TOURNAMENT_COLUMNS = ('tournament', 'name', 'tiebreaks')
+ARCHIVE_PLAYER_COLUMNS = ('player', 'name')
+ARCHIVE_PAIRING_COLUMNS = ('round', 'id1', 'name1', 'id2', 'name2')
+
+
+def _archiveLines(tournament, name, names, players, results, rounds):
+    """Yields the JSON lines of an archived tournament: the tournament, its
+    players, its results in the order they were reported (like the lines of
+    streamHistory) and the pairs of its stored rounds.
+
+    Args:
+      players, results: as returned by tournamentHistory
+      rounds: (round, pairs) of each stored round, first round first
+    """
+    yield _line((int(tournament), name, list(names)), ARCHIVE_TOURNAMENT_COLUMNS, 'json')
+    for player in players:
+        yield _line(player, ARCHIVE_PLAYER_COLUMNS, 'json')
+    for result in results:
+        yield _line(result, HISTORY_COLUMNS, 'json')
+    for (round, pairs) in rounds:
+        for pair in pairs:
+            yield _line((round, ) + tuple(pair), ARCHIVE_PAIRING_COLUMNS, 'json')
+
 
+_prepareQuery('count_players', "select count(*) from players")
+_prepareQuery('count_tournament_players', "select count(*) from tournament_players where tournament = %s")
+_prepareQuery('count_all_tournament_players', "select count(*) from tournament_players")
 
-def countPlayers():
+
+@read_db
+def countPlayers(c=None):
     """Returns the number of players currently registered."""
-    db = connect()
-    c = db.cursor()
-    c.execute("select count(*) from players")
+    _executePrepared(c, 'count_players')
     row = c.fetchone()
-    db.close()
     return int(row[0])
 
 
-def countTournamentPlayers(tournament=None):
+@read_db
+def countTournamentPlayers(tournament=None, c=None):
     """Returns the number of players currently registered."""
-    db = connect()
-    c = db.cursor()
     if tournament:
-        c.execute("select count(*) from tournament_players where tournament = %s", (tournament, ))
+        _executePrepared(c, 'count_tournament_players', (tournament, ))
     else:
-        c.execute("select count(*) from tournament_players")
+        _executePrepared(c, 'count_all_tournament_players')
     row = c.fetchone()
-    db.close()
     return int(row[0])
 
 
-def registerPlayer(name):
+@connect_db
+def registerPlayer(name, c=None):
     """Adds a player to the tournament database.
   
     The database assigns a unique serial id number for the player.  (This
@@ -88,43 +841,265 @@ def registerPlayer(name):
     Args:
       name: the player's full name (need not be unique).
     """
-    db = connect()
-    c = db.cursor()
     c.execute("insert into players (name) values (%s) RETURNING id;", (name,))
-    db.commit()
     player_id = c.fetchone()[0]
-    db.close()
     return int(player_id)
 
 
-def registerTournament(name):
-    """Adds a tournament to the tournament_extra database."""
-    db = connect()
-    c = db.cursor()
-    c.execute("insert into tournaments (name) values (%s) RETURNING id;", (name,))
-    db.commit()
+# one round trip, see migrations/0012_partition_locks.sql
+REGISTER_TOURNAMENT_QUERY = "select register_tournament(%s, %s)"
+
+
+@retry_on_conflict
+@connect_db
+def registerTournament(name, c=None):
+    """Adds a tournament to the tournament_extra database.
+
+    The partitions of the tournament (see migrations/0011_partitions.sql)
+    are usually there already.  Creating partitions takes an ACCESS
+    EXCLUSIVE lock on matches and tournament_players, which every query of
+    every tournament waits for, so a registration that finds none creates
+    them for the next PARTITIONS_AHEAD tournaments at once, see
+    migrations/0012_partition_locks.sql; the others only insert a row.
+    """
+    c.execute(REGISTER_TOURNAMENT_QUERY, (name, PARTITIONS_AHEAD))
     tournament_id = c.fetchone()[0]
-    db.close()
     return int(tournament_id)
 
 
-def registerTournamentPlayer(player, tournament):
-    """Adds a player to the tournament database.
+@connect_db
+def registerTournamentPlayer(player, tournament, c=None):
+    """Adds a registered player to a tournament.
 
-    The database assigns a unique serial id number for the player.  (This
-    should be handled by your SQL database schema, not in your Python code.)
+    The database assigns a unique serial id number for the tournament player,
+    which is what standings, pairings and match reports use.
 
     Args:
-      name: the player's full name (need not be unique).
+      player: the id of the registered player.
+      tournament: the id of the tournament.
+
+    Returns:
+      The integer id of the tournament player.
     """
-    db = connect()
-    c = db.cursor()
-    c.execute("insert into tournament_players (id, player, tournament) values (%s, %s, %s) RETURNING id;",
-              ("{0}-{1}".format(tournament, player), player, tournament))
-    db.commit()
+    c.execute("insert into tournament_players (player, tournament) values (%s, %s) RETURNING id;",
+              (player, tournament))
     tournament_player_id = c.fetchone()[0]
-    db.close()
-    return tournament_player_id
+    _invalidateStandings(tournament)
+    return int(tournament_player_id)
+
+
+@connect_db
+def bulkRegisterPlayers(names, c=None):
+    """Adds many players at once with COPY.
+
+    Args:
+      names: an iterable of names, or a file with one name per line (blank
+        lines are skipped).  It is streamed to the database, not read into
+        memory first.
+
+    Returns:
+      The ids of the new players, in the order of names.
+    """
+    c.execute("""
+        create temp table bulk_players (
+            ordinal integer,
+            name text,
+            id integer default nextval(pg_get_serial_sequence('players', 'id'))
+        ) on commit drop
+    """)
+    c.copy_expert("copy bulk_players (ordinal, name) from stdin",
+                  _CopyRows(enumerate(_bulkLines(names))))
+    c.execute("insert into players (id, name) select id, name from bulk_players order by ordinal")
+    c.execute("select id from bulk_players order by ordinal")
+    ids = [row[0] for row in c.fetchall()]
+    c.execute("drop table bulk_players")
+    if len(ids) >= BULK_ANALYZE_ROWS:
+        c.execute("analyze players")
+    return ids
+
+
+@connect_db
+def bulkRegisterTournamentPlayers(tournament, players, ignore_duplicates=True, c=None):
+    """Adds many registered players to a tournament at once with COPY.
+
+    Args:
+      tournament: the id of the tournament.
+      players: an iterable of player ids, or a file with one id per line.
+      ignore_duplicates: a player who is already registered, or who appears
+        more than once, gets the id of his or her existing registration.  With
+        False, such players raise a ValueError and nothing is registered.
+
+    Returns:
+      The tournament player ids, in the order of players.
+    """
+    c.execute("""
+        create temp table bulk_tournament_players (
+            ordinal integer,
+            player integer
+        ) on commit drop
+    """)
+    c.copy_expert("copy bulk_tournament_players (ordinal, player) from stdin",
+                  _CopyRows(enumerate(_bulkLines(players))))
+    if not ignore_duplicates:
+        c.execute("""
+            select player from bulk_tournament_players group by player having count(*) > 1
+            union
+            select tournament_players.player
+            from bulk_tournament_players join tournament_players
+            on tournament_players.player = bulk_tournament_players.player
+            where tournament_players.tournament = %s
+        """, (tournament, ))
+        duplicates = sorted(row[0] for row in c.fetchall())
+        if duplicates:
+            raise ValueError("players registered more than once in tournament {0}: {1}".format(
+                tournament, ', '.join(str(player) for player in duplicates[:10])))
+    c.execute("""
+        insert into tournament_players (player, tournament)
+        select player, %(tournament)s
+        from bulk_tournament_players
+        group by player
+        order by min(ordinal)
+        on conflict (tournament, player) do nothing
+    """, {'tournament': tournament})
+    c.execute("""
+        select tournament_players.id
+        from bulk_tournament_players join tournament_players
+        on tournament_players.player = bulk_tournament_players.player
+        where tournament_players.tournament = %s
+        order by bulk_tournament_players.ordinal
+    """, (tournament, ))
+    ids = [row[0] for row in c.fetchall()]
+    c.execute("drop table bulk_tournament_players")
+    # until autovacuum gets to it the planner may still think the table is
+    # nearly empty, and pick nested loops for the next standings query
+    if len(ids) >= BULK_ANALYZE_ROWS:
+        c.execute("analyze {0}".format(_partition('tournament_players', tournament)))
+    _invalidateStandings(tournament)
+    return ids
+
+
+def _bulkLines(values):
+    """Yields the values of an iterable, or the non-blank lines of a file."""
+    if hasattr(values, 'read'):
+        return (line.rstrip('\r\n') for line in values if line.strip())
+    return values
+
+
+class _CopyRows(object):
+    """A file-like object that feeds rows to COPY ... FROM STDIN as it is read."""
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(self._field(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+
+    @staticmethod
+    def _field(value):
+        if value is None:
+            return '\\N'
+        if not hasattr(value, 'replace'):
+            value = str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+# the player rows of a match: (player, win, bye) for the winner, the loser
+# and both players of a tie; a win without a loser is a bye
+RESULT_ROWS = """(values (matches.winner, 1, matches.loser is null), (matches.loser, 0, FALSE),
+                         (matches.p1, 0, FALSE), (matches.p2, 0, FALSE)) as result (player, win, bye)"""
+
+# the record of every player of a tournament: the counters rolled up in
+# tournament_players plus the matches reported after the rollup (the tail,
+# see migrations/0007_match_log.sql)
+RECORDS_QUERY = """
+    select
+        tournament_players.id,
+        tournament_players.player,
+        tournament_players.wins + COALESCE(tail.wins, 0) as wins,
+        tournament_players.matches + COALESCE(tail.matches, 0) as matches,
+        tournament_players.had_bye or COALESCE(tail.had_bye, FALSE) as had_bye
+    from
+        tournament_players
+        left join
+        (
+            select
+                result.player,
+                sum(result.win) as wins,
+                count(*) as matches,
+                bool_or(result.bye) as had_bye
+            from
+                tournaments
+                join
+                    matches
+                on
+                    matches.tournament = tournaments.id and
+                    matches.id > tournaments.rolled_up_through
+                cross join lateral
+                    """ + RESULT_ROWS + """
+            where
+                tournaments.id = %(tournament)s and
+                result.player is not null
+            group by
+                result.player
+        ) as tail
+        on
+            tournament_players.id = tail.player
+    where
+        tournament_players.tournament = %(tournament)s
+"""
+
+# ties are broken by the wins of the opponents each player beat (see
+# opponent_match_wins() in migrations/0001_initial.sql), aggregated for the
+# whole tournament at once instead of once per player
+STANDINGS_QUERY = """
+    with standings as (""" + RECORDS_QUERY + """)
+    select
+        standings.id,
+        players.name,
+        standings.wins,
+        standings.matches
+        {extra}
+    from
+        standings
+        join
+            players
+        on
+            standings.player = players.id
+        left join
+        (
+            select
+                matches.winner,
+                sum(opponents.wins) as wins
+            from
+                matches
+                join
+                    standings as opponents
+                on
+                    matches.loser = opponents.id
+            where
+                matches.tournament = %(tournament)s
+            group by
+                matches.winner
+        ) as opponent_match_wins
+        on
+            standings.id = opponent_match_wins.winner
+    order by
+        standings.wins desc,
+        COALESCE(opponent_match_wins.wins, 0) desc,
+        standings.id
+"""
 
 
 def tournamentPlayerStandings(tournament, with_bye=False):
@@ -133,6 +1108,13 @@ def tournamentPlayerStandings(tournament, with_bye=False):
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
 
+    Standings are served from the standings cache until a result, a
+    registration or a delete changes the tournament.  Standings read from a
+    replica (see configureReadPool) are not cached.
+
+    Players with equal wins are ranked by the tiebreaks of the tournament,
+    see setTiebreaks, and then by id.
+
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
         id: the player's unique id (assigned by the database)
@@ -140,96 +1122,521 @@ def tournamentPlayerStandings(tournament, with_bye=False):
         wins: the number of matches the player has won
         matches: the number of matches the player has played
     """
-    db = connect()
-    c = db.cursor()
-    c.execute("""
-        select
-            tournament_players.id,
-            players.name,
-            tournament_players.wins,
-            tournament_players.matches
-            {extra}
-        from
-            tournament_players
-            join
-                players
-            on
-                tournament_players.player = players.id
-        where
-            tournament_players.tournament = %(tournament)s
-        order by
-            wins desc,
-            opponent_match_wins(tournament_players.id) desc,
-            tournament_players.id
-    """.format(extra=', tournament_players.had_bye' if with_bye else ''), {'tournament': tournament})
-    rows = c.fetchall()
-    db.close()
-    return rows
+    key = int(tournament)
+    if _backend is not None:
+        return _backend.tournamentPlayerStandings(key, with_bye)
+    rows = _standings_cache.get(key)
+    if rows is None:
+        generation = _standings_cache.generation(key)
+        rows = tuple(_loadStandings(key))
+        # a replica may not have the change that dropped the cached entry yet
+        if _read_dsn is None or getattr(_local, 'primary', 0):
+            _standings_cache.put(key, rows, generation)
+    if with_bye:
+        return list(rows)
+    return [row[:4] for row in rows]
+
+
+@read_db
+def _loadStandings(tournament, c=None):
+    _executePrepared(c, 'standings', {'tournament': tournament})
+    rows, names = _splitTiebreaks(c.fetchall())
+    if names is None:
+        return rows
+    _executePrepared(c, 'results_log', (tournament, ))
+    return tiebreaks.rankStandings(rows, c.fetchall(), names)
+
+
+# the tiebreaks of the tournament, in every row, see _splitTiebreaks
+TIEBREAKS_COLUMN = ', (select tiebreaks from tournaments where id = %(tournament)s)'
+
+# the rows of tournamentPlayerStandings(..., with_bye=True) and the tiebreaks
+TIEBREAKS_EXTRA = ', standings.had_bye' + TIEBREAKS_COLUMN
+
+# the results of a tournament, the input of tiebreaks.rankStandings
+RESULTS_LOG_QUERY = "select winner, loser, p1, p2 from matches where tournament = %s order by id"
+
+_prepareQuery('standings', STANDINGS_QUERY.format(extra=TIEBREAKS_EXTRA))
+_prepareQuery('results_log', RESULTS_LOG_QUERY)
+
+
+def _splitTiebreaks(rows):
+    """Returns the rows without their last column, the tiebreaks of the
+    tournament, and those tiebreaks; None for the default ones, which the
+    rows are ranked by already."""
+    names = rows[0][-1] if rows else None
+    return [row[:-1] for row in rows], names or None
 
 
-def reportMatch(tournament, winner, loser):
+def _columnarRows(rows):
+    """Puts the rank into the tiebreak column of ranked standings rows, so
+    columnar.ColumnarStandings keeps their order when it sorts."""
+    count = len(rows)
+    return [tuple(row[:5]) + (count - rank, ) for (rank, row) in enumerate(rows)]
+
+
+@connect_db
+def setTiebreaks(tournament, names, c=None):
+    """Sets the tiebreaks ranking the players of a tournament with equal wins.
+
+    Args:
+      tournament: the id of the tournament
+      names: the tiebreaks in order, see tiebreaks.TIEBREAKS, e.g.
+        ('omw', 'buchholz'); None goes back to the default, the wins of the
+        opponents a player beat
+
+    Raises ValueError for an unknown tiebreak or tournament.
+    """
+    names = tiebreaks.checkTiebreaks(names)
+    c.execute("update tournaments set tiebreaks = %s where id = %s",
+              (None if names == tiebreaks.DEFAULT_TIEBREAKS else list(names), tournament))
+    if c.rowcount != 1:
+        raise ValueError("no tournament {0}".format(tournament))
+    _invalidateStandings(tournament)
+
+
+@connect_db
+def tournamentTiebreaks(tournament, c=None):
+    """Returns the names of the tiebreaks of a tournament, see setTiebreaks."""
+    c.execute("select tiebreaks from tournaments where id = %s", (tournament, ))
+    row = c.fetchone()
+    return tiebreaks.checkTiebreaks(row and row[0])
+
+
+# the columns of columnar.ColumnarStandings.fromRows
+COLUMNAR_EXTRA = ', standings.had_bye, COALESCE(opponent_match_wins.wins, 0)::bigint'
+
+
+@connect_db
+def columnarStandings(tournament, c=None):
+    """Returns the standings of a tournament as columnar.ColumnarStandings.
+
+    Meant for very large tournaments: the rows are read through a server
+    side cursor straight into arrays, so only the names are kept as Python
+    objects.  Not cached.
+
+    With tiebreaks other than the default, see setTiebreaks, the rows are
+    ranked by those and the tiebreaks column holds the rank instead (higher
+    is better).
+    """
+    ids, wins, matches, methods = [array.array('l') for _ in range(4)]
+    had_bye = array.array('b')
+    names = list()
+    cursor = c.connection.cursor('columnar_standings')
+    cursor.execute(STANDINGS_QUERY.format(extra=COLUMNAR_EXTRA), {'tournament': tournament})
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        for column, values in zip((ids, names, wins, matches, had_bye, methods), zip(*rows)):
+            column.extend(values)
+    cursor.close()
+    return _rankColumns(tournament, columnar.ColumnarStandings(ids, names, wins, matches, methods, had_bye), c)
+
+
+def _rankColumns(tournament, standings, c):
+    """Ranks columnar standings by the tiebreaks of the tournament, unless
+    those are the default ones."""
+    c.execute("select tiebreaks from tournaments where id = %s", (tournament, ))
+    row = c.fetchone()
+    if not (row and row[0]):
+        return standings
+    c.execute(RESULTS_LOG_QUERY, (tournament, ))
+    rows = tiebreaks.rankStandings(standings.rows(with_bye=True), c.fetchall(), row[0])
+    return columnar.ColumnarStandings.fromRows(_columnarRows(rows))
+
+
+# the tournaments of a list with matches reported since their last rollup
+TAILS_QUERY = """
+    select id from tournaments
+    where
+        id = any(%s::integer[]) and
+        exists (select 1 from matches
+                where matches.tournament = tournaments.id and matches.id > tournaments.rolled_up_through)
+    order by id
+"""
+
+# folds the tail of each of the tournaments into its counters; returns the
+# number of matches folded per tournament
+ROLLUP_QUERY = """
+    with
+        bounds as (
+            select
+                tournaments.id as tournament,
+                tournaments.rolled_up_through as after,
+                max(matches.id) as through,
+                count(*) as matches
+            from
+                tournaments
+                join
+                    matches
+                on
+                    matches.tournament = tournaments.id and
+                    matches.id > tournaments.rolled_up_through
+            where
+                tournaments.id = any(%(tournaments)s::integer[]) and
+                matches.tournament = any(%(tournaments)s::integer[])
+            group by
+                tournaments.id
+        ),
+        tail as (
+            select
+                bounds.tournament,
+                result.player,
+                sum(result.win) as wins,
+                count(*) as matches,
+                bool_or(result.bye) as had_bye
+            from
+                bounds
+                join
+                    matches
+                on
+                    matches.tournament = bounds.tournament and
+                    matches.id > bounds.after and
+                    matches.id <= bounds.through
+                cross join lateral
+                    """ + RESULT_ROWS + """
+            where
+                matches.tournament = any(%(tournaments)s::integer[]) and
+                result.player is not null
+            group by
+                bounds.tournament,
+                result.player
+        ),
+        counters as (
+            update tournament_players
+            set
+                wins = tournament_players.wins + tail.wins,
+                matches = tournament_players.matches + tail.matches,
+                had_bye = tournament_players.had_bye or tail.had_bye
+            from
+                tail
+            where
+                tournament_players.tournament = tail.tournament and
+                tournament_players.id = tail.player
+        )
+    update tournaments
+    set
+        rolled_up_through = bounds.through
+    from
+        bounds
+    where
+        tournaments.id = bounds.tournament
+    returning
+        bounds.matches
+"""
+
+
+def _rollup(tournaments, c):
+    """Folds the tails of the tournaments into their counters with one
+    statement, see rollupStandings; returns the number of matches folded."""
+    c.execute(TAILS_QUERY, (list(tournaments), ))
+    tailed = [row[0] for row in c.fetchall()]
+    if not tailed:
+        return 0
+    # waits for the reports still appending to the tournaments, see
+    # _appendLock; the rollup reads the matches after that, in a new snapshot
+    c.execute("select id from tournaments where id = any(%s::integer[]) order by id for update", (tailed, ))
+    c.execute(ROLLUP_QUERY, {'tournaments': tailed})
+    return sum(row[0] for row in c.fetchall())
+
+
+@connect_db
+def rollupStandings(tournament, c=None):
+    """Folds the matches reported since the last rollup into the counters.
+
+    Reports only append to matches; the standings are the counters of
+    tournament_players plus the matches after tournaments.rolled_up_through,
+    so they get cheaper the fewer of those there are.  swissPairings rolls
+    up once per round.  The standings themselves do not change.
+
+    Returns:
+      The number of matches folded into the counters.
+    """
+    return _rollup([int(tournament)], c)
+
+
+@retry_on_conflict
+@connect_db
+def reportMatch(tournament, winner, loser, key=None, c=None):
     """Records the outcome of a single match between two players.
 
+    While the tournament has an open round, see currentRound, only the
+    unreported pairings of that round can be reported (by every report
+    function); anything else raises ValueError and records nothing.
+
     Args:
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
+      key:  an idempotency key chosen by the client, e.g. one UUID per
+        result; a report repeating the key of an earlier one changes nothing
+
+    Returns:
+      False if the report repeated a key and was ignored, True otherwise.
     """
-    db = connect()
-    c = db.cursor()
+    winner, loser = _tournamentPlayerIds([winner, loser], c)
+    _appendLock(tournament, c)
+    if not _claimReportKey(key, tournament, c):
+        return False
+    _reportPairings(tournament, [(tournament, winner, loser, None, None)], c)
     c.execute("insert into matches (tournament, winner, loser) values (%s, %s, %s)", (tournament, winner, loser))
-    c.execute("update tournament_players set wins = wins + 1, matches = matches + 1 where id = %s", (winner, ))
-    c.execute("update tournament_players set matches = matches + 1 where id = %s", (loser, ))
-    db.commit()
-    db.close()
+    psycopg2.extras.execute_values(
+        c, OPPONENTS_INSERT_QUERY, _opponentRows([(tournament, winner, loser, None, None)]))
+    _invalidateStandings(tournament)
+    return True
 
 
-def reportTiedMatch(tournament, p1, p2):
+@retry_on_conflict
+@connect_db
+def reportTiedMatch(tournament, p1, p2, key=None, c=None):
     """Records the outcome of a single match between two players.
 
     Args:
       p1:  the id number of the player 1
       p2:  the id number of the player 2
+      key:  an idempotency key chosen by the client, e.g. one UUID per
+        result; a report repeating the key of an earlier one changes nothing
+
+    Returns:
+      False if the report repeated a key and was ignored, True otherwise.
     """
-    db = connect()
-    c = db.cursor()
+    p1, p2 = _tournamentPlayerIds([p1, p2], c)
+    _appendLock(tournament, c)
+    if not _claimReportKey(key, tournament, c):
+        return False
+    _reportPairings(tournament, [(tournament, None, None, p1, p2)], c)
     c.execute("insert into matches (tournament, p1, p2) values (%s, %s, %s)", (tournament, p1, p2))
-    c.execute("update tournament_players set matches = matches + 1 where id = %s", (p1, ))
-    c.execute("update tournament_players set matches = matches + 1 where id = %s", (p2, ))
-    db.commit()
-    db.close()
+    psycopg2.extras.execute_values(
+        c, OPPONENTS_INSERT_QUERY, _opponentRows([(tournament, None, None, p1, p2)]))
+    _invalidateStandings(tournament)
+    return True
 
 
-def reportByeMatch(winner):
+@retry_on_conflict
+@connect_db
+def reportByeMatch(winner, key=None, c=None):
     """Records the outcome of a bye match.
 
+    The bye is stored in matches as a win without a loser.
+
     Args:
       winner:  the id number of the player who won
+      key:  an idempotency key chosen by the client, e.g. one UUID per
+        result; a report repeating the key of an earlier one changes nothing
+
+    Returns:
+      False if the report repeated a key and was ignored, True otherwise.
+
+    Raises ValueError for an unknown player, with or without a key.
     """
-    db = connect()
-    c = db.cursor()
-    c.execute("""update tournament_players
-                 set wins = wins + 1, matches = matches + 1, had_bye = TRUE
-                 where id = %s""", (winner, ))
-    db.commit()
-    db.close()
+    winner, = _tournamentPlayerIds([winner], c)
+    c.execute("select tournament from tournament_players where id = %s", (winner, ))
+    row = c.fetchone()
+    if row is None:
+        raise ValueError("no tournament player {0}".format(winner))
+    tournament = row[0]
+    _appendLock(tournament, c)
+    if not _claimReportKey(key, tournament, c):
+        return False
+    _reportPairings(tournament, [(tournament, winner, None, None, None)], c)
+    c.execute("insert into matches (tournament, winner) values (%s, %s)", (tournament, winner))
+    _invalidateStandings(tournament)
+    return True
 
 
-def swissPairings(tournament):
-    """Returns a list of pairs of players for the next round of a match.
-  
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
-  
+@retry_on_conflict
+@connect_db
+def reportRound(tournament, results, key=None, c=None):
+    """Records the outcome of a whole round in one transaction.
+
+    All matches are inserted with one multi-row insert, so either the whole
+    round is recorded or, if anything is wrong with it, none of it is.
+
+    Args:
+      tournament:  the id number of the tournament
+      results:  a list of tuples, one per match, each of which is one of
+        ('win', winner, loser): winner beat loser
+        ('tie', p1, p2): p1 and p2 tied
+        ('bye', winner): winner got a bye
+      key:  an idempotency key for the whole round, see reportMatch
+
     Returns:
-      A list of tuples, each of which contains (id1, name1, id2, name2)
-        id1: the first player's unique id
-        name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+      False if the report repeated a key and was ignored, True otherwise.
     """
-    standings = tournamentPlayerStandings(tournament, with_bye=True)
+    players = _tournamentPlayerIds([player for result in results for player in result[1:]], c)
+    if len(set(players)) != len(players):
+        raise ValueError("a player appears more than once in the round")
+    # in this transaction, the key after the append lock like every report
+    return reportResults(tournament, results, key=key)
+
+
+@retry_on_conflict
+@connect_db
+def reportResults(tournament, results, key=None, c=None):
+    """Records any number of match results in one transaction.
+
+    Works like reportRound, except that a player may appear in more than one
+    result, so the results can span several rounds (e.g. a batch of results
+    written behind by state.TournamentState).
+    """
+    matches, records = _collectResults(tournament, results)
+    _appendLock(tournament, c)
+    if not _claimReportKey(key, tournament, c):
+        return False
+    if not records:
+        return True
+    ids = dict(zip(records, _tournamentPlayerIds(records, c)))
+    deltas, matches = _resultRows(tournament, matches, records, ids)
+    c.execute(RESULTS_PLAYERS_QUERY, (tournament, [delta[0] for delta in deltas]))
+    if c.fetchone()[0] != len(deltas):
+        raise ValueError("results name players who are not registered in tournament {0}".format(tournament))
+    _reportPairings(tournament, matches, c)
+    psycopg2.extras.execute_values(c, RESULTS_INSERT_QUERY, matches, page_size=1000)
+    opponents = _opponentRows(matches)
+    if opponents:
+        psycopg2.extras.execute_values(c, OPPONENTS_INSERT_QUERY, opponents, page_size=1000)
+    _invalidateStandings(tournament)
+    return True
+
+
+# how many of the given tournament players are registered in a tournament
+RESULTS_PLAYERS_QUERY = "select count(*) from tournament_players where tournament = %s and id = any(%s)"
+
+RESULTS_INSERT_QUERY = "insert into matches (tournament, winner, loser, p1, p2) values %s"
+
+OPPONENTS_INSERT_QUERY = "insert into opponents (tournament, player, opponent) values %s on conflict do nothing"
+
+
+def _opponentRows(matches):
+    """Returns the sorted rows of OPPONENTS_INSERT_QUERY for rows of matches."""
+    opponents = set()
+    for (tournament, winner, loser, p1, p2) in matches:
+        if loser is not None:
+            opponents.update([(tournament, winner, loser), (tournament, loser, winner)])
+        elif p1 is not None:
+            opponents.update([(tournament, p1, p2), (tournament, p2, p1)])
+    return sorted(opponents)
+
+
+def _collectResults(tournament, results):
+    """Returns the match rows of results and {player: [wins, matches, had_bye]}."""
+    matches = list()
+    records = dict()
+
+    def record(player, wins=0, had_bye=False):
+        entry = records.setdefault(player, [0, 0, False])
+        entry[0] += wins
+        entry[1] += 1
+        entry[2] = entry[2] or had_bye
+
+    for result in results:
+        kind = result[0]
+        if kind == 'win':
+            winner, loser = result[1:]
+            matches.append((tournament, winner, loser, None, None))
+            record(winner, wins=1)
+            record(loser)
+        elif kind == 'tie':
+            p1, p2 = result[1:]
+            matches.append((tournament, None, None, p1, p2))
+            record(p1)
+            record(p2)
+        elif kind == 'bye':
+            winner, = result[1:]
+            matches.append((tournament, winner, None, None, None))
+            record(winner, wins=1, had_bye=True)
+        else:
+            raise ValueError("unknown match result {0!r}".format(kind))
+    return matches, records
+
+
+def _resultRows(tournament, matches, records, ids):
+    """Returns the (id, tournament, wins, matches, had_bye) change of each
+    player, sorted by id, and the rows of RESULTS_INSERT_QUERY.
+
+    ids maps the player ids used in the results to database ids.
+    """
+    deltas = dict()
+    for player, (wins, played, had_bye) in records.items():
+        entry = deltas.setdefault(ids[player], [0, 0, False])
+        entry[0] += wins
+        entry[1] += played
+        entry[2] = entry[2] or had_bye
+    deltas = [(player, tournament) + tuple(entry) for player, entry in sorted(deltas.items())]
+    matches = [(t, ids.get(winner), ids.get(loser), ids.get(p1), ids.get(p2))
+               for (t, winner, loser, p1, p2) in matches]
+    return deltas, matches
+
+
+@connect_db
+def tournamentHistory(tournament, c=None):
+    """Returns everything needed to rebuild a tournament from its matches.
+
+    Returns:
+      (players, results): players is a list of (id, name) tuples of the
+      tournament players, results a list of ('win', winner, loser),
+      ('tie', p1, p2) and ('bye', winner) tuples in the order they were
+      reported.
+    """
+    c.execute("""
+        select tournament_players.id, players.name
+        from tournament_players join players on tournament_players.player = players.id
+        where tournament_players.tournament = %s
+        order by tournament_players.id
+    """, (tournament, ))
+    players = c.fetchall()
+    c.execute("select winner, loser, p1, p2 from matches where tournament = %s order by id", (tournament, ))
+    return players, _historyResults(c.fetchall())
+
+
+OPPONENTS_QUERY = "select player, opponent from opponents where tournament = %(tournament)s"
+
+
+@connect_db
+def tournamentOpponents(tournament, c=None):
+    """Returns a dict of tournament player id -> set of the ids of everyone he
+    or she played in the tournament (byes are not opponents)."""
+    c.execute(OPPONENTS_QUERY, {'tournament': tournament})
+    return _opponentsMap(c.fetchall())
+
+
+def _opponentsMap(rows):
+    opponents = dict()
+    for player, opponent in rows:
+        opponents.setdefault(player, set()).add(opponent)
+    return opponents
+
+
+def _historyResults(rows):
+    """Turns (winner, loser, p1, p2) rows of matches into results."""
+    return [_historyResult(row) for row in rows]
+
+
+def _historyResult(row):
+    winner, loser, p1, p2 = row
+    if p1 is not None:
+        return ('tie', p1, p2)
+    elif loser is not None:
+        return ('win', winner, loser)
+    return ('bye', winner)
+
+
+def pairStandings(standings, opponents=None):
+    """Pairs neighbours in the standings, see swissPairings.
+
+    Args:
+      standings: the rows of tournamentPlayerStandings(..., with_bye=True)
+      opponents: {id: ids played}, see tournamentOpponents; if given, the
+        players are paired without rematches by pairing.matchingPairings,
+        neighbours where they have not played yet, and the bye goes to the
+        lowest ranked player who has not had one
+
+    Raises ValueError if there is no pairing without rematches.
+    """
+    standings = list(standings)
+    if opponents is not None:
+        had_bye = set(row[0] for row in standings if row[4])
+        return pairing.matchingPairings(standings, opponents, had_bye)
     if len(standings) % 2 != 0:
         """
         with odd number of players, the following rule is used to find player for bye match
@@ -252,5 +1659,508 @@ def swissPairings(tournament):
     pairs = [(standings[x][0],
               standings[x][1],
               standings[x+1][0],
-              standings[x+1][1]) for x in xrange(0, len(standings), 2)]
+              standings[x+1][1]) for x in range(0, len(standings), 2)]
     return pairs
+
+
+def swissPairings(tournament, use_columnar=False, avoid_rematches=False):
+    """Returns a list of pairs of players for the next round of a match.
+  
+    Assuming that there are an even number of players registered, each player
+    appears exactly once in the pairings.  Each player is paired with another
+    player with an equal or nearly-equal win record, that is, a player adjacent
+    to him or her in the standings.
+  
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2)
+        id1: the first player's unique id
+        name1: the first player's name
+        id2: the second player's unique id
+        name2: the second player's name
+
+    With use_columnar=True the standings are read as columnarStandings, which
+    uses far less memory for very large tournaments; the pairs are the same.
+    With avoid_rematches=True players who already met are not paired again,
+    see pairStandings; ValueError is raised if that is impossible.
+
+    A new round starts here, so the results of the last one are rolled up
+    first, see rollupStandings.  The pairs are computed on every call and
+    not stored; currentRound pairs a round once and serves it to everyone.
+    """
+    rollupStandings(tournament)
+    opponents = tournamentOpponents(tournament) if avoid_rematches else None
+    if use_columnar:
+        standings = columnarStandings(tournament)
+        if opponents is None:
+            return standings.pairs()
+        return pairStandings(standings.rows(with_bye=True), opponents)
+    with _readPrimary():
+        return pairStandings(tournamentPlayerStandings(tournament, with_bye=True), opponents)
+
+
+# the standings (with byes and tiebreaks) and opponents of many tournaments
+# at once: STANDINGS_QUERY, run once per tournament
+PAIRING_INPUTS_QUERY = """
+    select
+        pairing.tournament,
+        standings.*
+    from
+        unnest(%(tournaments)s::integer[]) as pairing (tournament)
+        cross join lateral
+        (""" + STANDINGS_QUERY.format(
+            extra=', standings.had_bye, COALESCE(opponent_match_wins.wins, 0) as tiebreak, '
+                  'array(select opponent from opponents where opponents.player = standings.id) as opponents'
+                  + TIEBREAKS_COLUMN
+        ).replace('%(tournament)s', 'pairing.tournament') + """) as standings
+    order by
+        pairing.tournament,
+        standings.wins desc,
+        standings.tiebreak desc,
+        standings.id
+"""
+
+
+@connect_db
+def _pairingInputs(tournaments, c=None):
+    """Returns [(tournament, standings, opponents)] of each tournament, read
+    with a single query; standings are the rows of tournamentPlayerStandings
+    (..., with_bye=True), opponents those of tournamentOpponents.
+
+    The tournaments are rolled up first, all in one statement, as the next
+    round starts (see rollupStandings).
+    """
+    _rollup(tournaments, c)
+    c.execute(PAIRING_INPUTS_QUERY, {'tournaments': list(tournaments)})
+    inputs, ranked = _collectPairingInputs(tournaments, c.fetchall())
+    if ranked:
+        c.execute(TOURNAMENTS_RESULTS_QUERY, (list(ranked), ))
+        _rankPairingInputs(inputs, ranked, c.fetchall())
+    return [(tournament, standings, played) for (tournament, (standings, played)) in inputs.items()]
+
+
+# the results of many tournaments, see RESULTS_LOG_QUERY
+TOURNAMENTS_RESULTS_QUERY = """
+    select tournament, winner, loser, p1, p2 from matches where tournament = any(%s::integer[])
+    order by tournament, id
+"""
+
+
+def _collectPairingInputs(tournaments, rows):
+    """Returns {tournament: (standings, opponents)} of the rows of
+    PAIRING_INPUTS_QUERY, and {tournament: tiebreaks} of the tournaments
+    with other than the default tiebreaks."""
+    inputs = collections.OrderedDict((tournament, ([], {})) for tournament in tournaments)
+    ranked = dict()
+    for (tournament, tp_id, name, wins, matches, had_bye, _, opponents, names) in rows:
+        standings, played = inputs[tournament]
+        standings.append((tp_id, name, wins, matches, had_bye))
+        if opponents:
+            played[tp_id] = set(opponents)
+        if names:
+            ranked[tournament] = names
+    return inputs, ranked
+
+
+def _rankPairingInputs(inputs, ranked, rows):
+    """Ranks the standings of the inputs of the tournaments in ranked by their
+    tiebreaks, given the rows of TOURNAMENTS_RESULTS_QUERY."""
+    results = dict((tournament, []) for tournament in ranked)
+    for row in rows:
+        results[row[0]].append(row[1:])
+    for tournament, names in ranked.items():
+        standings = inputs[tournament][0]
+        standings[:] = tiebreaks.rankStandings(standings, results[tournament], names)
+
+
+def _pairInputs(inputs):
+    """Pairs one (tournament, standings, opponents) in a pool process."""
+    tournament, standings, opponents = inputs
+    try:
+        return tournament, pairStandings(standings, opponents)
+    except ValueError as error:
+        raise ValueError("tournament {0}: {1}".format(tournament, error))
+
+
+ROUNDS_INSERT_QUERY = "insert into rounds (tournament, round) values %s"
+
+PAIRINGS_INSERT_QUERY = "insert into pairings (tournament, round, board, player1, player2) values %s"
+
+NEXT_ROUNDS_QUERY = """
+    select tournament, max(round) + 1 from rounds where tournament = any(%s::integer[]) group by tournament
+"""
+
+
+@connect_db
+def _storePairings(pairings, c=None):
+    """Stores {tournament: pairs} as the next round of each tournament.
+
+    A tournament whose last round is still open keeps it: another caller
+    paired and stored it meanwhile, and its pairs are returned instead.
+
+    Returns:
+      {tournament: (round, pairs)}, (None, []) for no pairs
+    """
+    if not pairings:
+        return {}
+    c.execute("select id from tournaments where id = any(%s::integer[]) order by id for update", (list(pairings), ))
+    stored = _openRounds(list(pairings))
+    new = [(tournament, pairs) for (tournament, pairs) in pairings.items() if tournament not in stored and pairs]
+    c.execute(NEXT_ROUNDS_QUERY, ([tournament for (tournament, _) in new], ))
+    rounds = dict((tournament, 1) for (tournament, _) in new)
+    rounds.update(c.fetchall())
+    psycopg2.extras.execute_values(c, ROUNDS_INSERT_QUERY, sorted(rounds.items()), page_size=1000)
+    rows = [(tournament, rounds[tournament], board, id1, None if id2 == 'bye' else id2)
+            for (tournament, pairs) in new
+            for (board, (id1, _, id2, _)) in enumerate(pairs, 1)]
+    psycopg2.extras.execute_values(c, PAIRINGS_INSERT_QUERY, rows, page_size=1000)
+    result = dict((tournament, (None, [])) for tournament in pairings)
+    result.update((tournament, (rounds[tournament], pairs)) for (tournament, pairs) in new)
+    result.update(stored)
+    return result
+
+
+def _pairRounds(tournaments, workers):
+    """Returns {tournament: (round, pairs)} of the open round of each
+    tournament, pairing and storing it first where there is none."""
+    tournaments = [int(tournament) for tournament in tournaments]
+    rounds = _openRounds(tournaments)
+    unpaired = [tournament for tournament in tournaments if tournament not in rounds]
+    inputs = _pairingInputs(unpaired) if unpaired else []
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers == 1 or len(inputs) < 2:
+        pairings = map(_pairInputs, inputs)
+    else:
+        process_pool = multiprocessing.Pool(min(workers, len(inputs)))
+        try:
+            pairings = process_pool.map(_pairInputs, inputs, chunksize=max(1, len(inputs) // (workers * 4)))
+        finally:
+            process_pool.close()
+            process_pool.join()
+    rounds.update(_storePairings(collections.OrderedDict(pairings)))
+    return collections.OrderedDict((tournament, rounds[tournament]) for tournament in tournaments)
+
+
+def pairAllTournaments(tournaments, workers=None):
+    """Pairs the next round of many tournaments and stores the pairings.
+
+    The standings and opponents of every tournament are read with one query,
+    the tournaments are paired in a pool of worker processes (pairing is CPU
+    bound, and one process runs Python code on one core), and all pairings
+    are stored in one transaction, see tournamentPairings.  Players are
+    paired like swissPairings(tournament, avoid_rematches=True).
+
+    A tournament is paired only once per round: while its last stored round
+    is open, see currentRound, the stored pairs of that round are returned.
+
+    Args:
+      tournaments: the ids of the tournaments
+      workers: the number of worker processes; None uses one per CPU, 1
+        pairs in this process
+
+    Returns:
+      {tournament: pairs}, the pairs like those of swissPairings
+
+    Raises ValueError, and stores no round, if a tournament cannot be paired
+    without rematches.
+    """
+    return collections.OrderedDict((tournament, pairs)
+                                   for (tournament, (_, pairs)) in _pairRounds(tournaments, workers).items())
+
+
+def currentRound(tournament):
+    """Returns the round being played in a tournament.
+
+    The round is paired (like pairAllTournaments) and stored when it is
+    first asked for; every later call, from any client, gets the stored
+    pairs until all of them are reported.  Only the pairs of the round can
+    be reported then, see reportMatch.
+
+    Returns:
+      (round, pairs), round the number of the round (from 1) and pairs like
+      those of swissPairings; (None, []) if there is nobody to pair
+    """
+    return _pairRounds([tournament], 1)[int(tournament)]
+
+
+PAIRS_QUERY = """
+    select pairings.tournament, pairings.round, pairings.player1, p1.name, pairings.player2, p2.name
+    from pairings
+        join tournament_players as tp1 on pairings.tournament = tp1.tournament and pairings.player1 = tp1.id
+        join players as p1 on tp1.player = p1.id
+        left join tournament_players as tp2 on pairings.tournament = tp2.tournament and pairings.player2 = tp2.id
+        left join players as p2 on tp2.player = p2.id
+    where {where}
+    order by pairings.tournament, pairings.board
+"""
+
+TOURNAMENT_PAIRINGS_QUERY = PAIRS_QUERY.format(where='pairings.tournament = %s and pairings.round = %s')
+
+# every stored round of a tournament, see _storedRounds(..., by_round=True)
+TOURNAMENT_ROUNDS_QUERY = PAIRS_QUERY.format(where='pairings.tournament = %s')
+
+# the open round of a tournament is its last round with unreported pairings
+OPEN_ROUNDS_QUERY = PAIRS_QUERY.format(where="""(pairings.tournament, pairings.round) in (
+        select tournament, max(round) from pairings
+        where tournament = any(%s::integer[]) and not reported
+        group by tournament)""")
+
+
+def _storedRounds(rows, by_round=False):
+    """Turns rows of PAIRS_QUERY into {tournament: (round, pairs)}, 'bye'
+    for no player2; by_round=True keys them by round instead, for rows of
+    one tournament."""
+    rounds = collections.OrderedDict()
+    for (tournament, round, id1, name1, id2, name2) in rows:
+        pair = (id1, name1, 'bye', 'bye') if id2 is None else (id1, name1, id2, name2)
+        rounds.setdefault(round if by_round else tournament, (round, []))[1].append(pair)
+    return rounds
+
+
+@connect_db
+def _openRounds(tournaments, c=None):
+    """Returns {tournament: (round, pairs)} of the tournaments with an open round."""
+    c.execute(OPEN_ROUNDS_QUERY, (list(tournaments), ))
+    return _storedRounds(c.fetchall())
+
+
+# every pairing not reported yet is one of the open round
+UNREPORTED_PAIRINGS_QUERY = PAIRS_QUERY.format(where='pairings.tournament = %s and not pairings.reported')
+
+
+@connect_db
+def openRound(tournament, c=None):
+    """Returns the round being played in a tournament, if there is one.
+
+    Unlike currentRound it never pairs a round.
+
+    Returns:
+      (round, pairs), the pairs of the round that are not reported yet, like
+      those of swissPairings; (None, []) if no round is open
+    """
+    c.execute(UNREPORTED_PAIRINGS_QUERY, (tournament, ))
+    return _storedRounds(c.fetchall()).get(int(tournament), (None, []))
+
+
+_prepareQuery('last_round', "select max(round) from pairings where tournament = %s")
+_prepareQuery('tournament_pairings', TOURNAMENT_PAIRINGS_QUERY)
+
+
+@read_db
+def tournamentPairings(tournament, round=None, c=None):
+    """Returns the stored pairs of a round of a tournament, the last one by
+    default, like those of swissPairings; [] if there is no such round."""
+    if round is None:
+        _executePrepared(c, 'last_round', (tournament, ))
+        round = c.fetchone()[0]
+    _executePrepared(c, 'tournament_pairings', (tournament, round))
+    return _storedRounds(c.fetchall()).get(int(tournament), (round, []))[1]
+
+
+# Streaming exports.  The functions below return generators that read their
+# rows through a server side cursor, fetch_size rows per round trip, so an
+# export of a huge tournament needs memory for one batch only (the cached and
+# list returning functions above hold every row, twice).  Each export reads
+# one consistent snapshot on a connection of its own, and holds that
+# connection until the generator is exhausted or closed.
+#
+# output selects what the generators yield:
+#   'rows': the tuples of the corresponding list returning function
+#   'csv': text lines of CSV, a header line first
+#   'json': text lines of JSON objects (JSON lines), keyed by column name
+
+STANDINGS_COLUMNS = ('id', 'name', 'wins', 'matches')
+PAIRINGS_COLUMNS = ('id1', 'name1', 'id2', 'name2')
+HISTORY_COLUMNS = ('result', 'player1', 'player2')
+
+
+def streamStandings(tournament, with_bye=False, output='rows', fetch_size=STREAM_FETCH_SIZE):
+    """Streams the standings of a tournament, see tournamentPlayerStandings.
+
+    Not cached: every call reads the database.
+    """
+    columns = STANDINGS_COLUMNS + (('had_bye', ) if with_bye else ())
+    return _output(_streamStandings(tournament, with_bye, fetch_size), columns, output)
+
+
+def _streamStandings(tournament, with_bye, fetch_size):
+    if _backend is not None:
+        for row in _backend.tournamentPlayerStandings(int(tournament), with_bye):
+            yield row
+        return
+    with _snapshot() as db:
+        for row in _standingsRows(db, tournament, fetch_size):
+            yield row if with_bye else row[:4]
+
+
+def streamPairings(tournament, output='rows', fetch_size=STREAM_FETCH_SIZE):
+    """Streams the pairs of the next round, the same as swissPairings."""
+    return _output(_streamPairings(tournament, fetch_size), PAIRINGS_COLUMNS, output)
+
+
+def _streamPairings(tournament, fetch_size):
+    if _backend is not None:
+        for pair in pairStandings(_backend.tournamentPlayerStandings(int(tournament), with_bye=True)):
+            yield pair
+        return
+    with _snapshot() as db:
+        c = db.cursor()
+        c.execute(SEATING_QUERY, {'tournament': tournament})
+        count = _checkSeating(*c.fetchone())
+        c.close()
+        seating = _Seating(count % 2 != 0)
+        for row in _standingsRows(db, tournament, fetch_size):
+            for pair in seating.seat(row):
+                yield pair
+
+
+def _standingsRows(db, tournament, fetch_size):
+    """Yields the rows of tournamentPlayerStandings(..., with_bye=True) in
+    the snapshot db.
+
+    They come through a server side cursor, unless the tournament has other
+    than the default tiebreaks: those rank all rows in memory.
+    """
+    query = STANDINGS_QUERY.format(extra=', standings.had_bye')
+    c = db.cursor()
+    c.execute("select tiebreaks from tournaments where id = %s", (tournament, ))
+    row = c.fetchone()
+    if not (row and row[0]):
+        c.close()
+        for row in _serverRows(db, query, {'tournament': tournament}, fetch_size):
+            yield row
+        return
+    c.execute(query, {'tournament': tournament})
+    rows = c.fetchall()
+    c.execute(RESULTS_LOG_QUERY, (tournament, ))
+    rows = tiebreaks.rankStandings(rows, c.fetchall(), row[0])
+    c.close()
+    for row in rows:
+        yield row
+
+
+# players, and players without a bye yet, of a tournament
+SEATING_QUERY = """select count(*), count(*) filter (where not had_bye)
+                   from (""" + RECORDS_QUERY + """) as records"""
+
+
+def _checkSeating(count, without_bye):
+    if count % 2 != 0 and not without_bye:
+        raise ValueError("Unable to setup bye match, every players already had bye match")
+    return count
+
+
+class _Seating(object):
+    """Pairs neighbours like pairStandings, one standings row at a time.
+
+    With odd=True the bye is seated right below the first player who has not
+    had one.
+    """
+
+    def __init__(self, odd):
+        self.odd = odd
+        self.waiting = None
+
+    def seat(self, row):
+        """Seats the player of a (id, name, wins, matches, had_bye) row and
+        returns the pairs that completes, if any."""
+        pairs = list()
+        seats = [tuple(row[:2])]
+        if self.odd and row[4] is False:
+            seats.append(('bye', 'bye'))
+            self.odd = False
+        for seat in seats:
+            if self.waiting is None:
+                self.waiting = seat
+            else:
+                pairs.append(self.waiting + seat)
+                self.waiting = None
+        return pairs
+
+
+def streamHistory(tournament, output='rows', fetch_size=STREAM_FETCH_SIZE):
+    """Streams the results of a tournament in the order they were reported.
+
+    The rows are the results of tournamentHistory; in CSV and JSON a bye has
+    no player2.
+    """
+    return _output(_streamHistory(tournament, fetch_size), HISTORY_COLUMNS, output)
+
+
+def _streamHistory(tournament, fetch_size):
+    if _backend is not None:
+        for result in _backend.tournamentHistory(tournament)[1]:
+            yield result
+        return
+    with _snapshot() as db:
+        query = "select winner, loser, p1, p2 from matches where tournament = %s order by id"
+        for row in _serverRows(db, query, (tournament, ), fetch_size):
+            yield _historyResult(row)
+
+
+@contextlib.contextmanager
+def _snapshot():
+    """A dedicated connection in a read only, repeatable read transaction."""
+    with getPool().dedicated() as db:
+        c = db.cursor()
+        c.execute("set transaction isolation level repeatable read, read only")
+        c.close()
+        yield db
+        db.rollback()
+
+
+def _serverRows(db, query, params, fetch_size):
+    """Yields the rows of query through a server side cursor."""
+    cursor = db.cursor('stream_export')
+    cursor.itersize = fetch_size
+    try:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+OUTPUTS = ('rows', 'csv', 'json')
+
+
+def _output(rows, columns, output):
+    _checkOutput(output)
+    if output == 'rows':
+        return rows
+    return _lines(rows, columns, output)
+
+
+def _checkOutput(output):
+    if output not in OUTPUTS:
+        raise ValueError("unknown output {0!r}, expected 'rows', 'csv' or 'json'".format(output))
+
+
+def _lines(rows, columns, output):
+    if output == 'csv':
+        yield _csvLine(columns)
+    for row in rows:
+        yield _line(row, columns, output)
+
+
+def _line(row, columns, output):
+    """Formats a row as a line of CSV or JSON; a short row (a bye) is padded with None."""
+    row = tuple(row) + (None, ) * (len(columns) - len(row))
+    if output == 'csv':
+        return _csvLine(row)
+    return json.dumps(collections.OrderedDict(zip(columns, row))) + '\n'
+
+
+class _Written(list):
+    """A file for csv.writer that keeps what was written."""
+
+    write = list.append
+
+
+def _csvLine(row):
+    written = _Written()
+    csv.writer(written, lineterminator='\n').writerow(row)
+    return ''.join(written)
+
+
+configureBackend(os.environ.get('TOURNAMENT_BACKEND'))
@@ -2,9 +2,36 @@
 #
 # Test cases for tournament.py
 
+import functools
+import json
+import random
+import resource
+import StringIO
+import threading
+import time
+import warnings
+
+import psycopg2.extensions
+
+import columnar
+import metrics
+import simulator
+import tiebreaks
+from state import TournamentState
 from tournament import *
 
 
+def postgresqlOnly(test):
+    """Skips a test of PostgreSQL itself (pool, plans, SQL) on other backends."""
+    @functools.wraps(test)
+    def run():
+        if getBackend() is not None:
+            print "   skipped {0}, it needs the PostgreSQL backend".format(test.__name__)
+            return
+        test()
+    return run
+
+
 def verifyStandings(correct_pairs, tournament):
     """helper methods"""
     pairings = swissPairings(tournament)
@@ -333,6 +360,1138 @@ def testForOddPlayersTournament():
     print "12. with odd number of players, bye match is added"
 
 
+@postgresqlOnly
+def testConnectionPool():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    db_pool = configurePool(size=2, timeout=10)
+    threads = [threading.Thread(target=registerPlayer, args=("Player {0}".format(x),))
+               for x in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    c = countPlayers()
+    if c != 10:
+        raise ValueError("After ten concurrent registrations, countPlayers should be 10.")
+    if len(db_pool._idle) > 2:
+        raise ValueError("Connection pool should never open more than its size.")
+    configurePool()
+    print "13. Players can be registered concurrently through a pool of two connections"
+
+
+def testReportRound():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Round Robin Hood')
+    for name in ("A", "B", "C", "D", "E"):
+        registerTournamentPlayer(registerPlayer(name), t1)
+    standings = tournamentPlayerStandings(t1)
+    [id1, id2, id3, id4, id5] = [row[0] for row in standings]
+    reportRound(t1, [('win', id1, id2), ('tie', id3, id4), ('bye', id5)])
+    standings = tournamentPlayerStandings(t1, with_bye=True)
+    records = dict((i, (w, m, b)) for (i, n, w, m, b) in standings)
+    expected = {id1: (1, 1, False), id2: (0, 1, False), id3: (0, 1, False),
+                id4: (0, 1, False), id5: (1, 1, True)}
+    if records != expected:
+        raise ValueError("reportRound should record every result of the round.")
+    try:
+        reportRound(t1, [('win', id1, id3), ('win', id2, 'no-such-player')])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("reportRound should reject players not in the tournament.")
+    standings = tournamentPlayerStandings(t1, with_bye=True)
+    if dict((i, (w, m, b)) for (i, n, w, m, b) in standings) != expected:
+        raise ValueError("A rejected round should not record any of its results.")
+    print "14. A whole round can be reported at once, and a bad round changes nothing"
+
+
+@postgresqlOnly
+def testStandingsMatchTiebreakFunction():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    rng = random.Random(42)
+    t1 = registerTournament('Tiebreak Invitational')
+    for x in range(16):
+        registerTournamentPlayer(registerPlayer("Player {0}".format(x)), t1)
+    db = connect()
+    c = db.cursor()
+    for round_number in range(4):
+        results = list()
+        for (id1, name1, id2, name2) in swissPairings(t1):
+            outcome = rng.random()
+            if outcome < 0.2:
+                results.append(('tie', id1, id2))
+            elif outcome < 0.6:
+                results.append(('win', id1, id2))
+            else:
+                results.append(('win', id2, id1))
+        reportRound(t1, results)
+        # opponent_match_wins() reads the rolled up counters
+        rollupStandings(t1)
+        c.execute("""
+            select tournament_players.id, players.name, tournament_players.wins, tournament_players.matches
+            from tournament_players join players on tournament_players.player = players.id
+            where tournament_players.tournament = %s
+            order by wins desc, opponent_match_wins(tournament_players.id) desc, tournament_players.id
+        """, (t1, ))
+        if c.fetchall() != tournamentPlayerStandings(t1):
+            raise ValueError("Standings should be ordered exactly like opponent_match_wins() orders them.")
+    db.close()
+    print "15. Standings are broken by opponent match wins, like opponent_match_wins()"
+
+
+def seqScans(plan):
+    """Returns the names of the relations a query plan reads with a sequential scan."""
+    found = list()
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found.extend(seqScans(child))
+    return found
+
+
+def indexScans(plan):
+    """Returns the names of the indexes a query plan reads."""
+    found = list()
+    if 'Index Name' in plan:
+        found.append(plan['Index Name'])
+    for child in plan.get('Plans', []):
+        found.extend(indexScans(child))
+    return found
+
+
+@postgresqlOnly
+def testQueryPlans():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    db = connect()
+    c = db.cursor()
+    # 300 tournaments of 100 players with 200 matches each, plus players who
+    # are not in any tournament
+    c.execute("""
+        insert into players (name) select 'Player ' || x from generate_series(1, 60000) as x;
+        insert into tournaments (name) select 'Tournament ' || x from generate_series(1, 300) as x;
+        with
+            t as (select id, row_number() over (order by id) - 1 as n from tournaments),
+            p as (select id, row_number() over (order by id) - 1 as n from players)
+        insert into tournament_players (player, tournament)
+            select p.id, t.id from p join t on p.n % 600 = t.n;
+        with tp as (
+            select id, tournament, row_number() over (partition by tournament order by id) as n
+            from tournament_players)
+        insert into matches (tournament, winner, loser)
+            select a.tournament, a.id, b.id
+            from tp as a join tp as b on a.tournament = b.tournament and b.n = a.n + 1, generate_series(1, 4)
+            where a.n % 2 = 1;
+        insert into opponents (tournament, player, opponent)
+            select tournament, winner, loser from matches
+            union
+            select tournament, loser, winner from matches;
+    """)
+    db.commit()
+    db.autocommit = True
+    c.execute("vacuum analyze")
+    c.execute("select max(id) from tournaments")
+    tournament = c.fetchone()[0]
+    c.execute("select min(id) from tournament_players where tournament = %s", (tournament, ))
+    player = c.fetchone()[0]
+    # deleting the matches or players of a tournament truncates or drops its
+    # partitions, which hold nothing else, so they can be read whole too
+    hot_queries = [
+        STANDINGS_QUERY.format(extra=''),
+        STANDINGS_QUERY.format(extra=', standings.had_bye'),
+        "select count(*) from tournament_players where tournament = %(tournament)s",
+    ]
+    partitions = ['{0}_{1}'.format(table, tournament) for table in ('matches', 'tournament_players')]
+    for query in hot_queries:
+        c.execute("explain (format json) " + query, {'tournament': tournament})
+        scanned = [name for name in seqScans(c.fetchone()[0][0]['Plan']) if name not in partitions]
+        if scanned:
+            raise ValueError("Hot query scans {0} sequentially:{1}".format(', '.join(scanned), query))
+    # opponent and rematch lookups: who played whom in a tournament, whom one
+    # player met, and in the match log whom one player beat, lost to or tied
+    # with (on every partition, through its copy of the 0002 index)
+    lookups = [
+        (OPPONENTS_QUERY, 'opponents_tournament'),
+        ("select opponent from opponents where player = %(player)s", 'opponents_pkey'),
+        ("select loser from matches where winner = %(player)s", '_winner_loser_idx'),
+        ("select winner from matches where loser = %(player)s", '_loser_winner_idx'),
+        ("select p2 from matches where p1 = %(player)s", '_p1_p2_idx'),
+        ("select p1 from matches where p2 = %(player)s", '_p2_p1_idx'),
+    ]
+    for query, index in lookups:
+        c.execute("explain (format json) " + query, {'tournament': tournament, 'player': player})
+        plan = c.fetchone()[0][0]['Plan']
+        indexes = indexScans(plan)
+        if seqScans(plan) or not indexes or [name for name in indexes if not name.endswith(index)]:
+            raise ValueError("Lookup should only read the index {0}:{1}".format(index, query))
+    db.close()
+    print "16. Hot queries and opponent lookups use indexes instead of sequential scans on a large fixture"
+
+
+def testLegacyTournamentPlayerIds():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Old Timers')
+    p1 = registerPlayer("Legacy One")
+    p2 = registerPlayer("Legacy Two")
+    id1 = registerTournamentPlayer(p1, t1)
+    id2 = registerTournamentPlayer(p2, t1)
+    if not isinstance(id1, int):
+        raise TypeError("registerTournamentPlayer should return an integer id.")
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        reportMatch(t1, "{0}-{1}".format(t1, p1), "{0}-{1}".format(t1, p2))
+    if not any(issubclass(w.category, DeprecationWarning) for w in caught):
+        raise ValueError("Legacy tournament player ids should raise a DeprecationWarning.")
+    standings = tournamentPlayerStandings(t1)
+    if [(i, w, m) for (i, n, w, m) in standings] != [(id1, 1, 1), (id2, 0, 1)]:
+        raise ValueError("Legacy tournament player ids should report the same match as integer ids.")
+    try:
+        registerTournamentPlayer(p1, t1)
+    except psycopg2.IntegrityError:
+        pass
+    else:
+        raise ValueError("A player should not be registered twice in one tournament.")
+    print "17. Tournament players have integer ids, legacy ids still work"
+
+
+def testTournamentStateRecovery():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    rng = random.Random(7)
+    t1 = registerTournament('Live Event')
+    for x in range(9):
+        registerTournamentPlayer(registerPlayer("Player {0}".format(x)), t1)
+
+    def play(state):
+        results = list()
+        for (id1, name1, id2, name2) in state.swissPairings():
+            if 'bye' in (id1, id2):
+                results.append(('bye', id2 if id1 == 'bye' else id1))
+            elif rng.random() < 0.2:
+                results.append(('tie', id1, id2))
+            else:
+                results.append(('win', id1, id2) if rng.random() < 0.5 else ('win', id2, id1))
+        state.reportRound(results)
+
+    live = TournamentState.load(t1, flush_interval=0.05)
+    for round_number in range(4):
+        play(live)
+    live.close()
+    if live.standings(with_bye=True) != tournamentPlayerStandings(t1, with_bye=True):
+        raise ValueError("In-memory standings should match the database after a flush.")
+    if getBackend() is None:
+        # lose the counters, as if the process died between writes
+        db = connect()
+        c = db.cursor()
+        c.execute("update tournament_players set wins = 0, matches = 0, had_bye = FALSE where tournament = %s",
+                  (t1, ))
+        db.commit()
+        db.close()
+    recovered = TournamentState.load(t1, write_behind=False)
+    if recovered.standings(with_bye=True) != live.standings(with_bye=True):
+        raise ValueError("A tournament state should be rebuilt from the matches alone.")
+    if recovered.swissPairings() != live.swissPairings():
+        raise ValueError("A rebuilt tournament state should pair like the original one.")
+    setTiebreaks(t1, ['buchholz', 'omw'])
+    ranked = TournamentState.load(t1, flush_interval=0.05)
+    if ranked.standings(with_bye=True) != tournamentPlayerStandings(t1, with_bye=True):
+        raise ValueError("A tournament state should rank by the tiebreaks of the tournament.")
+    play(ranked)
+    ranked.close()
+    if ranked.standings(with_bye=True) != tournamentPlayerStandings(t1, with_bye=True) or \
+            ranked.swissPairings() != swissPairings(t1, avoid_rematches=True):
+        raise ValueError("A tournament state should rank and pair new results by the tiebreaks too.")
+    # results the database would refuse are refused before they count
+    stale = TournamentState.load(t1, write_behind=False)
+    (a, _, b, _), (c, _, d, _) = [pair for pair in stale.swissPairings() if 'bye' not in pair][:2]
+    try:
+        stale.reportRound([('win', a, b), ('tie', a, c)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A tournament state should refuse a round naming a player twice.")
+    if stale.standings(with_bye=True) != tournamentPlayerStandings(t1, with_bye=True) or stale.log != ranked.log:
+        raise ValueError("A refused round should not change the tournament state.")
+    # a round paired by another client is served by newly loaded states
+    round_number, stored = currentRound(t1)
+    opened = TournamentState.load(t1, write_behind=False)
+    if opened.swissPairings() != stored:
+        raise ValueError("A tournament state should serve the stored open round.")
+    (a, _, b, _), (c, _, d, _) = [pair for pair in stored if 'bye' not in pair][:2]
+    try:
+        opened.reportRound([('win', a, c)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A tournament state should refuse results outside the open round.")
+    opened.reportRound([('win', a, b)])
+    if [pair[0] for pair in opened.swissPairings()] != [pair[0] for pair in stored if pair[0] != a]:
+        raise ValueError("A tournament state should only serve the unreported pairs of the open round.")
+    opened.close()
+    # the state loaded before the round was paired lets such results through,
+    # the database refuses them for good: they are parked, not retried
+    stale.reportRound([('win', c, a)])
+    try:
+        stale.flush()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A refused batch should be raised to the caller.")
+    if stale.rejected != [([('win', c, a)], stale.last_error)]:
+        raise ValueError("A refused batch should be parked in rejected.")
+    stale.reportRound([('win', c, d)])
+    stale.flush()
+    if [pair for pair in openRound(t1)[1] if c in (pair[0], pair[2])]:
+        raise ValueError("Results queued after a refused batch should still be written.")
+    stale.close()
+    # a batch the background writer had refused is raised by the next call
+    behind = TournamentState.load(t1, flush_interval=0.01, open_round=(None, []))
+    behind.reportRound([('win', d, c)])
+    for attempt in range(200):
+        if behind.rejected:
+            break
+        time.sleep(0.01)
+    try:
+        behind.close()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A batch refused behind the caller should be raised by the next call.")
+    print "18. A tournament state can be rebuilt from the matches after a crash"
+
+
+@postgresqlOnly
+def testStandingsCache():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    configureStandingsCache(2)
+    t1 = registerTournament('Cached Open')
+    ids = [registerTournamentPlayer(registerPlayer("Player {0}".format(x)), t1) for x in range(3)]
+    standings = tournamentPlayerStandings(t1)
+    standings.pop()
+    if standingsCacheStats()['misses'] != 1 or len(tournamentPlayerStandings(t1)) != 3:
+        raise ValueError("Standings should be cached, and callers should get their own copy.")
+    if standingsCacheStats()['hits'] != 1:
+        raise ValueError("A second read of unchanged standings should hit the cache.")
+    reportMatch(t1, ids[2], ids[0])
+    if tournamentPlayerStandings(t1)[0][0] != ids[2]:
+        raise ValueError("reportMatch should invalidate the cached standings.")
+    reportTiedMatch(t1, ids[0], ids[1])
+    if [m for (i, n, w, m) in tournamentPlayerStandings(t1)] != [1, 2, 1]:
+        raise ValueError("reportTiedMatch should invalidate the cached standings.")
+    reportByeMatch(ids[1])
+    if (ids[1], "Player 1", 1, 2, True) not in tournamentPlayerStandings(t1, with_bye=True):
+        raise ValueError("reportByeMatch should invalidate the cached standings.")
+    reportRound(t1, [('win', ids[0], ids[1])])
+    if tournamentPlayerStandings(t1)[0][0] != ids[0]:
+        raise ValueError("reportRound should invalidate the cached standings.")
+    for x in range(2):
+        tournamentPlayerStandings(registerTournament("Other {0}".format(x)))
+    stats = standingsCacheStats()
+    if stats['size'] != 2 or stats['evictions'] != 1:
+        raise ValueError("The least recently used standings should be evicted.")
+    deleteMatches(t1)
+    deleteTournamentPlayers(t1)
+    if tournamentPlayerStandings(t1) != []:
+        raise ValueError("Deleting tournament players should invalidate the cached standings.")
+    standings_cache = configureStandingsCache()
+    generation = standings_cache.generation(t1)
+    standings_cache.invalidate(t1 + 1)
+    standings_cache.put(t1, (), generation)
+    if standings_cache.get(t1) != ():
+        raise ValueError("A change of another tournament should not keep standings out of the cache.")
+    for key in (t1, None):
+        generation = standings_cache.generation(t1)
+        standings_cache.invalidate(key)
+        standings_cache.put(t1, (), generation)
+        if standings_cache.get(t1) is not None:
+            raise ValueError("Standings read before their tournament changed should not be cached.")
+    configureStandingsCache()
+    print "19. Standings are cached until results change them"
+
+
+def testBulkRegistration():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    names = ["Entrant {0}".format(x) for x in range(100000)]
+    names[1] = "Tab\tSlash\\ New\nline"
+    ids = bulkRegisterPlayers(iter(names))
+    if len(ids) != 100000 or countPlayers() != 100000:
+        raise ValueError("bulkRegisterPlayers should register every name.")
+    if getBackend() is None:
+        db = connect()
+        c = db.cursor()
+        c.execute("select id, name from players where id in %s", (tuple(ids[:3] + ids[-3:]), ))
+        found = dict(c.fetchall())
+        db.close()
+        if [found[i] for i in ids[:3] + ids[-3:]] != names[:3] + names[-3:]:
+            raise ValueError("bulkRegisterPlayers should return the ids in input order.")
+    from_file = bulkRegisterPlayers(StringIO.StringIO("Late One\n\nLate Two\n"))
+    if len(from_file) != 2:
+        raise ValueError("bulkRegisterPlayers should read one name per line of a file.")
+    t1 = registerTournament('Bulk Open')
+    early = registerTournamentPlayer(ids[5], t1)
+    roster = ids + [ids[7]]
+    tp_ids = bulkRegisterTournamentPlayers(t1, roster)
+    if len(tp_ids) != len(roster) or countTournamentPlayers(t1) != 100000:
+        raise ValueError("bulkRegisterTournamentPlayers should register every player once.")
+    if tp_ids[5] != early or tp_ids[7] != tp_ids[-1]:
+        raise ValueError("Duplicate players should get the id of their existing registration.")
+    standings = dict((i, n) for (i, n, w, m) in tournamentPlayerStandings(t1))
+    if standings[tp_ids[1]] != names[1] or standings[tp_ids[99999]] != names[99999]:
+        raise ValueError("bulkRegisterTournamentPlayers should return the ids in input order.")
+    try:
+        bulkRegisterTournamentPlayers(t1, from_file + [ids[0]], ignore_duplicates=False)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("ignore_duplicates=False should reject players already registered.")
+    if countTournamentPlayers(t1) != 100000:
+        raise ValueError("A rejected import should not register anyone.")
+    print "20. Players and rosters can be imported in bulk with COPY"
+
+
+def testSimulator():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    configurePool(connection_factory=simulator.CountingConnection)
+    try:
+        run = simulator.simulate(9, tournaments=3, results='elo', report='match')
+    finally:
+        configurePool()
+    operations = run['operations']
+    if run['rounds'] != 4 or operations['swissPairings']['calls'] != 12:
+        raise ValueError("The simulator should play every round of every tournament.")
+    if operations['reportByeMatch']['calls'] != 12:
+        raise ValueError("The simulator should report one bye per round of an odd field.")
+    if getBackend() is None and operations['registerTournament']['round_trips_per_call'] != 2:
+        raise ValueError("registerTournament should take one insert and one commit.")
+    for name, stats in operations.items():
+        if not 0 <= stats['p50_ms'] <= stats['p99_ms'] <= stats['max_ms']:
+            raise ValueError("Latency percentiles of {0} are out of order.".format(name))
+    print "21. The simulator plays whole tournaments and counts round trips"
+
+
+@postgresqlOnly
+def testMemoryBackend():
+    played = list()
+    for backend in ('postgresql', 'memory'):
+        configureBackend(backend)
+        deleteMatches()
+        deletePlayers()
+        deleteTournamentPlayers()
+        deleteTournaments()
+        t1 = registerTournament('Backend Cup')
+        ids = bulkRegisterTournamentPlayers(t1, bulkRegisterPlayers("Player {0}".format(x) for x in range(11)))
+        rng = random.Random(12)
+        for round_number in range(4):
+            results = list()
+            for (id1, name1, id2, name2) in swissPairings(t1):
+                if 'bye' in (id1, id2):
+                    results.append(('bye', id2 if id1 == 'bye' else id1))
+                elif rng.random() < 0.2:
+                    results.append(('tie', id1, id2))
+                else:
+                    results.append(('win', id1, id2) if rng.random() < 0.5 else ('win', id2, id1))
+            reportRound(t1, results)
+        standings = [(ids.index(i), n, w, m, b) for (i, n, w, m, b) in tournamentPlayerStandings(t1, with_bye=True)]
+        played.append(standings)
+    configureBackend()
+    if played[0] != played[1]:
+        raise ValueError("The memory backend should play a tournament exactly like PostgreSQL.")
+    print "22. The memory backend plays a tournament exactly like PostgreSQL"
+
+
+def testTournamentOpponents():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Graph Open')
+    t2 = registerTournament('Graph Closed')
+    [id1, id2, id3, id4, id5] = [registerTournamentPlayer(registerPlayer(name), t1)
+                                 for name in ("A", "B", "C", "D", "E")]
+    other1, other2 = [registerTournamentPlayer(registerPlayer(name), t2) for name in ("F", "G")]
+    reportMatch(t1, id1, id2)
+    reportMatch(t1, id2, id1)
+    reportTiedMatch(t1, id3, id4)
+    reportByeMatch(id5)
+    reportRound(t1, [('win', id1, id3), ('tie', id2, id4), ('bye', id5)])
+    reportMatch(t2, other1, other2)
+    expected = {id1: set([id2, id3]), id2: set([id1, id4]), id3: set([id4, id1]), id4: set([id3, id2])}
+    if tournamentOpponents(t1) != expected:
+        raise ValueError("tournamentOpponents should list everyone each player played, byes excluded.")
+    deleteMatches(t1)
+    if tournamentOpponents(t1) != {} or tournamentOpponents(t2) != {other1: set([other2]), other2: set([other1])}:
+        raise ValueError("Deleting the matches of a tournament should only clear its opponents.")
+    print "23. Opponents are recorded per tournament with every match"
+
+
+def testColumnarStandings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    rng = random.Random(14)
+    t1 = registerTournament('Columnar Open')
+    bulkRegisterTournamentPlayers(t1, bulkRegisterPlayers("Player {0}".format(x) for x in range(25)))
+    for round_number in range(4):
+        results = list()
+        for (id1, name1, id2, name2) in swissPairings(t1):
+            if 'bye' in (id1, id2):
+                results.append(('bye', id2 if id1 == 'bye' else id1))
+            else:
+                results.append(('win', id1, id2) if rng.random() < 0.5 else ('win', id2, id1))
+        reportRound(t1, results)
+    numpy = columnar.numpy
+    try:
+        # the NumPy columns if NumPy is installed, then the array.array ones
+        for columnar.numpy in (numpy, None):
+            standings = columnarStandings(t1)
+            if list(standings) != tournamentPlayerStandings(t1) or \
+                    list(standings.rows(with_bye=True)) != tournamentPlayerStandings(t1, with_bye=True):
+                raise ValueError("Columnar standings should yield the same rows as tournamentPlayerStandings.")
+            if standings.pairs() != swissPairings(t1) or swissPairings(t1, use_columnar=True) != swissPairings(t1):
+                raise ValueError("Columnar standings should pair like swissPairings.")
+            groups = standings.scoreGroups()
+            if [wins for wins, group in groups] != sorted(set(w for (i, n, w, m) in standings), reverse=True) or \
+                    sum(len(group) for wins, group in groups) != 25 or \
+                    any(set(w for (i, n, w, m) in group) != set([wins]) for wins, group in groups):
+                raise ValueError("Score groups should split the standings by wins.")
+            rows = list(zip(standings.ids, standings.names, standings.wins, standings.matches,
+                            standings.had_bye, standings.tiebreaks))
+            rng.shuffle(rows)
+            if list(columnar.ColumnarStandings.fromRows(rows, ranked=False)) != list(standings):
+                raise ValueError("Sorting the columns should restore the standings order.")
+    finally:
+        columnar.numpy = numpy
+    print "24. Standings can be read into columns, and pair the same"
+
+
+def testStreamingExports():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Export Open')
+    ids = bulkRegisterTournamentPlayers(t1, bulkRegisterPlayers("Player, {0}".format(x) for x in range(7)))
+    reportRound(t1, [('win', ids[0], ids[1]), ('tie', ids[2], ids[3]), ('win', ids[4], ids[5]), ('bye', ids[6])])
+    if list(streamStandings(t1, fetch_size=2)) != tournamentPlayerStandings(t1) or \
+            list(streamStandings(t1, with_bye=True)) != tournamentPlayerStandings(t1, with_bye=True):
+        raise ValueError("streamStandings should yield the rows of tournamentPlayerStandings.")
+    if list(streamPairings(t1, fetch_size=3)) != swissPairings(t1):
+        raise ValueError("streamPairings should yield the pairs of swissPairings.")
+    if list(streamHistory(t1)) != tournamentHistory(t1)[1]:
+        raise ValueError("streamHistory should yield the results of tournamentHistory.")
+    lines = list(streamStandings(t1, output='csv'))
+    if lines[0] != "id,name,wins,matches\n" or len(lines) != 8 or '"Player, 0"' not in lines[1]:
+        raise ValueError("CSV exports should have a header and one quoted line per row.")
+    results = [json.loads(line) for line in streamHistory(t1, output='json')]
+    if results[-1] != {'result': 'bye', 'player1': ids[6], 'player2': None}:
+        raise ValueError("JSON exports should have one object per row.")
+    try:
+        streamHistory(t1, output='xml')
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Unknown export formats should be rejected.")
+    if getBackend() is None:
+        # a million matches between 2000 players, straight in SQL
+        t2 = registerTournament('Export Marathon')
+        first = bulkRegisterTournamentPlayers(t2, bulkRegisterPlayers("Runner {0}".format(x) for x in range(2000)))[0]
+        db = connect()
+        c = db.cursor()
+        c.execute("""
+            insert into matches (tournament, winner, loser)
+                select %(tournament)s, %(first)s + x %% 2000, %(first)s + (x + 1 + x / 2000 %% 1999) %% 2000
+                from generate_series(0, 999999) as x;
+            update tournament_players set wins = results.wins, matches = results.matches
+            from (
+                select player, sum(won) as wins, count(*) as matches
+                from (select winner as player, 1 as won from matches where tournament = %(tournament)s
+                      union all
+                      select loser, 0 from matches where tournament = %(tournament)s) as played
+                group by player
+            ) as results
+            where tournament_players.id = results.player;
+            -- the counters above already hold every match
+            update tournaments set rolled_up_through = (select max(id) from matches where tournament = %(tournament)s)
+            where id = %(tournament)s;
+            analyze matches;
+        """, {'tournament': t2, 'first': first})
+        db.commit()
+        db.close()
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        history = streamHistory(t2, output='csv')
+        next(history)
+        # the export reads a snapshot on its own connection
+        registerTournamentPlayer(registerPlayer("Latecomer"), t2)
+        count = sum(1 for line in history)
+        if count != 1000000:
+            raise ValueError("streamHistory should export every one of the million matches.")
+        if resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss > 50 * 1024:
+            raise ValueError("Streaming a million matches should not hold them all in memory.")
+        if list(streamStandings(t2)) != tournamentPlayerStandings(t2) or \
+                list(streamPairings(t2)) != swissPairings(t2):
+            raise ValueError("Streamed standings and pairings of a large tournament should match.")
+        standings = tournamentPlayerStandings(t2)
+        if sum(row[2] for row in standings) != 1000000 or sum(row[3] for row in standings) != 2000000:
+            raise ValueError("Each of the million matches should count once in the standings.")
+        deleteTournaments(t2)
+    print "25. Standings, pairings and history stream as rows, CSV or JSON lines"
+
+
+def testMetrics():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    registry = configureMetrics(metrics.Registry())
+    try:
+        t1 = registerTournament('Metered Open')
+        ids = [registerTournamentPlayer(registerPlayer(name), t1) for name in ("A", "B", "C", "D")]
+        reportRound(t1, [('win', ids[0], ids[1]), ('win', ids[2], ids[3])])
+        try:
+            reportRound(t1, [('win', ids[0], ids[0])])
+        except ValueError:
+            pass
+        tournamentPlayerStandings(t1)
+        stats = registry.stats()
+        if stats['registerPlayer']['calls'] != 4 or stats['reportRound']['calls'] != 2 or \
+                stats['reportRound']['errors'] != 1:
+            raise ValueError("Every call and every failed call should be counted.")
+        if getBackend() is None:
+            if stats['registerTournament']['statements'] != 1 or stats['registerTournament']['commits'] != 1 or \
+                    stats['_loadStandings']['rows'] != 4:
+                raise ValueError("Statements, commits and rows should be counted per call.")
+            configurePool(enabled=False)
+            opened, closed = registry.connections_opened, registry.connections_closed
+            countPlayers()
+            countPlayers()
+            if (registry.connections_opened - opened, registry.connections_closed - closed) != (2, 2):
+                raise ValueError("Every connection opened and closed should be counted.")
+        if 'tournament_call_seconds_count{function="reportRound"} 2\n' not in registry.prometheusText():
+            raise ValueError("The registry should dump its histograms in the Prometheus format.")
+        pairs, profile = metrics.profileCall(swissPairings, t1)
+        if pairs != swissPairings(t1) or 'pairStandings' not in [name for (_, _, name) in profile.stats]:
+            raise ValueError("profileCall should return the result and the profile of the call.")
+    finally:
+        configureMetrics()
+        configurePool()
+    print "26. API calls can be measured, dumped for Prometheus and profiled"
+
+
+def testConcurrentReporting():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Busy Open')
+    ids = [registerTournamentPlayer(registerPlayer("P{0}".format(x)), t1) for x in range(12)]
+    pairs = [(p1, p2) for (i, p1) in enumerate(ids) for p2 in ids[i + 1:]][:60]
+    rng = random.Random(7)
+    results = [('key-{0}'.format(n), rng.choice(['win', 'tie']), p1, p2) for n, (p1, p2) in enumerate(pairs)]
+    accepted = list()
+    failures = list()
+
+    def report(seed):
+        # every client sends every result, some of them twice, in its own order
+        mine = results + random.Random(seed).sample(results, 20)
+        random.Random(seed).shuffle(mine)
+        try:
+            for key, outcome, p1, p2 in mine:
+                call = reportMatch if outcome == 'win' else reportTiedMatch
+                if call(t1, p1, p2, key=key):
+                    accepted.append(key)
+        except Exception as e:
+            failures.append(e)
+
+    registry = configureMetrics(metrics.Registry())
+    try:
+        threads = [threading.Thread(target=report, args=(seed, )) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = registry.stats()
+    finally:
+        configureMetrics()
+    if failures:
+        raise failures[0]
+    if sorted(accepted) != sorted(key for (key, _, _, _) in results):
+        raise ValueError("Each keyed result should be accepted exactly once.")
+    if sum(stats[name]['errors'] for name in ('reportMatch', 'reportTiedMatch')) != 0:
+        raise ValueError("Reports appending to the match log under a shared lock of their tournament "
+                         "should never deadlock.")
+    wins = dict((player, 0) for player in ids)
+    played = dict((player, 0) for player in ids)
+    for key, outcome, p1, p2 in results:
+        wins[p1] += outcome == 'win'
+        played[p1] += 1
+        played[p2] += 1
+    for (tp_id, name, w, m) in tournamentPlayerStandings(t1):
+        if (w, m) != (wins[tp_id], played[tp_id]):
+            raise ValueError("Concurrent reports should neither lose nor double count results.")
+    if len(tournamentHistory(t1)[1]) != 60:
+        raise ValueError("Each keyed result should be stored as exactly one match.")
+    t2 = registerTournament('Keyed Open')
+    a, b, c = [registerTournamentPlayer(registerPlayer(name), t2) for name in ("A", "B", "C")]
+    if not reportRound(t2, [('win', a, b), ('bye', c)], key='round-1') or \
+            reportRound(t2, [('win', a, b), ('bye', c)], key='round-1') or \
+            not reportByeMatch(a, key='bye-a') or reportByeMatch(a, key='bye-a'):
+        raise ValueError("A report repeating a key should be ignored and return False.")
+    if [row[2:] for row in tournamentPlayerStandings(t2)] != [(2, 2), (1, 1), (0, 1)]:
+        raise ValueError("A repeated report should change nothing.")
+    for key in (None, 'bye-unknown'):
+        try:
+            reportByeMatch(max(a, b, c) + 1000, key=key)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("A bye of an unknown player should raise ValueError, with or without a key.")
+    deleteMatches(t2)
+    if not reportMatch(t2, a, b, key='round-1'):
+        raise ValueError("deleteMatches should forget the keys of the deleted matches.")
+    deleteTournamentPlayers(t2)
+    a, b = [registerTournamentPlayer(registerPlayer(name), t2) for name in ("A2", "B2")]
+    if not reportMatch(t2, a, b, key='round-1'):
+        raise ValueError("deleteTournamentPlayers should forget the keys of the deleted matches.")
+    deletePlayers()
+    a, b = [registerTournamentPlayer(registerPlayer(name), t2) for name in ("A3", "B3")]
+    if not reportMatch(t2, a, b, key='round-1') or len(tournamentHistory(t2)[1]) != 1:
+        raise ValueError("deletePlayers should forget the keys of the deleted matches.")
+    if getBackend() is None:
+        attempts = list()
+
+        @retry_on_conflict
+        @connect_db
+        def flakyCount(c=None):
+            attempts.append(True)
+            if len(attempts) == 1:
+                raise psycopg2.extensions.TransactionRollbackError("deadlock detected")
+            c.execute("select count(*) from result_reports where tournament = %s", (t2, ))
+            return c.fetchone()[0]
+
+        if flakyCount() != 1 or len(attempts) != 2:
+            raise ValueError("A transaction rolled back by a conflict should be retried.")
+    print "27. Concurrent, repeated and retried reports are counted exactly once"
+
+
+def testMatchLog():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Logged Open')
+    ids = [registerTournamentPlayer(registerPlayer("L{0}".format(x)), t1) for x in range(8)]
+    expected = dict((player, [0, 0]) for player in ids)
+
+    def counters():
+        db = connect()
+        c = db.cursor()
+        c.execute("select id, wins, matches from tournament_players where tournament = %s", (t1, ))
+        rows = dict((tp_id, [wins, matches]) for (tp_id, wins, matches) in c.fetchall())
+        db.close()
+        return rows
+
+    def record(results):
+        for result in results:
+            if result[0] == 'bye':
+                expected[result[1]][0] += 1
+                expected[result[1]][1] += 1
+            else:
+                expected[result[1]][0] += result[0] == 'win'
+                expected[result[1]][1] += 1
+                expected[result[2]][1] += 1
+
+    def verify(message):
+        if dict((row[0], list(row[2:])) for row in tournamentPlayerStandings(t1)) != expected:
+            raise ValueError(message)
+
+    first = [('win', ids[0], ids[1]), ('tie', ids[2], ids[3]), ('win', ids[4], ids[5])]
+    reportRound(t1, first)
+    reportMatch(t1, ids[6], ids[7])
+    record(first + [('win', ids[6], ids[7])])
+    verify("Standings should add up the matches reported since the last rollup.")
+    if getBackend() is None:
+        if counters() != dict((player, [0, 0]) for player in ids):
+            raise ValueError("Reports should only append matches, not update the players.")
+        if rollupStandings(t1) != 4 or rollupStandings(t1) != 0 or counters() != expected:
+            raise ValueError("A rollup should fold every new match into the counters, once.")
+    verify("A rollup should not change the standings.")
+    second = [('win', ids[1], ids[2]), ('tie', ids[3], ids[4])]
+    reportResults(t1, second)
+    record(second)
+    verify("Standings should add the matches after a rollup to the counters.")
+    swissPairings(t1)
+    if rollupStandings(t1) != 0:
+        raise ValueError("swissPairings should roll up the round before pairing the next one.")
+
+    # writers keep appending while rollups run
+    pairs = [(p1, p2) for (i, p1) in enumerate(ids) for p2 in ids[i + 1:]]
+    done = threading.Event()
+    failures = list()
+
+    def write(batch):
+        try:
+            for (p1, p2) in batch:
+                reportMatch(t1, p1, p2)
+        except Exception as e:
+            failures.append(e)
+
+    def rollup():
+        try:
+            while not done.is_set():
+                rollupStandings(t1)
+        except Exception as e:
+            failures.append(e)
+
+    writers = [threading.Thread(target=write, args=(pairs[x::4], )) for x in range(4)]
+    roller = threading.Thread(target=rollup)
+    roller.start()
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    roller.join()
+    if failures:
+        raise failures[0]
+    record([('win', p1, p2) for (p1, p2) in pairs])
+    verify("Matches reported during a rollup should be counted exactly once.")
+    rollupStandings(t1)
+    if getBackend() is None and counters() != expected:
+        raise ValueError("Matches reported during a rollup should be folded in by the next one.")
+    deleteMatches(t1)
+    if [row[2:] for row in tournamentPlayerStandings(t1)] != [(0, 0)] * 8:
+        raise ValueError("Deleting the matches should reset the records derived from them.")
+    print "28. Standings are a rollup of the match log plus the matches reported since"
+
+
+def testPairAllTournaments():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    tournaments = list()
+    for (x, size) in enumerate([6, 7, 8]):
+        t = registerTournament("Parallel Open {0}".format(x))
+        for y in range(size):
+            registerTournamentPlayer(registerPlayer("P{0}-{1}".format(x, y)), t)
+        tournaments.append(t)
+    if pairAllTournaments([]) != {} or tournamentPairings(tournaments[0]) != []:
+        raise ValueError("No round should be paired or stored before pairAllTournaments.")
+    played = set()
+    rounds = list()
+    for _ in range(3):
+        expected = dict((t, swissPairings(t, avoid_rematches=True)) for t in tournaments)
+        pairings = pairAllTournaments(tournaments, workers=2)
+        if list(pairings) != tournaments or dict(pairings) != expected:
+            raise ValueError("pairAllTournaments should pair like swissPairings(avoid_rematches=True).")
+        for t in tournaments:
+            if tournamentPairings(t) != pairings[t]:
+                raise ValueError("tournamentPairings should return the last stored round.")
+            results = list()
+            for (id1, _, id2, _) in pairings[t]:
+                if id2 == 'bye':
+                    results.append(('bye', id1))
+                    continue
+                if (id1, id2) in played:
+                    raise ValueError("pairAllTournaments should avoid rematches.")
+                played.update([(id1, id2), (id2, id1)])
+                results.append(('win', id1, id2))
+            reportRound(t, results)
+        rounds.append(pairings)
+    for t in tournaments:
+        if [tournamentPairings(t, round) for round in (1, 2, 3)] != [pairings[t] for pairings in rounds]:
+            raise ValueError("Every paired round should be stored under its number.")
+    if pairAllTournaments(tournaments[:1], workers=1)[tournaments[0]] != tournamentPairings(tournaments[0], 4):
+        raise ValueError("pairAllTournaments should store the round it pairs in this process too.")
+    small = registerTournament("Parallel Open 3")
+    for y in range(4):
+        registerTournamentPlayer(registerPlayer("P3-{0}".format(y)), small)
+    for _ in range(3):
+        reportRound(small, [('win', id1, id2) for (id1, _, id2, _) in pairAllTournaments([small])[small]])
+    try:
+        pairAllTournaments([small] + tournaments[1:], workers=2)
+    except ValueError as error:
+        if str(small) not in str(error):
+            raise ValueError("The error should name the tournament that cannot be paired.")
+    else:
+        raise ValueError("A round that cannot be paired without rematches should raise ValueError.")
+    if tournamentPairings(small, 4) != [] or tournamentPairings(tournaments[1], 4) != []:
+        raise ValueError("No round should be stored when a tournament cannot be paired.")
+    if getBackend() is None:
+        db = connect()
+        c = db.cursor()
+        c.execute("""select count(*) from tournaments where id = any(%s) and
+                     rolled_up_through < (select max(id) from matches where tournament = tournaments.id)""",
+                  (tournaments + [small], ))
+        if c.fetchone()[0] != 0:
+            raise ValueError("pairAllTournaments should roll up every tournament it pairs.")
+        db.close()
+    deleteTournaments(tournaments[0])
+    if tournamentPairings(tournaments[0]) != [] or tournamentPairings(tournaments[1], 3) != rounds[2][tournaments[1]]:
+        raise ValueError("Deleting a tournament should delete its pairings, and only those.")
+    print "29. Many tournaments are paired at once and their rounds stored"
+
+
+def testCurrentRound():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Stored Open')
+    ids = [registerTournamentPlayer(registerPlayer("S{0}".format(x)), t1) for x in range(5)]
+    if currentRound(registerTournament('Empty Open')) != (None, []):
+        raise ValueError("A tournament without players should have no round.")
+    first = currentRound(t1)
+    if first[0] != 1 or len(first[1]) != 3 or currentRound(t1) != first or tournamentPairings(t1) != first[1]:
+        raise ValueError("currentRound should pair the first round once and then serve it.")
+    (a, _, b, _), (c, _, d, _) = [pair for pair in first[1] if pair[2] != 'bye']
+    bye, = [pair[0] for pair in first[1] if pair[2] == 'bye']
+    for report in (lambda: reportMatch(t1, a, c), lambda: reportTiedMatch(t1, a, bye),
+                   lambda: reportByeMatch(a), lambda: reportRound(t1, [('win', a, b), ('win', c, bye)])):
+        try:
+            report()
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Reports should be checked against the pairings of the open round.")
+    if any(row[3] for row in tournamentPlayerStandings(t1)):
+        raise ValueError("A rejected report should record nothing.")
+    reportMatch(t1, b, a)
+    try:
+        reportTiedMatch(t1, a, b)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A pairing should be reported once.")
+    if currentRound(t1) != first:
+        raise ValueError("The round should stay open until every pairing is reported.")
+    reportRound(t1, [('tie', d, c), ('bye', bye)])
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(currentRound(t1))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    second = results[0]
+    if second[0] != 2 or results != [second] * 4 or tournamentPairings(t1, 1) != first[1]:
+        raise ValueError("Concurrent callers should all get the one stored next round.")
+    played = set([(a, b), (c, d)])
+    if any((p[0], p[2]) in played or (p[2], p[0]) in played for p in second[1]):
+        raise ValueError("The next round should avoid rematches.")
+    deleteMatches(t1)
+    if tournamentPairings(t1) != [] or currentRound(t1)[0] != 1:
+        raise ValueError("Deleting the matches should delete the rounds paired from them.")
+    deleteTournamentPlayers(t1)
+    for x in range(4):
+        registerTournamentPlayer(registerPlayer("T{0}".format(x)), t1)
+    if currentRound(t1)[0] != 1:
+        raise ValueError("Deleting the players should delete the rounds paired from them.")
+    deletePlayers()
+    for x in range(4):
+        registerTournamentPlayer(registerPlayer("U{0}".format(x)), t1)
+    if currentRound(t1)[0] != 1:
+        raise ValueError("Deleting the players should delete the rounds paired from them.")
+    deleteTournaments(t1)
+    print "30. Rounds are paired once, stored, and the reports checked against them"
+
+
+def testTiebreaks():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Tiebreak Open')
+    a, b, d, c = [registerTournamentPlayer(registerPlayer(name), t1) for name in ('A', 'B', 'D', 'C')]
+    reportMatch(t1, a, b)
+    reportTiedMatch(t1, c, d)
+    reportMatch(t1, a, c)
+    reportMatch(t1, b, d)
+    columns = tiebreaks.computeTiebreaks([a, b, c, d], [2, 1, 0, 0], [(a, b, None, None), (None, None, c, d),
+                                         (a, c, None, None), (b, d, None, None)], tiebreaks.TIEBREAKS)
+    if columns != [[1, 0, 0, 0], [0.416666667, 0.666666667, 0.666666667, 0.416666667],
+                   [1.5, 2.5, 2.5, 1.5], [1.5, 2.5, 2.5, 1.5], [3.0, 1.0, 1.0, 1.0]]:
+        raise ValueError("Tiebreaks should count ties as half a win and tied opponents as opponents.")
+    if tournamentTiebreaks(t1) != ('opponent_match_wins', ) or \
+            [row[0] for row in tournamentPlayerStandings(t1)] != [a, b, d, c]:
+        raise ValueError("By default ties should be broken by the wins of the opponents a player beat.")
+    for (names, order) in [(['buchholz'], [a, b, c, d]), (['cumulative'], [a, b, d, c]),
+                           (('cumulative', 'omw'), [a, b, c, d])]:
+        setTiebreaks(t1, names)
+        standings = tournamentPlayerStandings(t1)
+        if tournamentTiebreaks(t1) != tuple(names) or [row[0] for row in standings] != order:
+            raise ValueError("Standings should be ranked by the tiebreaks {0}.".format(names))
+        if list(columnarStandings(t1)) != standings or list(columnarStandings(t1).sort()) != standings or \
+                list(streamStandings(t1)) != standings:
+            raise ValueError("Columnar and streamed standings should be ranked by the tiebreaks too.")
+        if swissPairings(t1) != [(p1[0], p1[1], p2[0], p2[1]) for (p1, p2) in zip(standings[0::2], standings[1::2])]:
+            raise ValueError("swissPairings should pair by the tiebreaks of the tournament.")
+    for names in (['bogus'], ['omw', 'median']):
+        try:
+            setTiebreaks(t1, names)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("Unknown tiebreaks should be rejected.")
+    if tournamentTiebreaks(t1) != ('cumulative', 'omw'):
+        raise ValueError("Rejected tiebreaks should change nothing.")
+    setTiebreaks(t1, None)
+    if tournamentTiebreaks(t1) != ('opponent_match_wins', ) or \
+            [row[0] for row in tournamentPlayerStandings(t1)] != [a, b, d, c]:
+        raise ValueError("setTiebreaks(tournament, None) should go back to the default tiebreak.")
+    print "31. Ties are broken by the tiebreaks chosen for the tournament"
+
+
+@postgresqlOnly
+def testReadPath():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    configureStandingsCache(0)
+    read_pool = configureReadPool(size=1)
+    try:
+        t1 = registerTournament('Read Open')
+        ids = [registerTournamentPlayer(registerPlayer(name), t1) for name in ("A", "B", "C", "D")]
+        reportRound(t1, [('win', ids[0], ids[1]), ('win', ids[2], ids[3])])
+        standings = tournamentPlayerStandings(t1)
+        for x in range(3):
+            if tournamentPlayerStandings(t1) != standings or countTournamentPlayers(t1) != 4 or countPlayers() != 4:
+                raise ValueError("The read path should return what it returned before.")
+        with read_pool.dedicated() as db:
+            c = db.cursor()
+            c.execute("select name from pg_prepared_statements")
+            names = set(row[0] for row in c.fetchall())
+            if names != db.prepared or not set(['standings', 'count_players', 'count_tournament_players']) <= names:
+                raise ValueError("Read queries should be prepared once on their connection.")
+            c.execute("show transaction_read_only")
+            if c.fetchone()[0] != 'on' or not db.autocommit:
+                raise ValueError("Read connections should be read only and in autocommit mode.")
+        configureStandingsCache()
+        configureReadPool(dsn=DSN)
+        if tournamentPlayerStandings(t1) != standings or standingsCacheStats()['size'] != 0:
+            raise ValueError("Standings read from a replica should not be cached.")
+        pairs = swissPairings(t1)
+        if standingsCacheStats()['size'] != 1 or tournamentPairings(t1) != [] or len(pairs) != 2:
+            raise ValueError("swissPairings should read the standings it pairs from the primary.")
+    finally:
+        configureReadPool()
+        configureStandingsCache()
+    print "32. Standings, counts and pairings are read through prepared statements"
+
+
+def testArchiveTournament():
+    deleteMatches()
+    deletePlayers()
+    deleteTournamentPlayers()
+    deleteTournaments()
+    t1 = registerTournament('Archived Open')
+    t2 = registerTournament('Kept Open')
+    players = [registerPlayer(name) for name in ("A", "B", "C", "D")]
+    ids = [registerTournamentPlayer(player, t1) for player in players]
+    kept = [registerTournamentPlayer(player, t2) for player in players[:2]]
+    setTiebreaks(t1, ['buchholz'])
+    round, pairs = currentRound(t1)
+    reportRound(t1, [('win', pairs[0][0], pairs[0][2]), ('tie', pairs[1][0], pairs[1][2])])
+    reportMatch(t2, kept[0], kept[1])
+    history = tournamentHistory(t1)
+    out = StringIO.StringIO()
+    tables = archiveTournament(t1, out)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    if lines[0] != {'tournament': t1, 'name': 'Archived Open', 'tiebreaks': ['buchholz']} or \
+            [(line['player'], line['name']) for line in lines[1:5]] != history[0] or \
+            [(line['result'], line['player1'], line['player2']) for line in lines[5:7]] != history[1] or \
+            [(line['id1'], line['id2']) for line in lines[7:]] != [(pair[0], pair[2]) for pair in pairs]:
+        raise ValueError("archiveTournament should export the tournament, its players, results and rounds.")
+    if countTournamentPlayers(t1) != 0 or tournamentPairings(t1, 1) != [] or countTournamentPlayers(t2) != 2 or \
+            [row[:4] for row in tournamentPlayerStandings(t2)] != [(kept[0], 'A', 1, 1), (kept[1], 'B', 0, 1)]:
+        raise ValueError("An archived tournament should be gone, and only that tournament.")
+    try:
+        archiveTournament(t1, StringIO.StringIO())
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Archiving an unknown tournament should raise ValueError.")
+    if getBackend() is None:
+        db = connect()
+        c = db.cursor()
+        if tables != ['archive.matches_{0}'.format(t1), 'archive.tournament_players_{0}'.format(t1)]:
+            raise ValueError("archiveTournament should return the archived tables.")
+        c.execute("select count(*) from {0} union all select count(*) from {1}".format(*tables))
+        if c.fetchall() != [(2, ), (4, )]:
+            raise ValueError("The archived tables should keep the rows of the tournament.")
+        deleteTournaments(t2)
+        c.execute("select relname from pg_class where relname in %s",
+                  (('matches_{0}'.format(t2), 'tournament_players_{0}'.format(t2)), ))
+        if c.fetchall():
+            raise ValueError("Deleting a tournament should drop its partitions.")
+        c.execute("drop table {0}".format(', '.join(tables)))
+        db.commit()
+        t3 = registerTournament('Closed Open')
+        t4 = registerTournament('Busy Open')
+        a, b = [registerTournamentPlayer(player, t3) for player in players[:2]]
+        x, y = [registerTournamentPlayer(player, t4) for player in players[:2]]
+        c.execute("update tournaments set closed = TRUE where id = %s", (t3, ))
+        db.commit()
+        try:
+            reportMatch(t3, a, b)
+        except ValueError:
+            pass
+        else:
+            raise ValueError("A closed tournament should take no reports.")
+        c.execute("update tournaments set closed = FALSE where id = %s", (t3, ))
+        c.execute("select create_missing_partitions(last_value::integer + 1, 1) from tournaments_id_seq")
+        db.commit()
+        # a transaction reading another tournament keeps the archive waiting
+        reader = connect()
+        reader.cursor().execute("select count(*) from matches where tournament = %s", (t4, ))
+        archived = list()
+        thread = threading.Thread(target=lambda: archived.append(archiveTournament(t3, StringIO.StringIO())))
+        thread.start()
+        time.sleep(0.5)
+        c.execute("set lock_timeout = '1s'")
+        try:
+            c.execute("insert into matches (tournament, winner, loser) values (%s, %s, %s)", (t4, x, y))
+            c.execute("select register_tournament('Next Open', 1)")
+            db.commit()
+        except psycopg2.OperationalError:
+            raise ValueError("Archiving a tournament should not block the reports and registrations of others.")
+        finally:
+            reader.close()
+            thread.join()
+        if archived != [['archive.matches_{0}'.format(t3), 'archive.tournament_players_{0}'.format(t3)]]:
+            raise ValueError("The archive should finish once the transactions using the tables do.")
+        c.execute("drop table {0}".format(', '.join(archived[0])))
+        db.commit()
+        db.close()
+    print "33. A finished tournament is exported and its partitions archived"
+
+
 if __name__ == '__main__':
     testDeleteMatches()
     testDelete()
@@ -346,4 +1505,25 @@ if __name__ == '__main__':
     testComplicatedTournament()
     testEvenMatches()
     testForOddPlayersTournament()
+    testConnectionPool()
+    testReportRound()
+    testStandingsMatchTiebreakFunction()
+    testQueryPlans()
+    testLegacyTournamentPlayerIds()
+    testTournamentStateRecovery()
+    testStandingsCache()
+    testBulkRegistration()
+    testSimulator()
+    testMemoryBackend()
+    testTournamentOpponents()
+    testColumnarStandings()
+    testStreamingExports()
+    testMetrics()
+    testConcurrentReporting()
+    testMatchLog()
+    testPairAllTournaments()
+    testCurrentRound()
+    testTiebreaks()
+    testReadPath()
+    testArchiveTournament()
     print "Success!  All tests pass!"